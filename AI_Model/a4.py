@@ -1,5 +1,6 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextStreamer
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from incremental_streamer import IncrementalTextStreamer
 
 class SuperChatbot:
     def __init__(self):
@@ -40,7 +41,7 @@ class SuperChatbot:
         model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
 
         # 实例化流式器，让文字在 CMD 里一个一个蹦出来
-        streamer = TextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        streamer = IncrementalTextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
 
         print("🤖 AI: ", end="", flush=True)
         
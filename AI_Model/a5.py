@@ -1,8 +1,11 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextStreamer
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from incremental_streamer import IncrementalTextStreamer
+from prompt_lookup import PromptLookupDecoder
+from candidate_fork import CandidateGenerator, combine, length_score, repetition_score
 
 class NovelProWriter:
-    def __init__(self):
+    def __init__(self, use_prompt_lookup=False, num_candidates=1, scorer=None):
         # 建议至少使用 1.5B 模型，0.5B 的逻辑链太短，很难写长文不跑题
         self.model_name = "Qwen/Qwen2.5-1.5B-Instruct" 
         print(f"正在加载专业创作引擎: {self.model_name}...")
@@ -24,6 +27,16 @@ class NovelProWriter:
             "4. 如果故事没写完，请在结尾留下伏笔。"
         )
         self.messages = []
+        
+        # 可选：Prompt Lookup 解码，续写时复用上下文里已有的片段，一次前向多出几个 token
+        self.prompt_lookup = PromptLookupDecoder(self.model) if use_prompt_lookup else None
+
+        # 可选：每段同时写 num_candidates 个版本（上下文只 prefill 一次，KV 写时复制共享），由打分器挑最好的
+        self.num_candidates = num_candidates
+        self.candidates = None
+        if num_candidates > 1:
+            scorer = scorer or combine((repetition_score, 0.7), (length_score(600), 0.3))
+            self.candidates = CandidateGenerator(self.model, self.tokenizer, scorer=scorer)
 
     def write_long_chapter(self, prompt, target_length=1500):
         self.messages = [{"role": "system", "content": self.system_prompt}]
@@ -40,21 +53,35 @@ class NovelProWriter:
             # 构建输入
             text = self.tokenizer.apply_chat_template(self.messages, tokenize=False, add_generation_prompt=True)
             model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
-            streamer = TextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
 
-            # 生成这一段
-            generated_ids = self.model.generate(
-                **model_inputs,
-                streamer=streamer,
-                max_new_tokens=800, # 每次生成的中段长度
-                do_sample=True,
-                temperature=0.9,     # 略高一点增加文采
-                top_p=0.95,
-                repetition_penalty=1.15
-            )
+            if self.candidates:
+                # 多路候选：上下文只 prefill 一次，fork 出几份一起写，挑分数最高的一版
+                response_text, candidates = self.candidates.generate(
+                    model_inputs.input_ids[0].tolist(), n=self.num_candidates,
+                    max_new_tokens=800, temperature=0.9, top_p=0.95, repetition_penalty=1.15)
+                print(response_text)
+                scores = ", ".join(f"{c['score']:.2f}" for c in candidates)
+                print(f"\n[{self.num_candidates} 个候选，得分 {scores}，用时 {self.candidates.last_stats['total_seconds']}s]")
+            else:
+                streamer = IncrementalTextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+                # 生成这一段
+                generate = self.prompt_lookup.generate if self.prompt_lookup else self.model.generate
+                generated_ids = generate(
+                    **model_inputs,
+                    streamer=streamer,
+                    max_new_tokens=800, # 每次生成的中段长度
+                    do_sample=True,
+                    temperature=0.9,     # 略高一点增加文采
+                    top_p=0.95,
+                    repetition_penalty=1.15
+                )
+            
+                if self.prompt_lookup:
+                    print(f"\n[{self.prompt_lookup.report()}]")
             
-            response_ids = generated_ids[0][model_inputs.input_ids.shape[-1]:]
-            response_text = self.tokenizer.decode(response_ids, skip_special_tokens=True)
+                response_ids = generated_ids[0][model_inputs.input_ids.shape[-1]:]
+                response_text = self.tokenizer.decode(response_ids, skip_special_tokens=True)
             
             # 拼接到全文
             full_story += response_text
@@ -1,8 +1,12 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextStreamer, BitsAndBytesConfig
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from incremental_streamer import IncrementalTextStreamer
+from prompt_lookup import PromptLookupDecoder
+from candidate_fork import CandidateGenerator, combine, length_score, repetition_score
+import tiled_attention  # 注册 "tiled" 注意力实现
 
 class FastNovelWriter:
-    def __init__(self):
+    def __init__(self, use_prompt_lookup=False, num_candidates=1, scorer=None, attn_implementation=None):
         # 依然使用 1.5B 效果较好，如果追求极致速度可以换回 0.5B
         self.model_name = "Qwen/Qwen2.5-1.5B-Instruct" 
         print(f"🚀 正在以加速模式加载引擎: {self.model_name}...")
@@ -23,7 +27,9 @@ class FastNovelWriter:
             quantization_config=bnb_config, # 应用量化
             device_map="auto",             # 自动分配显存/内存
             low_cpu_mem_usage=True,
-            trust_remote_code=True
+            trust_remote_code=True,
+            # 每段续写上下文都会长约 800 token，"tiled" 分块注意力在 prefill 时不生成完整的注意力矩阵
+            attn_implementation=attn_implementation
         )
         
         # 3. 开启推理加速（针对支持的算子）
@@ -34,6 +40,16 @@ class FastNovelWriter:
             "【规则】：严禁跳过剧情，禁止做总结性陈述，每一章必须包含大量的细节描写，节奏要慢。"
         )
         self.messages = []
+        
+        # 4. 可选：Prompt Lookup 解码，续写时复用上下文里已有的片段，一次前向多出几个 token
+        self.prompt_lookup = PromptLookupDecoder(self.model) if use_prompt_lookup else None
+
+        # 可选：每段同时写 num_candidates 个版本（上下文只 prefill 一次，KV 写时复制共享），由打分器挑最好的
+        self.num_candidates = num_candidates
+        self.candidates = None
+        if num_candidates > 1:
+            scorer = scorer or combine((repetition_score, 0.7), (length_score(600), 0.3))
+            self.candidates = CandidateGenerator(self.model, self.tokenizer, scorer=scorer, dtype=torch.bfloat16)
 
     def write_long_chapter(self, prompt, target_length=1500):
         self.messages = [{"role": "system", "content": self.system_prompt}]
@@ -47,24 +63,37 @@ class FastNovelWriter:
             text = self.tokenizer.apply_chat_template(self.messages, tokenize=False, add_generation_prompt=True)
             model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
             
-            # 使用流式输出，边写边看就不会觉得慢了
-            streamer = TextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            if self.candidates:
+                # 多路候选：上下文只 prefill 一次，fork 出几份一起写，挑分数最高的一版
+                response_text, candidates = self.candidates.generate(
+                    model_inputs.input_ids[0].tolist(), n=self.num_candidates,
+                    max_new_tokens=512, temperature=0.8, top_p=0.9, repetition_penalty=1.1)
+                print(response_text)
+                scores = ", ".join(f"{c['score']:.2f}" for c in candidates)
+                print(f"\n[{self.num_candidates} 个候选，得分 {scores}，用时 {self.candidates.last_stats['total_seconds']}s]")
+            else:
+                # 使用流式输出，边写边看就不会觉得慢了
+                streamer = IncrementalTextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
 
-            # 生成配置优化
-            with torch.no_grad(): # 禁用梯度计算，省内存提速
-                generated_ids = self.model.generate(
-                    **model_inputs,
-                    streamer=streamer,
-                    max_new_tokens=512, # 减小单次生成长度，保持推理高效
-                    do_sample=True,
-                    temperature=0.8,
-                    top_p=0.9,
-                    repetition_penalty=1.1,
-                    use_cache=True # 务必开启缓存，这是提速核心
-                )
+                # 生成配置优化
+                generate = self.prompt_lookup.generate if self.prompt_lookup else self.model.generate
+                with torch.no_grad(): # 禁用梯度计算，省内存提速
+                    generated_ids = generate(
+                        **model_inputs,
+                        streamer=streamer,
+                        max_new_tokens=512, # 减小单次生成长度，保持推理高效
+                        do_sample=True,
+                        temperature=0.8,
+                        top_p=0.9,
+                        repetition_penalty=1.1,
+                        use_cache=True # 务必开启缓存，这是提速核心
+                    )
+            
+                if self.prompt_lookup:
+                    print(f"\n[{self.prompt_lookup.report()}]")
             
-            response_ids = generated_ids[0][model_inputs.input_ids.shape[-1]:]
-            response_text = self.tokenizer.decode(response_ids, skip_special_tokens=True)
+                response_ids = generated_ids[0][model_inputs.input_ids.shape[-1]:]
+                response_text = self.tokenizer.decode(response_ids, skip_special_tokens=True)
             
             full_story += response_text
             self.messages.append({"role": "assistant", "content": response_text})
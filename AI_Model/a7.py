@@ -2,7 +2,11 @@ import torch
 import json
 import os
 import gc
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextStreamer
+import time
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from incremental_streamer import IncrementalTextStreamer
+from long_term_memory import ConversationMemory, HashingEmbedder
+from prompt_compressor import PromptCompressor
 from rich.console import Console
 from rich.panel import Panel
 from rich.markdown import Markdown
@@ -17,6 +21,7 @@ class SuperChatbot:
         self.model_name = model_name
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.max_history_len = 10  # 限制保留最近的 N 轮对话，防止爆显存
+        self.memory_top_k = 3      # 更早的对话按相关度取回几轮
         
         console.print(f"[bold green]正在加载引擎: {self.model_name} (设备: {self.device})...[/bold green]")
         
@@ -41,6 +46,7 @@ class SuperChatbot:
             "repetition_penalty": 1.1
         }
         
+        self.compressor = None     # /compress 开启后，prefill 前压缩较早的历史
         self.mode = "assistant"
         self.messages = []
         self.reset_history()
@@ -55,16 +61,32 @@ class SuperChatbot:
             self.gen_kwargs["temperature"] = 0.7   # 问答更严谨
         
         self.messages = [{"role": "system", "content": sys_prompt}]
+        self.memory = ConversationMemory(HashingEmbedder())
         console.print(f"[dim]已重置上下文，当前模式: {self.mode}[/dim]")
 
     def trim_history(self):
-        """滑动窗口：当对话过长时，移除最早的对话（保留 System Prompt）"""
+        """滑动窗口：当对话过长时，把最早的对话移进长期记忆（保留 System Prompt）"""
         # System prompt 是 index 0，所以我们检查长度是否超过 limit + 1
         if len(self.messages) > (self.max_history_len * 2) + 1:
-            # 保留 system prompt (index 0)，切掉中间旧的，保留最近的
+            # 保留 system prompt (index 0)，中间旧的按 user/assistant 成对存进记忆，保留最近的
             removed_count = len(self.messages) - ((self.max_history_len * 2) + 1)
+            removed = self.messages[1:1 + removed_count]
+            for i in range(0, len(removed) - 1, 2):
+                self.memory.add(removed[i]["content"], removed[i + 1]["content"])
             self.messages = [self.messages[0]] + self.messages[-(self.max_history_len * 2):]
-            console.print(f"[dim yellow]⚠️为了保持思维清晰，遗忘了 {removed_count} 条旧消息...[/dim yellow]")
+            console.print(f"[dim yellow]📚 {removed_count} 条旧消息移入长期记忆（共 {len(self.memory)} 轮），需要时会自动想起...[/dim yellow]")
+
+    def recall(self, user_input):
+        """从长期记忆里检索和当前问题相关的旧对话"""
+        start = time.perf_counter()
+        recalled = self.memory.search(user_input, self.memory_top_k)
+        if recalled:
+            console.print(f"[dim]🔎 想起了 {len(recalled)} 轮相关的旧对话 "
+                          f"({(time.perf_counter() - start) * 1000:.2f}ms, 记忆占用 {self.memory.nbytes() / 1024:.0f}KB)[/dim]")
+        messages = []
+        for user, assistant in recalled:
+            messages += [{"role": "user", "content": user}, {"role": "assistant", "content": assistant}]
+        return messages
 
     def save_chat(self, filename="chat_history.json"):
         """保存对话到本地"""
@@ -83,6 +105,7 @@ class SuperChatbot:
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 self.messages = json.load(f)
+            self.memory = ConversationMemory(HashingEmbedder())
             console.print(f"[green]✅ 已加载历史对话 ({len(self.messages)} 条消息)[/green]")
         except Exception as e:
             console.print(f"[red]❌ 加载失败: {e}[/red]")
@@ -90,9 +113,15 @@ class SuperChatbot:
     def chat(self, user_input):
         self.trim_history() # 检查是否需要遗忘旧消息
         self.messages.append({"role": "user", "content": user_input})
+        # 检索到的旧对话只放进这次的 prompt，不写回 self.messages
+        prompt_messages = self.messages[:1] + self.recall(user_input) + self.messages[1:]
+        if self.compressor:
+            prompt_messages, stats = self.compressor.compress(prompt_messages)
+            if stats["original_chars"]:
+                console.print(f"[dim]🗜️ 旧历史 {stats['original_chars']} -> {stats['compressed_chars']} 字[/dim]")
         
         text = self.tokenizer.apply_chat_template(
-            self.messages,
+            prompt_messages,
             tokenize=False,
             add_generation_prompt=True
         )
@@ -101,7 +130,7 @@ class SuperChatbot:
         # 打印 AI 思考中的提示
         console.print(Text("🤖 AI 正在思考...", style="bold cyan"), end="\r")
 
-        streamer = TextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        streamer = IncrementalTextStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
         
         # 换行开始输出
         print("\n" + "-"*30) 
@@ -129,6 +158,7 @@ def print_menu():
     [green]/save[/green]  - 保存当前对话
     [green]/load[/green]  - 读取历史对话
     [green]/temp X[/green]- 设置温度 (0.1-1.0)，例如 /temp 0.9
+    [green]/compress X[/green] - 压缩较早的历史到 X 左右，例如 /compress 0.5 (加 model 用模型打分，off 关闭)
     [green]/clear[/green] - 清空记忆
     [red]/exit[/red]  - 退出程序
     """
@@ -172,6 +202,18 @@ def main():
                         except: console.print("[red]❌ 请输入数字，例如 /temp 0.8[/red]")
                     else:
                         console.print(f"[dim]当前温度: {bot.gen_kwargs['temperature']}[/dim]")
+                elif cmd == '/compress':
+                    if len(cmd_parts) > 1 and cmd_parts[1] == "off":
+                        bot.compressor = None
+                        console.print("[dim]🗜️ 历史压缩已关闭[/dim]")
+                    else:
+                        try:
+                            ratio = max(0.1, min(1.0, float(cmd_parts[1]))) if len(cmd_parts) > 1 else 0.5
+                            use_model = len(cmd_parts) > 2 and cmd_parts[2] == "model"
+                            bot.compressor = PromptCompressor(ratio=ratio, model=bot.model if use_model else None,
+                                                              tokenizer=bot.tokenizer)
+                            console.print(f"[dim]🗜️ 历史压缩已开启: {ratio} ({'模型打分' if use_model else '启发式'})[/dim]")
+                        except: console.print("[red]❌ 请输入数字，例如 /compress 0.5[/red]")
                 else:
                     console.print("[red]❌ 未知指令[/red]")
                 continue
@@ -1,6 +1,9 @@
+import os
 import streamlit as st
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from incremental_streamer import IncrementalIteratorStreamer
+import tiled_attention  # 注册 "tiled" 注意力实现
 from threading import Thread
 
 # === 1. 页面配置 ===
@@ -18,7 +21,9 @@ def load_model():
     model = AutoModelForCausalLM.from_pretrained(
         model_name,
         torch_dtype="auto",
-        device_map="auto"
+        device_map="auto",
+        # AI_ATTENTION=tiled：长对话的 prefill 分块计算注意力，不生成完整的注意力矩阵
+        attn_implementation=os.environ.get("AI_ATTENTION") or None
     )
     status_text.empty() # 加载完清空提示
     return tokenizer, model
@@ -82,7 +87,7 @@ if user_input := st.chat_input("输入你的问题..."):
         model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
 
         # 设置流式输出器 (这是 Web 版流式的关键)
-        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        streamer = IncrementalIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
         
         # 参数设置
         generation_kwargs = dict(
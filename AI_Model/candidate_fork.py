@@ -0,0 +1,163 @@
+import time
+
+import torch
+
+from paged_kv import BatchedPagedKVCache, BlockPool, PagedKVCache
+from sampling import sample_next_token
+
+
+# ==================== 打分器 ====================
+# 打分器签名: scorer(text, token_ids) -> float，分数越高越好
+
+def repetition_score(text, token_ids=None, n=4):
+    """不重复的 n-gram 占比：1.0 表示没有任何重复片段，原地打转的段落分数会很低"""
+    grams = [text[i:i + n] for i in range(len(text) - n + 1)]
+    return len(set(grams)) / len(grams) if grams else 0.0
+
+
+def length_score(target):
+    """越接近目标字数越好"""
+    def score(text, token_ids=None):
+        return max(0.0, 1 - abs(len(text) - target) / target)
+    return score
+
+
+def combine(*weighted):
+    """把几个打分器加权合成一个，例如 combine((repetition_score, 0.7), (length_score(600), 0.3))"""
+    def score(text, token_ids=None):
+        return sum(w * fn(text, token_ids) for fn, w in weighted)
+    return score
+
+
+class CandidateGenerator:
+    """
+    一次 prefill，多路候选续写：
+    - 共同的上下文（整章内容）只 prefill 一次，写进分页 KV 缓存
+    - fork 出 n 份缓存，前缀 block 全部共享（写时复制，只有最后一个没写满的 block 各自复制一份）
+    - n 路候选拼成一个 batch 一起 decode，每一步一次前向；结束的候选直接移出 batch
+    - 最后用打分器选出最好的一路
+    """
+
+    def __init__(self, model, tokenizer, kv_cache_mb=256, block_size=16, dtype=None, scorer=repetition_score):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.scorer = scorer
+        # dtype 要和注意力计算用的一致（4-bit 量化模型填 compute dtype）
+        self.pool = BlockPool.from_budget(model.config, kv_cache_mb * 2**20, block_size, dtype or model.dtype,
+                                          model.device)
+        eos = model.generation_config.eos_token_id
+        self.eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        if tokenizer.eos_token_id is not None:
+            self.eos_ids.add(tokenizer.eos_token_id)
+        self.last_stats = {}
+
+    def generate(self, prompt_ids, n=4, max_new_tokens=512, temperature=0.9, top_p=0.95,
+                 repetition_penalty=1.1, scorer=None):
+        """返回 (最好的文本, 全部候选)，候选按分数从高到低排列"""
+        scorer = scorer or self.scorer
+        pool = self.pool
+        prompt_ids = list(prompt_ids)
+        # 最坏情况：共享前缀 + 每路各自的输出（外加最后一个前缀 block 的复制）
+        need = pool.blocks_needed(len(prompt_ids)) + n * (pool.blocks_needed(max_new_tokens) + 1)
+        if not pool.reserve(need):
+            raise RuntimeError(f"KV 缓存池不够：需要 {need} 个 block，可用 {pool.num_available()} 个")
+
+        root = PagedKVCache(pool, reserved=need)
+        caches = []
+        start = time.perf_counter()
+        try:
+            with torch.inference_mode():
+                out = self.model(input_ids=torch.tensor([prompt_ids], device=self.model.device),
+                                 past_key_values=root, use_cache=True, logits_to_keep=1)
+                prefill_time = time.perf_counter() - start
+                logits = out.logits[0, -1].float()
+
+                # fork：每路只持有 block 表，root 剩下的预留平分给各路
+                caches = [root.fork() for _ in range(n)]
+                share = root.reserved // n
+                for cache in caches:
+                    cache.reserved = share
+                root.reserved -= share * n
+                outputs = [[] for _ in range(n)]
+                active = list(range(n))
+                step_logits = [logits] * n
+                batch = BatchedPagedKVCache([caches[i] for i in active])
+                peak_blocks = 0
+
+                for _ in range(max_new_tokens):
+                    next_tokens = []
+                    for row, i in enumerate(list(active)):
+                        token = sample_next_token(step_logits[row].clone(), prompt_ids + outputs[i], True,
+                                                  temperature, top_p, repetition_penalty)
+                        if token in self.eos_ids:
+                            active.remove(i)
+                            continue
+                        outputs[i].append(token)
+                        next_tokens.append(token)
+                    if not active:
+                        break
+                    batch.caches = [caches[i] for i in active]
+                    input_ids = torch.tensor([[t] for t in next_tokens], device=self.model.device)
+                    out = self.model(input_ids=input_ids, past_key_values=batch, use_cache=True, logits_to_keep=1)
+                    step_logits = out.logits[:, -1].float()
+                    peak_blocks = max(peak_blocks, pool.num_blocks - len(pool.free) - len(pool.evictable))
+        finally:
+            for cache in caches + [root]:
+                cache.free()
+
+        texts = [self.tokenizer.decode(ids, skip_special_tokens=True) for ids in outputs]
+        candidates = sorted(({"text": t, "ids": ids, "score": scorer(t, ids)} for t, ids in zip(texts, outputs)),
+                            key=lambda c: c["score"], reverse=True)
+        separate_blocks = n * pool.blocks_needed(len(prompt_ids) + max(len(ids) for ids in outputs))
+        self.last_stats = {
+            "candidates": n,
+            "prompt_tokens": len(prompt_ids),
+            "output_tokens": sum(len(ids) for ids in outputs),
+            "prefill_seconds": round(prefill_time, 3),
+            "total_seconds": round(time.perf_counter() - start, 3),
+            "kv_peak_blocks": peak_blocks,
+            "kv_blocks_if_separate": separate_blocks,
+        }
+        return candidates[0]["text"], candidates
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model_name = "Qwen/Qwen2.5-0.5B-Instruct"
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, device_map={"": "cpu"})
+
+    chapter = ("夜色渐深，长安城的灯火一盏盏熄灭。李白独自坐在酒肆的角落里，望着窗外的月亮，手中的酒杯迟迟没有放下。"
+               "他想起了远方的故乡，想起了少年时仗剑远游的日子，也想起了那些早已散落天涯的朋友。") * 8
+    messages = [{"role": "system", "content": "你是一位顶级的网文大神，擅长细腻的心理描写。"},
+                {"role": "user", "content": f"请紧接下面的内容继续写：\n{chapter}"}]
+    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    prompt_ids = tokenizer(text)["input_ids"]
+    n, max_new_tokens = 4, 64
+
+    start = time.perf_counter()
+    for _ in range(n):
+        with torch.no_grad():
+            model.generate(torch.tensor([prompt_ids]), max_new_tokens=max_new_tokens, do_sample=True,
+                           temperature=0.9, top_p=0.95, repetition_penalty=1.1)
+    separate = time.perf_counter() - start
+
+    generator = CandidateGenerator(model, tokenizer, scorer=combine((repetition_score, 0.7), (length_score(100), 0.3)))
+    start = time.perf_counter()
+    best, candidates = generator.generate(prompt_ids, n=n, max_new_tokens=max_new_tokens)
+    forked = time.perf_counter() - start
+    s = generator.last_stats
+
+    print(f"上下文 {len(prompt_ids)} token，{n} 路候选，每路最多 {max_new_tokens} token")
+    print(f"  分别生成 {n} 次: {separate:.2f}s")
+    print(f"  fork 后一起 decode: {forked:.2f}s（prefill {s['prefill_seconds']}s，只做一次），{separate / forked:.2f}x")
+    print(f"  KV 峰值 {s['kv_peak_blocks']} 个 block（各自独立缓存需要 {s['kv_blocks_if_separate']} 个）")
+    for c in candidates:
+        print(f"  {c['score']:.3f}  {c['text'][:40]!r}")
+
+
+if __name__ == "__main__":
+    main()
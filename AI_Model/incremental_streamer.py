@@ -0,0 +1,120 @@
+import time
+
+from transformers import TextIteratorStreamer, TextStreamer
+
+
+class IncrementalDetokenizer:
+    """
+    增量解码：每来一个新 token，只解码最近几个 token 组成的小窗口
+    （TextStreamer 会把整段回复反复重新 decode，中文没有换行时越写越慢）
+
+    prefix_offset 之前的文字已经输出过，read_offset 之后是新 token；
+    解码结果以 '\\ufffd' 结尾说明一个汉字的 UTF-8 字节被拆在多个 token 里，先不输出，等下一个 token。
+    """
+
+    def __init__(self, tokenizer, **decode_kwargs):
+        self.tokenizer = tokenizer
+        self.decode_kwargs = decode_kwargs
+        self.tokens = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, ids):
+        return self.tokenizer.decode(ids, **self.decode_kwargs)
+
+    def add(self, token_ids) -> str:
+        """加入新 token，返回可以安全输出的新文字（可能为空）"""
+        self.tokens.extend(token_ids)
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+
+        if len(new_text) <= len(prefix_text) or new_text.endswith("�"):
+            return ""
+
+        # 窗口前移，已经输出过的 token 不再保留
+        self.tokens = self.tokens[self.read_offset:]
+        self.prefix_offset = 0
+        self.read_offset = len(self.tokens)
+        return new_text[len(prefix_text):]
+
+    def flush(self) -> str:
+        """生成结束时，把剩下还没输出的文字全部吐出来"""
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+        self.tokens = []
+        self.prefix_offset = self.read_offset = 0
+        return new_text[len(prefix_text):]
+
+
+class IncrementalTextStreamer(TextStreamer):
+    """TextStreamer 的替代品：用法完全相同，单个 token 的解码开销不随回复长度增长"""
+
+    def __init__(self, tokenizer, skip_prompt=False, **decode_kwargs):
+        super().__init__(tokenizer, skip_prompt, **decode_kwargs)
+        self.detokenizer = IncrementalDetokenizer(tokenizer, **decode_kwargs)
+
+    def put(self, value):
+        if len(value.shape) > 1 and value.shape[0] > 1:
+            raise ValueError("IncrementalTextStreamer only supports batch size 1")
+        elif len(value.shape) > 1:
+            value = value[0]
+
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+
+        text = self.detokenizer.add(value.tolist())
+        if text:
+            self.on_finalized_text(text)
+
+    def end(self):
+        self.next_tokens_are_prompt = True
+        self.on_finalized_text(self.detokenizer.flush(), stream_end=True)
+
+
+class IncrementalIteratorStreamer(IncrementalTextStreamer, TextIteratorStreamer):
+    """TextIteratorStreamer 的替代品：在另一个线程里 generate，这边逐段迭代取文字"""
+
+    def __init__(self, tokenizer, skip_prompt=False, timeout=None, **decode_kwargs):
+        TextIteratorStreamer.__init__(self, tokenizer, skip_prompt, timeout, **decode_kwargs)
+        self.detokenizer = IncrementalDetokenizer(tokenizer, **decode_kwargs)
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    import torch
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained("Qwen/Qwen2.5-0.5B-Instruct")
+    text = "夜色渐深，长安城的灯火一盏盏熄灭。李白独自坐在酒肆的角落里，望着窗外的月亮。🌙" * 80
+    ids = tokenizer(text)["input_ids"][:2000]
+
+    class Silent:
+        def on_finalized_text(self, text, stream_end=False):
+            self.chunks.append(text)
+
+    class SilentTextStreamer(Silent, TextStreamer):
+        pass
+
+    class SilentIncrementalStreamer(Silent, IncrementalTextStreamer):
+        pass
+
+    print(f"流式解码基准：{len(ids)} 个 token 的中文输出")
+    for cls in (SilentTextStreamer, SilentIncrementalStreamer):
+        streamer = cls(tokenizer, skip_special_tokens=True)
+        streamer.chunks = []
+        costs = []
+        for token in ids:
+            start = time.perf_counter()
+            streamer.put(torch.tensor([token]))
+            costs.append(time.perf_counter() - start)
+        streamer.end()
+        head = sum(costs[:200]) / 200 * 1e6
+        tail = sum(costs[-200:]) / 200 * 1e6
+        print(f"  {cls.__bases__[1].__name__:<24} 前 200 个 token: {head:7.1f} 微秒/个，"
+              f"最后 200 个 token: {tail:7.1f} 微秒/个，输出一致: {''.join(streamer.chunks) == tokenizer.decode(ids)}")
+
+
+if __name__ == "__main__":
+    main()
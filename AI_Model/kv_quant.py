@@ -0,0 +1,89 @@
+import torch
+
+
+def quantize_int8(x):
+    """对称 int8 量化：最后一维（head_dim）共用一个缩放系数，即每个 token 每个头一个 scale"""
+    scale = x.abs().amax(dim=-1).float().clamp(min=1e-8) / 127
+    q = torch.round(x.float() / scale.unsqueeze(-1)).clamp(-127, 127).to(torch.int8)
+    return q, scale
+
+
+def dequantize_int8(q, scale, dtype=torch.float32):
+    return q.to(dtype) * scale.unsqueeze(-1).to(dtype)
+
+
+# ==================== 精度与容量评估 ====================
+
+EVAL_TEXTS = [
+    "夜色渐深，长安城的灯火一盏盏熄灭。李白独自坐在酒肆的角落里，望着窗外的月亮，手中的酒杯迟迟没有放下。"
+    "他想起了远方的故乡，想起了少年时仗剑远游的日子，也想起了那些早已散落天涯的朋友。",
+    "机器学习是人工智能的一个分支，它让计算机能够从数据中学习规律，而不需要显式地编写每一条规则。"
+    "常见的方法包括监督学习、无监督学习和强化学习，它们分别适用于不同类型的问题。",
+    "用户：请帮我写一个 Python 函数，判断一个字符串是不是回文。\n"
+    "助手：可以先把字符串反转，再和原字符串比较。def is_palindrome(s): return s == s[::-1]",
+    "The weather in Kuala Lumpur is usually hot and humid, with frequent afternoon thunderstorms. "
+    "Visitors are advised to carry an umbrella and drink plenty of water throughout the day.",
+]
+
+
+def evaluate(model, tokenizer, texts=EVAL_TEXTS, block_size=16):
+    """同一组文本分别用 float32 和 int8 KV 缓存跑一遍，比较每个位置的预测分布"""
+    from paged_kv import BlockPool, PagedKVCache
+
+    def logits_with(pool, ids):
+        need = pool.blocks_needed(len(ids))
+        pool.reserve(need)
+        cache = PagedKVCache(pool, reserved=need)
+        with torch.no_grad():
+            logits = model(input_ids=torch.tensor([ids]), past_key_values=cache, use_cache=True).logits[0]
+        cache.free()
+        return logits.float()
+
+    budget = 64 * 2**20
+    pools = {q: BlockPool.from_budget(model.config, budget, block_size, model.dtype, kv_quant=q) for q in (None, "int8")}
+    agree = total = 0
+    kl = 0.0
+    nll = {None: 0.0, "int8": 0.0}
+    for text in texts:
+        ids = tokenizer(text)["input_ids"]
+        ref = logits_with(pools[None], ids)
+        quant = logits_with(pools["int8"], ids)
+        agree += (ref.argmax(-1) == quant.argmax(-1)).sum().item()
+        total += len(ids)
+        ref_logp, quant_logp = ref.log_softmax(-1), quant.log_softmax(-1)
+        kl += (ref_logp.exp() * (ref_logp - quant_logp)).sum().item()
+        target = torch.tensor(ids[1:])
+        nll[None] -= ref_logp[:-1].gather(1, target[:, None]).sum().item()
+        nll["int8"] -= quant_logp[:-1].gather(1, target[:, None]).sum().item()
+
+    targets = total - len(texts)
+    return {
+        "tokens": total,
+        "top1_agreement": agree / total,
+        "mean_kl": kl / total,
+        "ppl_float32": torch.tensor(nll[None] / targets).exp().item(),
+        "ppl_int8": torch.tensor(nll["int8"] / targets).exp().item(),
+        "bytes_per_token": {q or "float32": p.bytes_per_block / block_size for q, p in pools.items()},
+    }
+
+
+def main():
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model_name = "Qwen/Qwen2.5-0.5B-Instruct"
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, device_map={"": "cpu"})
+
+    r = evaluate(model, tokenizer)
+    print(f"评估集 {r['tokens']} 个 token（{model_name}）")
+    print(f"  top-1 预测一致率 {r['top1_agreement']:.2%}，平均 KL {r['mean_kl']:.5f}")
+    print(f"  困惑度 float32 {r['ppl_float32']:.3f} -> int8 {r['ppl_int8']:.3f} "
+          f"({r['ppl_int8'] / r['ppl_float32'] - 1:+.2%})")
+    for context in (1024, 2048, 4096):
+        line = "，".join(f"{name} {2**30 / (per_token * context):6.1f} 个"
+                        for name, per_token in r["bytes_per_token"].items())
+        print(f"  每 GB 可容纳 {context} token 的会话: {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# 几乎每句话都有的字，参与打分只会带来噪声
+STOP_CHARS = set("的了是我你他她它们这那在有和就也都吗呢吧啊呀哦嗯，。！？、；：“”‘’（）,.!?;:()'\" \n\t")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    """把文本哈希成固定维度的向量：中文按单字 + 相邻两字，英文/数字按单词，不需要任何模型"""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _features(self, text):
+        text = text.lower()
+        chars = [c for c in text if c not in STOP_CHARS and not c.isascii()]
+        feats = [(c, 0.5) for c in chars]
+        feats += [(a + b, 1.0) for a, b in zip(chars, chars[1:])]
+        feats += [(w, 1.0) for w in _WORD.findall(text)]
+        return feats
+
+    def embed(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        feats = self._features(text)
+        if feats:
+            # crc32 在不同进程间稳定；最高位决定正负号，减少哈希冲突带来的偏差
+            hashes = np.array([zlib.crc32(f.encode("utf-8")) for f, _ in feats], dtype=np.uint64)
+            weights = np.array([w for _, w in feats], dtype=np.float32)
+            signs = np.where(hashes >> 31 & 1, -1.0, 1.0).astype(np.float32)
+            np.add.at(vec, (hashes % self.dim).astype(np.int64), weights * signs)
+            vec /= max(float(np.linalg.norm(vec)), 1e-6)
+        return vec
+
+
+class ConversationMemory:
+    """
+    一个会话的长期记忆：每轮对话（用户 + AI）存成一个 float32 向量（512 维占 2KB）
+    向量放在一个按需翻倍的 NumPy 矩阵里，检索就是一次矩阵乘法取 top-k
+    """
+
+    def __init__(self, embedder, max_chars=300):
+        self.embedder = embedder
+        self.max_chars = max_chars            # 每轮只保留这么多字，检索回来时不会撑爆 prompt
+        self.vectors = np.zeros((8, embedder.dim), dtype=np.float32)
+        self.turns = []                       # [(user, assistant), ...]
+        self.lock = threading.Lock()          # /chat 和 /draft 可能同时给同一个会话建索引、检索
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add(self, user, assistant):
+        if len(self.turns) == len(self.vectors):
+            grown = np.zeros((len(self.vectors) * 2, self.embedder.dim), dtype=np.float32)
+            grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+        user, assistant = user[:self.max_chars], assistant[:self.max_chars]
+        self.vectors[len(self.turns)] = self.embedder.embed(f"{user}\n{assistant}")
+        self.turns.append((user, assistant))
+
+    def search(self, query, k=3, min_score=0.2):
+        """返回和 query 最相关的 k 轮旧对话，按原来的先后顺序排列"""
+        if not self.turns or k <= 0:
+            return []
+        scores = self.vectors[:len(self.turns)] @ self.embedder.embed(query)
+        picked = []
+        for i in np.argsort(-scores):
+            if len(picked) == k or scores[i] < min_score:
+                break
+            # 同样的话说过好几遍时只取一次
+            if all(self.turns[i][0] != self.turns[j][0] for j in picked):
+                picked.append(i)
+        return [self.turns[i] for i in sorted(picked)]
+
+    def nbytes(self):
+        text = sum(len(u.encode("utf-8")) + len(a.encode("utf-8")) for u, a in self.turns)
+        return self.vectors.nbytes + text
+
+
+class MemoryStore:
+    """
+    所有会话的长期记忆（按 session_id 区分，LRU 淘汰长时间不用的会话）
+    前端每次都会带上完整历史：最近 window 条消息原样放进 prompt，更早的消息只在第一次出现时建一次索引，
+    然后按当前问题检索最相关的 top_k 轮塞回去 —— 对话再长，prompt 长度也基本不变
+    """
+
+    def __init__(self, dim=512, window=4, top_k=3, max_sessions=10000, stats_size=2000):
+        self.embedder = HashingEmbedder(dim)
+        self.window = window
+        self.top_k = top_k
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.latency = deque(maxlen=stats_size)
+
+    def _memory(self, session_id):
+        with self._lock:
+            memory = self.sessions.get(session_id)
+            if memory is None:
+                memory = self.sessions[session_id] = ConversationMemory(self.embedder)
+                if len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session_id)
+            return memory
+
+    def build_context(self, session_id, history, query, record_latency=True):
+        """返回放进 prompt 的历史消息：检索到的旧对话 + 最近 window 条消息（预先 prefill 的草稿不计入延迟统计）"""
+        recent = history[-self.window:] if self.window else []
+        older = history[:len(history) - len(recent)]
+        if not older:
+            return list(recent)
+
+        start = time.perf_counter()
+        memory = self._memory(session_id)
+        with memory.lock:
+            # 只给新滑出窗口的消息建索引（按 user/assistant 两两成对）；起点和 add 要在同一把锁里，否则会重复建索引
+            for i in range(len(memory) * 2, len(older) - 1, 2):
+                memory.add(older[i]["content"], older[i + 1]["content"])
+            recalled = memory.search(query, self.top_k)
+        if record_latency:
+            self.latency.append(time.perf_counter() - start)
+
+        messages = []
+        for user, assistant in recalled:
+            messages += [{"role": "user", "content": user}, {"role": "assistant", "content": assistant}]
+        return messages + list(recent)
+
+    def stats(self):
+        def pct(values, p):
+            values = sorted(values)
+            return round(values[min(int(len(values) * p), len(values) - 1)] * 1000, 3) if values else None
+
+        with self._lock:
+            sizes = [m.nbytes() for m in self.sessions.values()]
+            turns = sum(len(m) for m in self.sessions.values())
+        latency = list(self.latency)
+        return {
+            "sessions": len(sizes),
+            "turns": turns,
+            "bytes_per_session": sum(sizes) // len(sizes) if sizes else 0,
+            "retrieval_ms_p50": pct(latency, 0.5),
+            "retrieval_ms_p99": pct(latency, 0.99),
+        }
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    import random
+
+    rnd = random.Random(0)
+    facts = ["我养了一只叫小白的猫", "我在学 Python 编程", "下个月要去日本旅行", "我最喜欢吃火锅",
+             "我的生日是五月十二号", "我在写一部武侠小说", "最近在准备考研", "我家住在上海浦东"]
+    fillers = ["今天天气怎么样", "讲个笑话吧", "帮我想个标题", "谢谢你", "继续说", "翻译一下这句话",
+               "推荐一本书", "解释一下量子纠缠", "写一首关于秋天的诗", "怎么煮咖啡"]
+    replies = ["好的。", "没问题，", "明白了。", "这是个好问题。"]
+    fact_turns = set(rnd.sample(range(2000), len(facts)))
+
+    store = MemoryStore()
+    history = []
+    for i in range(2000):
+        user = facts[len([t for t in fact_turns if t < i])] if i in fact_turns else rnd.choice(fillers)
+        history += [{"role": "user", "content": user}, {"role": "assistant", "content": rnd.choice(replies)}]
+        store.build_context("bench", history, "随便聊聊")
+
+    for query in ["小白猫最近不爱吃饭怎么办", "我要去哪里旅行", "我的生日是几月几号", "我的小说写的是什么类型"]:
+        context = store.build_context("bench", history, query)
+        recalled = [m["content"] for m in context[:-store.window] if m["role"] == "user"]
+        print(f"  {query} -> {recalled}")
+
+    s = store.stats()
+    print(f"2000 轮对话：prompt 里始终只有 {store.top_k} 轮检索结果 + 最近 {store.window} 条消息，"
+          f"检索 p50 {s['retrieval_ms_p50']}ms / p99 {s['retrieval_ms_p99']}ms，"
+          f"单会话记忆 {s['bytes_per_session'] / 1024:.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
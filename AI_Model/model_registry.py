@@ -0,0 +1,338 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+from transformers import (AutoConfig, AutoModel, AutoModelForCausalLM, AutoModelForSeq2SeqLM,
+                          AutoTokenizer, GenerationConfig)
+
+SNAPSHOT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_chat_snapshots")
+
+# 各个脚本用到的模型：名字 -> (模型 id, 模型类, 额外的加载参数)
+KNOWN_MODELS = {
+    "qwen-0.5b": ("Qwen/Qwen2.5-0.5B-Instruct", AutoModelForCausalLM, {}),
+    "qwen-1.5b": ("Qwen/Qwen2.5-1.5B-Instruct", AutoModelForCausalLM, {}),
+    "chatglm3-6b": ("THUDM/chatglm3-6b", AutoModel, {"trust_remote_code": True}),
+    "blenderbot-400m": ("facebook/blenderbot-400M-distill", AutoModelForSeq2SeqLM, {}),
+}
+
+
+def model_bytes(model):
+    """模型参数和 buffer 实际占用的字节数（共享权重只算一次）"""
+    seen, total = set(), 0
+    for t in list(model.parameters()) + list(model.buffers()):
+        if t.device.type == "meta":
+            continue
+        key = t.untyped_storage().data_ptr()
+        if key not in seen:
+            seen.add(key)
+            total += t.untyped_storage().nbytes()
+    return total
+
+
+class ModelEntry:
+    """一个已登记的模型：加载参数、当前是否常驻、占用多少内存、正在被几个请求使用"""
+
+    def __init__(self, name, model_id, model_cls, load_kwargs, size_hint):
+        self.name = name
+        self.model_id = model_id
+        self.model_cls = model_cls
+        self.load_kwargs = load_kwargs
+        self.size_hint = size_hint    # 第一次加载前对占用内存的估计（字节）
+        self.model = None
+        self.tokenizer = None
+        self.bytes = 0
+        self.users = 0                # 正在使用的请求数，大于 0 时不会被换出
+        self.loads = 0
+        self.evictions = 0
+        self.last_load_seconds = None
+        self.snapshot = None          # 换出时保存的快照目录
+        self.loading = None           # 正在加载时是一个 Event，加载完成（或失败）时 set
+        self.evicting = None          # 正在换出（写快照）时是一个 Event，换出完成（或失败）时 set
+
+
+class ModelRegistry:
+    """
+    模型注册表：一个进程里挂多个模型，用到时才加载
+    - 记录每个模型常驻内存的大小，总量超过预算时，把最久没用的模型换出
+    - 换出前把权重存成快照，再次用到时 torch.load(mmap=True) 直接映射文件，
+      不用重新解析 safetensors、也不用先随机初始化一遍，重新上线很快
+    - 正在生成的模型不会被换出；换出时会通知使用方（比如关掉对应的生成引擎）
+    """
+
+    def __init__(self, budget_mb=None, snapshot_dir=SNAPSHOT_DIR):
+        self.budget = budget_mb * 2**20 if budget_mb else None
+        self.snapshot_dir = snapshot_dir
+        self.entries = OrderedDict()      # 按最近使用排序，最前面的最久没用
+        self._lock = threading.RLock()
+        self._evict_callbacks = {}
+
+    def register(self, name, model_id=None, model_cls=AutoModelForCausalLM, size_mb=None, **load_kwargs):
+        """登记一个模型（不加载）；name 在 KNOWN_MODELS 里时可以省略其余参数"""
+        if model_id is None:
+            model_id, model_cls, known_kwargs = KNOWN_MODELS[name]
+            load_kwargs = {**known_kwargs, **load_kwargs}
+        load_kwargs.setdefault("torch_dtype", torch.float32)
+        with self._lock:
+            self.entries[name] = ModelEntry(name, model_id, model_cls, load_kwargs,
+                                            int(size_mb * 2**20) if size_mb else 0)
+        return self
+
+    def on_evict(self, name, callback):
+        """模型被换出时调用 callback(name)，使用方借此释放自己持有的引用"""
+        self._evict_callbacks.setdefault(name, []).append(callback)
+
+    # ---------- 使用 ----------
+
+    def get(self, name):
+        """返回 (model, tokenizer)，没加载就先加载；调用方自己保证用完前它不会被换出"""
+        return self._acquire(name, pin=False)
+
+    @contextmanager
+    def use(self, name):
+        """with registry.use(name) as (model, tokenizer): 期间这个模型不会被换出"""
+        model, tokenizer = self._acquire(name, pin=True)
+        try:
+            yield model, tokenizer
+        finally:
+            with self._lock:
+                self.entries[name].users -= 1
+
+    def _acquire(self, name, pin):
+        """
+        加载（from_pretrained 或从快照映射）在全局锁外面做：加载期间其他模型照常使用，
+        同一个模型的其他调用方等这次加载完成，不会重复加载
+        """
+        while True:
+            with self._lock:
+                entry = self.entries[name]
+                self.entries.move_to_end(name)
+                if entry.model is not None and entry.evicting is None:
+                    if pin:
+                        entry.users += 1  # 和返回在同一把锁里，中间不会被别人换出
+                    return entry.model, entry.tokenizer
+                pending = entry.loading or entry.evicting
+                if pending is None:
+                    entry.loading = threading.Event()
+                    victims = self._make_room(entry.bytes or entry.size_hint, keep=name)
+            if pending is not None:
+                # 别人正在加载或换出这个模型，等它完成后重新检查（加载失败时由下一个调用方重试）
+                pending.wait()
+                continue
+
+            try:
+                self._evict_victims(victims)
+                model, tokenizer, seconds = self._load(entry)
+            except BaseException:
+                with self._lock:
+                    event, entry.loading = entry.loading, None
+                event.set()
+                raise
+            with self._lock:
+                entry.model, entry.tokenizer = model, tokenizer
+                entry.bytes = model_bytes(model)
+                entry.loads += 1
+                entry.last_load_seconds = seconds
+                event, entry.loading = entry.loading, None
+                victims = self._make_room(0, keep=name)
+                if pin:
+                    entry.users += 1
+            event.set()
+            self._evict_victims(victims)
+            return model, tokenizer
+
+    def estimate_bytes(self, name):
+        """加载前估计模型要占多少内存：没给 size_mb 时在 meta 设备上搭一遍结构，按参数量和 dtype 算"""
+        entry = self.entries[name]
+        if entry.bytes or entry.size_hint:
+            return entry.bytes or entry.size_hint
+        trust = entry.load_kwargs.get("trust_remote_code", False)
+        config = AutoConfig.from_pretrained(entry.model_id, trust_remote_code=trust)
+        with torch.device("meta"):
+            model = entry.model_cls.from_config(config, trust_remote_code=trust)
+        dtype = entry.load_kwargs.get("torch_dtype")
+        itemsize = dtype.itemsize if isinstance(dtype, torch.dtype) else 4
+        seen, total = set(), 0
+        for t in list(model.parameters()) + list(model.buffers()):
+            if id(t) not in seen:
+                seen.add(id(t))
+                total += t.numel() * (itemsize if t.is_floating_point() else t.element_size())
+        return total
+
+    def remove(self, name):
+        """注销模型并释放内存（不存快照），热更新换下来的旧模型用"""
+        with self._lock:
+            entry = self.entries[name]
+            if entry.users or entry.loading is not None or entry.evicting is not None:
+                raise RuntimeError(f"模型 {name} 正在使用、加载或换出中，不能注销")
+            for callback in self._evict_callbacks.pop(name, []):
+                callback(name)
+            del self.entries[name]
+            entry.model = None
+            print(f"🗑️ 模型 {name} 已注销")
+
+    def resident_bytes(self):
+        return sum(e.bytes for e in self.entries.values() if e.model is not None)
+
+    def evict(self, name):
+        """把模型换出内存（先存快照，下次加载走 mmap）"""
+        with self._lock:
+            entry = self.entries[name]
+            if entry.model is None or entry.evicting is not None:
+                return
+            if entry.users:
+                raise RuntimeError(f"模型 {name} 正在使用中，不能换出")
+            entry.evicting = threading.Event()
+        self._finish_evict(entry)
+
+    def _finish_evict(self, entry):
+        """
+        换出的后半段，调用时不持有全局锁：写快照（torch.save 整个模型，可能要好几秒）期间
+        其他模型照常使用，用到这个模型的调用方等换出完成后再重新加载
+        """
+        try:
+            snapshot = entry.snapshot or self._save_snapshot(entry)
+        except BaseException:
+            with self._lock:
+                event, entry.evicting = entry.evicting, None
+            event.set()
+            raise
+        with self._lock:
+            entry.snapshot = snapshot
+            for callback in self._evict_callbacks.get(entry.name, []):
+                callback(entry.name)
+            entry.model = None
+            entry.bytes = 0
+            entry.evictions += 1
+            event, entry.evicting = entry.evicting, None
+        event.set()
+        print(f"💤 模型 {entry.name} 已换出内存")
+
+    def _evict_victims(self, victims):
+        for entry in victims:
+            try:
+                self._finish_evict(entry)
+            except Exception as e:
+                print(f"⚠️ 模型 {entry.name} 换出失败，继续常驻: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_mb": round(self.budget / 2**20, 1) if self.budget else None,
+                "resident_mb": round(self.resident_bytes() / 2**20, 1),
+                "models": {
+                    e.name: {
+                        "resident": e.model is not None,
+                        "mb": round(e.bytes / 2**20, 1),
+                        "users": e.users,
+                        "loads": e.loads,
+                        "evictions": e.evictions,
+                        "last_load_seconds": e.last_load_seconds,
+                        "snapshot": e.snapshot is not None,
+                        "loading": e.loading is not None,
+                        "evicting": e.evicting is not None,
+                    } for e in self.entries.values()
+                },
+            }
+
+    # ---------- 内部实现 ----------
+
+    def _make_room(self, incoming, keep):
+        """
+        按 LRU 挑出没人在用的模型、标记为换出中，直到放得下 incoming 字节；调用时持有全局锁，
+        只做标记，返回的模型由调用方释放锁之后交给 _evict_victims 真正换出
+        """
+        if self.budget is None:
+            return []
+        # 别的线程正在加载、还没算进常驻内存的模型也要留出位置；正在换出的不再算常驻
+        incoming += sum(e.bytes or e.size_hint for n, e in self.entries.items()
+                        if e.loading is not None and n != keep)
+        resident = sum(e.bytes for e in self.entries.values() if e.model is not None and e.evicting is None)
+        victims = []
+        for name, entry in self.entries.items():
+            if resident + incoming <= self.budget:
+                return victims
+            if name != keep and entry.model is not None and entry.evicting is None and not entry.users:
+                entry.evicting = threading.Event()
+                victims.append(entry)
+                resident -= entry.bytes
+        if resident + incoming > self.budget:
+            print(f"⚠️ 模型内存超出预算：常驻 {resident / 2**20:.0f}MB，"
+                  f"预算 {self.budget / 2**20:.0f}MB（没有可以换出的模型）")
+        return victims
+
+    def _load(self, entry):
+        """加载模型，返回 (model, tokenizer, 耗时)；不改 entry 的状态，调用时不持有全局锁"""
+        start = time.perf_counter()
+        tokenizer = entry.tokenizer
+        if tokenizer is None:
+            tokenizer = AutoTokenizer.from_pretrained(
+                entry.model_id, trust_remote_code=entry.load_kwargs.get("trust_remote_code", False))
+        if entry.snapshot is not None:
+            print(f"⚡ 从快照映射模型 {entry.name}...")
+            model = self._load_snapshot(entry)
+        else:
+            print(f"🚀 正在加载模型 {entry.name} ({entry.model_id})...")
+            model = entry.model_cls.from_pretrained(entry.model_id, **entry.load_kwargs)
+        model.eval()
+        return model, tokenizer, round(time.perf_counter() - start, 2)
+
+    def _save_snapshot(self, entry):
+        path = os.path.join(self.snapshot_dir, entry.name)
+        os.makedirs(path, exist_ok=True)
+        model = entry.model
+        model.config.save_pretrained(path)
+        if getattr(model, "generation_config", None) is not None:
+            model.generation_config.save_pretrained(path)
+        # 参数和 buffer（包括不进 state_dict 的 rotary inv_freq 之类）都存下来，共享的权重只存一份
+        tensors = {name: t for name, t in model.named_parameters(remove_duplicate=False)}
+        tensors.update(model.named_buffers(remove_duplicate=False))
+        torch.save(tensors, os.path.join(path, "weights.pt"))
+        return path
+
+    def _load_snapshot(self, entry):
+        path = entry.snapshot
+        config = AutoConfig.from_pretrained(path, trust_remote_code=entry.load_kwargs.get("trust_remote_code", False))
+        # 在 meta 设备上只搭结构，不分配也不初始化权重
+        with torch.device("meta"):
+            model = entry.model_cls.from_config(
+                config, trust_remote_code=entry.load_kwargs.get("trust_remote_code", False))
+        tensors = torch.load(os.path.join(path, "weights.pt"), mmap=True, weights_only=True)
+        for name, tensor in tensors.items():
+            module_name, _, attr = name.rpartition(".")
+            module = model.get_submodule(module_name)
+            if attr in module._parameters:
+                module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+            else:
+                module._buffers[attr] = tensor
+        if os.path.exists(os.path.join(path, "generation_config.json")):
+            model.generation_config = GenerationConfig.from_pretrained(path)
+        return model
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    import sys
+
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else 2500
+    registry = ModelRegistry(budget_mb=budget)
+    registry.register("qwen-0.5b").register("blenderbot-400m", model_cls=AutoModelForSeq2SeqLM)
+
+    prompt = "你好，请介绍一下你自己。"
+    print(f"内存预算 {budget}MB，两个模型轮流使用")
+    for name in ["qwen-0.5b", "blenderbot-400m", "qwen-0.5b", "blenderbot-400m"]:
+        with registry.use(name) as (model, tokenizer):
+            inputs = tokenizer(prompt, return_tensors="pt")
+            with torch.no_grad():
+                output = model.generate(**inputs, max_new_tokens=20, do_sample=False)
+        entry = registry.entries[name]
+        print(f"  {name:<16} 加载 {entry.last_load_seconds}s  常驻 {registry.resident_bytes() / 2**20:.0f}MB  "
+              f"输出: {tokenizer.decode(output[0][-20:], skip_special_tokens=True)[:30]!r}")
+    print(registry.stats())
+
+
+if __name__ == "__main__":
+    main()
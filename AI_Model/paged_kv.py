@@ -0,0 +1,325 @@
+import math
+from collections import OrderedDict, deque
+
+import torch
+from transformers.cache_utils import Cache, DynamicLayer
+
+from kv_quant import dequantize_int8, quantize_int8
+
+
+class BlockPool:
+    """
+    分页 KV 缓存池：启动时一次性申请固定大小的内存，切成一个个 block（每块存 block_size 个 token 的 KV）
+    - 每个请求只持有一张 block 表，不再各自拼接增长连续的大张量，内存峰值在启动时就确定了
+    - block 带引用计数：相同前缀（同一个系统提示词、同一段历史）的请求直接共享 block，不复制
+    - 已写满的 block 按“前缀 hash”登记，请求结束后先留着（可被淘汰），下一轮对话还能直接复用
+    - kv_quant="int8" 时 KV 按 int8 存（每个 token 每个头一个缩放系数），同样的内存能放下约 3.7 倍的 token（head_dim=64），
+      注意力计算前再临时还原成 dtype
+    """
+
+    def __init__(self, num_layers, num_kv_heads, head_dim, num_blocks, block_size=16,
+                 dtype=torch.float32, device="cpu", kv_quant=None):
+        self.num_layers = num_layers
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.dtype = dtype
+        self.kv_quant = kv_quant
+        shape = (num_layers, num_kv_heads, num_blocks, block_size, head_dim)
+        store_dtype = torch.int8 if kv_quant == "int8" else dtype
+        # zeros 会立刻占用物理内存，之后无论多少请求进来都不会再涨
+        self.keys = torch.zeros(shape, dtype=store_dtype, device=device)
+        self.values = torch.zeros(shape, dtype=store_dtype, device=device)
+        if kv_quant == "int8":
+            self.key_scales = torch.zeros(shape[:-1], dtype=torch.float32, device=device)
+            self.value_scales = torch.zeros(shape[:-1], dtype=torch.float32, device=device)
+        elif kv_quant is not None:
+            raise ValueError(f"不支持的 KV 量化方式: {kv_quant}")
+
+        self.ref_counts = [0] * num_blocks
+        self.free = deque(range(num_blocks))
+        self.reserved = 0                  # 已经承诺给在跑请求、但还没真正分配的 block 数
+        self.hash_to_block = {}            # 前缀 hash -> block
+        self.block_to_hash = {}
+        self.evictable = OrderedDict()     # 没人用但内容还有效的 block（LRU）
+
+    @staticmethod
+    def block_bytes(num_layers, num_kv_heads, head_dim, block_size=16, dtype=torch.float32, kv_quant=None):
+        """一个 block（K 和 V）占多少字节"""
+        per_token = head_dim * (1 if kv_quant == "int8" else torch.finfo(dtype).bits // 8)
+        if kv_quant == "int8":
+            per_token += 4  # float32 缩放系数
+        return 2 * num_layers * num_kv_heads * block_size * per_token
+
+    @classmethod
+    def from_budget(cls, config, budget_bytes, block_size=16, dtype=torch.float32, device="cpu", kv_quant=None):
+        """按内存预算（字节）计算能放多少个 block"""
+        head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+        kv_heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+        per_block = cls.block_bytes(config.num_hidden_layers, kv_heads, head_dim, block_size, dtype, kv_quant)
+        num_blocks = max(1, int(budget_bytes // per_block))
+        return cls(config.num_hidden_layers, kv_heads, head_dim, num_blocks, block_size, dtype, device, kv_quant)
+
+    @property
+    def bytes_per_block(self):
+        _, heads, _, _, head_dim = self.keys.shape
+        return self.block_bytes(self.num_layers, heads, head_dim, self.block_size, self.dtype, self.kv_quant)
+
+    def num_available(self):
+        """还能分配出去的 block 数（空闲的 + 可淘汰的 - 已承诺的）"""
+        return len(self.free) + len(self.evictable) - self.reserved
+
+    def blocks_needed(self, num_tokens):
+        return math.ceil(num_tokens / self.block_size)
+
+    # ---------- 分配与释放 ----------
+
+    def reserve(self, num_blocks):
+        """准入检查：能预留就预留并返回 True，否则返回 False（请求继续排队）"""
+        if num_blocks > self.num_available():
+            return False
+        self.reserved += num_blocks
+        return True
+
+    def unreserve(self, num_blocks):
+        self.reserved -= num_blocks
+
+    def allocate(self, reserved=True):
+        """取一个空 block；reserved=False 表示调用方没有预留，池子必须还有余量"""
+        if reserved:
+            self.reserved -= 1
+        elif self.num_available() <= 0:
+            raise RuntimeError("KV 缓存池已满")
+        if self.free:
+            block = self.free.popleft()
+        elif self.evictable:
+            block, _ = self.evictable.popitem(last=False)
+            del self.hash_to_block[self.block_to_hash.pop(block)]
+        else:
+            raise RuntimeError("KV 缓存池已满")
+        self.ref_counts[block] = 1
+        return block
+
+    def acquire(self, block):
+        if self.ref_counts[block] == 0:
+            self.evictable.pop(block, None)
+        self.ref_counts[block] += 1
+
+    def release(self, block):
+        self.ref_counts[block] -= 1
+        if self.ref_counts[block] == 0:
+            if block in self.block_to_hash:
+                self.evictable[block] = None
+            else:
+                self.free.append(block)
+
+    def copy_block(self, src, reserved=True):
+        """写时复制：共享的 block 要写入新 token 前，先复制一份给自己"""
+        dst = self.allocate(reserved)
+        self.keys[:, :, dst] = self.keys[:, :, src]
+        self.values[:, :, dst] = self.values[:, :, src]
+        if self.kv_quant:
+            self.key_scales[:, :, dst] = self.key_scales[:, :, src]
+            self.value_scales[:, :, dst] = self.value_scales[:, :, src]
+        self.release(src)
+        return dst
+
+    # ---------- 读写 ----------
+
+    def write(self, layer, block, offset, keys, values):
+        """把一段新 token 的 KV（[头数, token 数, head_dim]）写进一个 block"""
+        end = offset + keys.shape[1]
+        if self.kv_quant:
+            keys, k_scale = quantize_int8(keys)
+            values, v_scale = quantize_int8(values)
+            self.key_scales[layer, :, block, offset:end] = k_scale
+            self.value_scales[layer, :, block, offset:end] = v_scale
+        self.keys[layer, :, block, offset:end] = keys
+        self.values[layer, :, block, offset:end] = values
+
+    def gather(self, layer, table, length):
+        """按 block 表取出一层的前 length 个 token 的 KV（临时张量，算完注意力就释放）"""
+        k = self.keys[layer][:, table].flatten(1, 2)[:, :length]
+        v = self.values[layer][:, table].flatten(1, 2)[:, :length]
+        if self.kv_quant:
+            k = dequantize_int8(k, self.key_scales[layer][:, table].flatten(1, 2)[:, :length], self.dtype)
+            v = dequantize_int8(v, self.value_scales[layer][:, table].flatten(1, 2)[:, :length], self.dtype)
+        return k, v
+
+    def unregister(self, block):
+        h = self.block_to_hash.pop(block, None)
+        if h is not None:
+            del self.hash_to_block[h]
+
+    # ---------- 前缀共享 ----------
+
+    def _hashes(self, token_ids, num_blocks):
+        h, out = None, []
+        for i in range(num_blocks):
+            h = hash((h, tuple(token_ids[i * self.block_size:(i + 1) * self.block_size])))
+            out.append(h)
+        return out
+
+    def match_prefix(self, token_ids):
+        """找出已缓存的最长前缀 block（引用计数 +1），至少留一个 token 给模型计算"""
+        blocks = []
+        for h in self._hashes(token_ids, (len(token_ids) - 1) // self.block_size):
+            block = self.hash_to_block.get(h)
+            if block is None:
+                break
+            self.acquire(block)
+            blocks.append(block)
+        return blocks
+
+    def register(self, block_table, token_ids, num_tokens):
+        """把已经写满的 block 按前缀 hash 登记，供之后的请求复用"""
+        full = num_tokens // self.block_size
+        for block, h in zip(block_table[:full], self._hashes(token_ids, full)):
+            if h not in self.hash_to_block and block not in self.block_to_hash:
+                self.hash_to_block[h] = block
+                self.block_to_hash[block] = h
+
+    def usage(self):
+        used = self.num_blocks - len(self.free) - len(self.evictable)
+        return {
+            "blocks_total": self.num_blocks,
+            "blocks_used": used,
+            "blocks_cached": len(self.evictable),
+            "blocks_reserved": self.reserved,
+            "pool_mb": round(self.num_blocks * self.bytes_per_block / 2**20, 1),
+            "kv_quant": self.kv_quant,
+        }
+
+
+class PagedLayer(DynamicLayer):
+    """一层的 KV：数据在 BlockPool 里，按 block 表取出来交给注意力计算"""
+
+    def __init__(self, cache, layer_idx):
+        super().__init__()
+        self.cache = cache
+        self.layer_idx = layer_idx
+        self.length = cache.num_tokens
+
+    def lazy_initialization(self, key_states, value_states):
+        self.dtype, self.device = key_states.dtype, key_states.device
+        self.is_initialized = True
+
+    def update(self, key_states, value_states, *args, **kwargs):
+        if not self.is_initialized:
+            self.lazy_initialization(key_states, value_states)
+        cache, pool = self.cache, self.cache.pool
+        n = key_states.shape[-2]
+        if self.layer_idx == 0:
+            cache.prepare_write(self.length, n)
+
+        # 逐个 block 写入新 token
+        pos, written = self.length, 0
+        while written < n:
+            block = cache.block_table[pos // pool.block_size]
+            offset = pos % pool.block_size
+            take = min(pool.block_size - offset, n - written)
+            pool.write(self.layer_idx, block, offset,
+                       key_states[0, :, written:written + take], value_states[0, :, written:written + take])
+            pos += take
+            written += take
+        self.length += n
+
+        # 按 block 表一次性取出
+        k, v = pool.gather(self.layer_idx, cache.table_tensor(), self.length)
+        return k.unsqueeze(0), v.unsqueeze(0)
+
+    def get_seq_length(self):
+        return self.length
+
+    def crop(self, tokens_to_remove):
+        if tokens_to_remove < 0:
+            self.length = max(0, self.length + tokens_to_remove)
+
+
+class PagedKVCache(Cache):
+    """单个请求的分页 KV 缓存，可以直接作为 past_key_values 传给 HF 模型"""
+
+    def __init__(self, pool, block_table=None, num_tokens=0, reserved=0):
+        self.pool = pool
+        self.block_table = list(block_table or [])
+        self.num_tokens = num_tokens
+        self.reserved = reserved   # 准入时为这个请求预留、还没用掉的 block 数
+        self._table_tensor = None
+        super().__init__(layers=[PagedLayer(self, i) for i in range(pool.num_layers)])
+
+    def table_tensor(self):
+        if self._table_tensor is None or len(self._table_tensor) != len(self.block_table):
+            self._table_tensor = torch.tensor(self.block_table, dtype=torch.long, device=self.pool.keys.device)
+        return self._table_tensor
+
+    def _take_reservation(self):
+        if self.reserved > 0:
+            self.reserved -= 1
+            return True
+        return False
+
+    def prepare_write(self, start, n):
+        """第 0 层写入前调用：补齐需要的 block，并对要写入的共享 block 做写时复制"""
+        pool = self.pool
+        first, last = start // pool.block_size, (start + n - 1) // pool.block_size
+        for i in range(first, min(last + 1, len(self.block_table))):
+            block = self.block_table[i]
+            if pool.ref_counts[block] > 1:
+                self.block_table[i] = pool.copy_block(block, self._take_reservation())
+                self._table_tensor = None
+            else:
+                # 内容要被改写，不能再被当作缓存前缀
+                pool.unregister(block)
+        while len(self.block_table) <= last:
+            self.block_table.append(pool.allocate(self._take_reservation()))
+        self.num_tokens = start + n
+
+    def crop(self, tokens_to_remove):
+        super().crop(tokens_to_remove)
+        self.num_tokens = self.layers[0].length
+
+    def fork(self):
+        """复制出一个共享全部 block 的新缓存（写时复制）"""
+        for block in self.block_table:
+            self.pool.acquire(block)
+        return PagedKVCache(self.pool, self.block_table, self.num_tokens)
+
+    def free(self):
+        """归还全部 block 和没用完的预留"""
+        for block in self.block_table:
+            self.pool.release(block)
+        self.pool.unreserve(self.reserved)
+        self.reserved = 0
+        self.block_table = []
+        self._table_tensor = None
+
+
+class BatchedPagedLayer(DynamicLayer):
+    """batch 里每一行各自写进自己的分页缓存，再把取出的 KV 按 batch 拼起来"""
+
+    def __init__(self, batch, layer_idx):
+        super().__init__()
+        self.batch = batch
+        self.layer_idx = layer_idx
+        self.is_initialized = True
+
+    def update(self, key_states, value_states, *args, **kwargs):
+        keys, values = [], []
+        for i, cache in enumerate(self.batch.caches):
+            k, v = cache.layers[self.layer_idx].update(key_states[i:i + 1], value_states[i:i + 1])
+            keys.append(k)
+            values.append(v)
+        return torch.cat(keys), torch.cat(values)
+
+    def get_seq_length(self):
+        return self.batch.caches[0].layers[self.layer_idx].length
+
+
+class BatchedPagedKVCache(Cache):
+    """
+    把几个长度相同的分页缓存当成一个 batch 传给模型（同一前缀 fork 出来的候选续写一起 decode）
+    caches 列表可以随时删掉已经结束的行
+    """
+
+    def __init__(self, caches):
+        self.caches = list(caches)
+        super().__init__(layers=[BatchedPagedLayer(self, i) for i in range(self.caches[0].pool.num_layers)])
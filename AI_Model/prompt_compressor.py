@@ -0,0 +1,244 @@
+import re
+import time
+from collections import OrderedDict
+
+import torch
+
+# 口语里常见、几乎不带信息的填充词
+FILLERS = ["嗯", "啊", "呃", "哦", "哈哈", "那个", "就是说", "就是", "然后", "其实", "好的", "对的", "的话", "总之",
+           "一般来说", "基本上", "可以说", "怎么说呢", "你知道", "um", "uh", "like", "you know", "basically", "actually"]
+_SPLIT = re.compile(r"(?<=[。！？；，、,.!?;\n])")
+_FILLER = re.compile("|".join(sorted(map(re.escape, FILLERS), key=len, reverse=True)), re.IGNORECASE)
+
+
+class PromptCompressor:
+    """
+    prefill 前压缩旧的对话历史：把旧消息切成短句，按信息量打分，丢掉分数低的，直到只剩 ratio 左右的字数
+    - 系统提示词、最近 keep_recent_turns 轮和当前问题原样保留
+    - 打分默认用便宜的启发式（新内容占比 - 填充词占比 + 数字/英文占比，名字、数字、代码通常最重要）；
+      传入 model 时改用小模型算每个 token 的自信息（-log p），越出乎意料的内容越要保留
+    - 每条消息只依赖自己的内容打分，结果按内容缓存：同一条历史在之后的每轮对话里压缩结果都一样，
+      既不用重复打分，也不会破坏 KV 前缀缓存
+    """
+
+    def __init__(self, ratio=0.5, keep_recent_turns=2, model=None, tokenizer=None, min_chars=20, cache_size=2048):
+        self.ratio = ratio
+        self.keep_recent_turns = keep_recent_turns
+        self.model = model
+        self.tokenizer = tokenizer
+        self.min_chars = min_chars          # 太短的消息不压缩
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.original_chars = 0
+        self.compressed_chars = 0
+
+    @staticmethod
+    def split_spans(text):
+        return [s for s in _SPLIT.split(text) if s]
+
+    def _heuristic_scores(self, spans):
+        seen, scores = set(), []
+        for span in spans:
+            bigrams = {span[i:i + 2] for i in range(len(span) - 1)} or {span}
+            novelty = len(bigrams - seen) / len(bigrams)
+            seen |= bigrams
+            filler = sum(len(m) for m in _FILLER.findall(span)) / len(span)
+            marked = sum(c.isdigit() or c.isascii() and c.isalpha() for c in span) / len(span)
+            scores.append(novelty - filler + 0.5 * marked)
+        return scores
+
+    def _model_scores(self, text, spans):
+        enc = self.tokenizer(text, return_offsets_mapping=True)
+        ids, offsets = enc["input_ids"], enc["offset_mapping"]
+        with torch.inference_mode():
+            logits = self.model(input_ids=torch.tensor([ids], device=self.model.device)).logits[0].float()
+        surprisal = [0.0] + (-logits[:-1].log_softmax(-1).gather(1, torch.tensor(ids[1:])[:, None])[:, 0]).tolist()
+        if len(surprisal) > 1:
+            surprisal[0] = sum(surprisal[1:]) / (len(surprisal) - 1)
+
+        scores, start, t = [], 0, 0
+        for span in spans:
+            end = start + len(span)
+            values = []
+            while t < len(ids) and offsets[t][0] < end:
+                values.append(surprisal[t])
+                t += 1
+            scores.append(sum(values) / len(values) if values else 0.0)
+            start = end
+        return scores
+
+    def compress_text(self, text):
+        """压缩一条消息，至少保留分数最高的一句"""
+        key = (text, self.ratio)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        spans = self.split_spans(text)
+        if len(text) < self.min_chars or len(spans) < 2:
+            result = text
+        else:
+            scores = self._model_scores(text, spans) if self.model is not None else self._heuristic_scores(spans)
+            keep, kept_chars = set(), 0
+            for i in sorted(range(len(spans)), key=lambda i: scores[i], reverse=True):
+                if keep and kept_chars >= self.ratio * len(text):
+                    break
+                keep.add(i)
+                kept_chars += len(spans[i])
+            result = "".join(span for i, span in enumerate(spans) if i in keep)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def compress(self, messages):
+        """返回 (压缩后的消息列表, 统计)；messages 的第一条如果是 system 原样保留"""
+        start = time.perf_counter()
+        head = messages[:1] if messages and messages[0]["role"] == "system" else []
+        body = messages[len(head):]
+        # 最近 keep_recent_turns 轮加上当前问题（最后一条）原样保留
+        keep = min(len(body), 2 * self.keep_recent_turns + 1)
+        old, recent = body[:len(body) - keep], body[len(body) - keep:]
+
+        compressed = [{**m, "content": self.compress_text(m["content"])} for m in old]
+        before = sum(len(m["content"]) for m in old)
+        after = sum(len(m["content"]) for m in compressed)
+        self.original_chars += before
+        self.compressed_chars += after
+        return head + compressed + recent, {
+            "old_messages": len(old), "original_chars": before, "compressed_chars": after,
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+
+    def stats(self):
+        return {
+            "ratio": self.ratio,
+            "original_chars": self.original_chars,
+            "compressed_chars": self.compressed_chars,
+            "cached_messages": len(self.cache),
+        }
+
+
+# ==================== 固定评估集 ====================
+# 每段对话里，答案藏在较早的几轮（会被压缩），中间夹着大量口语填充；看压缩后还能不能答对
+
+EVAL_SET = [
+    {
+        "history": [
+            ("嗯，那个，其实我就是想先说一下，我叫王小明，然后我是做前端开发的，基本上每天都在写代码，怎么说呢，挺累的。",
+             "你好王小明！前端开发确实很辛苦，有什么我可以帮你的吗？"),
+            ("哦好的，然后就是说，我最近在学 Python，感觉还挺有意思的，嗯，就是有时候有点难。", "学习 Python 是个好选择，遇到问题随时问我。"),
+            ("哈哈对的，总之我下周三要去杭州出差，呃，大概待三天吧。", "好的，祝你出差顺利！"),
+            ("嗯嗯，谢谢。", "不客气！"),
+        ],
+        "question": "我叫什么名字？",
+        "answer": "你叫王小明。",
+    },
+    {
+        "history": [
+            ("其实吧，我家那只猫，嗯，名字叫橘子，然后它今年三岁了，基本上每天都在睡觉，哈哈。", "橘子听起来很可爱！三岁的猫正是活泼的年纪。"),
+            ("对的对的，然后就是说它特别喜欢吃鱼，一般来说一天要吃两顿。", "猫喜欢吃鱼很常见，注意控制盐分。"),
+            ("好的，嗯，我知道了，那个，明天天气怎么样你知道吗？", "我无法实时查询天气，建议看一下天气预报。"),
+            ("哦哦好吧。", "还有什么想聊的吗？"),
+        ],
+        "question": "我的猫叫什么？几岁了？",
+        "answer": "你的猫叫橘子，今年三岁。",
+    },
+    {
+        "history": [
+            ("嗯，就是，我的订单号是 A20240518，然后那个，我买的是一台蓝色的电风扇，怎么说呢，到现在还没发货。",
+             "抱歉让您久等了，我记下了订单号 A20240518。"),
+            ("然后其实我比较着急，基本上这周就要用，呃，天太热了。", "理解您的心情，我会尽快帮您催促发货。"),
+            ("好的好的，那个，顺便问一下你们周末上班吗？", "客服周末正常上班，9 点到 18 点。"),
+            ("嗯，明白了。", "还有其他问题吗？"),
+        ],
+        "question": "我的订单号是多少？",
+        "answer": "您的订单号是 A20240518。",
+    },
+    {
+        "history": [
+            ("那个，我想写一个小说，嗯，主角叫林风，然后他是一个剑客，其实就是很普通的那种武侠故事。",
+             "好的，林风这个名字很有武侠味道，可以从他的身世写起。"),
+            ("对的，然后就是说他的师父叫玄机子，基本上是个隐世高人，哈哈。", "玄机子这个角色可以作为林风成长的引路人。"),
+            ("嗯嗯，总之先这样，那个，你觉得开头怎么写比较好？", "可以从一个雨夜写起，营造悬念。"),
+            ("好的，我想想。", "慢慢来，有想法随时告诉我。"),
+        ],
+        "question": "主角的师父叫什么？",
+        "answer": "主角林风的师父叫玄机子。",
+    },
+]
+
+
+def build_messages(item, system="你是一个简明扼要、专业的 AI 助手。"):
+    messages = [{"role": "system", "content": system}]
+    for user, assistant in item["history"]:
+        messages += [{"role": "user", "content": user}, {"role": "assistant", "content": assistant}]
+    return messages + [{"role": "user", "content": item["question"]}]
+
+
+def evaluate(model, tokenizer, compressor, eval_set=EVAL_SET, repeat=3):
+    """
+    对比原始 prompt 和压缩后的 prompt：prefill 耗时（取 repeat 次里最快的）、prompt token 数，
+    以及参考答案的平均负对数似然（越低越好，差值就是压缩带来的回答质量变化）
+    """
+    def run(messages):
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prompt_ids = tokenizer(text)["input_ids"]
+        best = float("inf")
+        with torch.inference_mode():
+            for _ in range(repeat):
+                start = time.perf_counter()
+                model(input_ids=torch.tensor([prompt_ids]), logits_to_keep=1)
+                best = min(best, time.perf_counter() - start)
+        return prompt_ids, best
+
+    def answer_nll(prompt_ids, answer):
+        answer_ids = tokenizer(answer + tokenizer.eos_token)["input_ids"]
+        ids = torch.tensor([prompt_ids + answer_ids])
+        with torch.inference_mode():
+            logp = model(input_ids=ids).logits[0, len(prompt_ids) - 1:-1].float().log_softmax(-1)
+        return -logp.gather(1, torch.tensor(answer_ids)[:, None]).mean().item()
+
+    rows = []
+    for item in eval_set:
+        full = build_messages(item)
+        short, stats = compressor.compress(full)
+        full_ids, full_time = run(full)
+        short_ids, short_time = run(short)
+        rows.append({
+            "tokens": (len(full_ids), len(short_ids)),
+            "prefill_seconds": (full_time, short_time),
+            "answer_nll": (answer_nll(full_ids, item["answer"]), answer_nll(short_ids, item["answer"])),
+            "compress_seconds": stats["seconds"],
+        })
+
+    def total(key, i):
+        return sum(r[key][i] for r in rows)
+    n = len(rows)
+    return {
+        "cases": n,
+        "prompt_tokens": (total("tokens", 0), total("tokens", 1)),
+        "prefill_ms": (round(total("prefill_seconds", 0) * 1000, 1), round(total("prefill_seconds", 1) * 1000, 1)),
+        "compress_ms": round(sum(r["compress_seconds"] for r in rows) * 1000, 1),
+        "answer_nll": (round(total("answer_nll", 0) / n, 4), round(total("answer_nll", 1) / n, 4)),
+        "rows": rows,
+    }
+
+
+def main():
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model_name = "Qwen/Qwen2.5-0.5B-Instruct"
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, device_map={"": "cpu"})
+
+    print(f"评估集 {len(EVAL_SET)} 段对话（{model_name}），只压缩最近 2 轮之前的历史")
+    for name, compressor in (("启发式", PromptCompressor(ratio=0.5, keep_recent_turns=1)),
+                             ("小模型打分", PromptCompressor(ratio=0.5, keep_recent_turns=1, model=model, tokenizer=tokenizer))):
+        r = evaluate(model, tokenizer, compressor)
+        (t0, t1), (p0, p1), (n0, n1) = r["prompt_tokens"], r["prefill_ms"], r["answer_nll"]
+        print(f"  {name}: prompt {t0} -> {t1} token ({1 - t1 / t0:.0%} 更少)，prefill {p0}ms -> {p1}ms "
+              f"(省 {p0 - p1:.1f}ms，压缩本身 {r['compress_ms']}ms)，参考答案 NLL {n0} -> {n1} ({n1 - n0:+.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import time
+
+import torch
+from transformers import DynamicCache
+
+from sampling import sample_next_token
+
+
+class PromptLookupDecoder:
+    """
+    Prompt Lookup 解码（不需要草稿模型）
+    小说续写、引用用户原话时，输出经常重复上下文里已有的片段：
+    用最后 n 个 token 去上下文里找相同的 n-gram，把它后面的 token 当作候选，
+    一次前向同时验证所有候选，猜中几个就一次性多出几个 token。
+    找不到候选、或者命中率太低时，自动退回普通的逐 token 解码。
+    """
+
+    def __init__(self, model, ngram_size=3, num_pred_tokens=10,
+                 min_accept_rate=0.1, warmup_steps=20):
+        self.model = model
+        self.ngram_size = ngram_size            # 最长用几个 token 去匹配
+        self.num_pred_tokens = num_pred_tokens  # 每次最多猜几个 token
+        self.min_accept_rate = min_accept_rate  # 命中率低于它就停止猜测
+        self.warmup_steps = warmup_steps        # 至少猜这么多次再判断命中率
+        self.stats = {}
+
+    # ---------- n-gram 索引：增量维护“某个 n-gram 最近一次出现在哪” ----------
+
+    def _reset_index(self):
+        self._index = {n: {} for n in range(1, self.ngram_size + 1)}
+        self._indexed = 1
+
+    def _update_index(self, ids):
+        # 只登记后面已经有后续 token 的 n-gram（不包括当前结尾本身）
+        for j in range(self._indexed, len(ids)):
+            for n, table in self._index.items():
+                if j >= n:
+                    table[tuple(ids[j - n:j])] = j
+        self._indexed = len(ids)
+
+    def find_candidates(self, ids, limit):
+        """用结尾的 n-gram（从长到短）匹配上下文，返回匹配处后面的 token 作为候选"""
+        self._update_index(ids)
+        for n in range(min(self.ngram_size, len(ids)), 0, -1):
+            start = self._index[n].get(tuple(ids[-n:]))
+            if start is not None:
+                return ids[start:start + limit]
+        return []
+
+    # ---------- 生成 ----------
+
+    @torch.no_grad()
+    def generate(self, input_ids, attention_mask=None, streamer=None, max_new_tokens=512,
+                 do_sample=True, temperature=1.0, top_p=1.0, repetition_penalty=1.0,
+                 eos_token_id=None, **kwargs):
+        """用法与 model.generate 相同（单条输入），返回包含 prompt 的完整 token 序列"""
+        if eos_token_id is None:
+            eos_token_id = self.model.generation_config.eos_token_id
+        eos_ids = set(eos_token_id if isinstance(eos_token_id, (list, tuple)) else [eos_token_id])
+        sample_kwargs = dict(do_sample=do_sample, temperature=temperature, top_p=top_p,
+                             repetition_penalty=repetition_penalty)
+
+        start_time = time.perf_counter()
+        ids = input_ids[0].tolist()
+        prompt_len = len(ids)
+        self._reset_index()
+        forward_passes = proposed = accepted = 0
+        lookup_enabled = self.num_pred_tokens > 0
+
+        if streamer is not None:
+            streamer.put(input_ids[0].cpu())
+
+        # 1. prefill
+        cache = DynamicCache()
+        out = self.model(input_ids=input_ids, past_key_values=cache, use_cache=True)
+        forward_passes += 1
+        token = sample_next_token(out.logits[0, -1], ids, **sample_kwargs)
+        ids.append(token)
+        if streamer is not None:
+            streamer.put(torch.tensor([token]))
+
+        # 2. 猜测 + 一次前向验证
+        while len(ids) - prompt_len < max_new_tokens and token not in eos_ids:
+            remaining = max_new_tokens - (len(ids) - prompt_len)
+            candidates = self.find_candidates(ids, min(self.num_pred_tokens, remaining - 1)) if lookup_enabled else []
+
+            step_input = torch.tensor([[ids[-1]] + candidates], device=input_ids.device)
+            out = self.model(input_ids=step_input, past_key_values=cache, use_cache=True)
+            forward_passes += 1
+            proposed += len(candidates)
+
+            new_tokens = []
+            for i in range(len(candidates) + 1):
+                token = sample_next_token(out.logits[0, i], ids, **sample_kwargs)
+                ids.append(token)
+                new_tokens.append(token)
+                if token in eos_ids or i == len(candidates) or token != candidates[i]:
+                    break
+                accepted += 1
+
+            # 没被接受的候选对应的 KV 要丢掉（负数表示从末尾删掉几个）
+            rejected = cache.get_seq_length() - (len(ids) - 1)
+            if rejected > 0:
+                cache.crop(-rejected)
+            if streamer is not None:
+                streamer.put(torch.tensor(new_tokens))
+
+            if lookup_enabled and proposed >= self.warmup_steps * self.num_pred_tokens:
+                lookup_enabled = accepted / proposed >= self.min_accept_rate
+
+        if streamer is not None:
+            streamer.end()
+
+        generated = len(ids) - prompt_len
+        self.stats = {
+            "new_tokens": generated,
+            "forward_passes": forward_passes,
+            "proposed": proposed,
+            "accepted": accepted,
+            "accept_rate": accepted / proposed if proposed else 0.0,
+            # 普通解码每个 token 需要一次前向，这里是平均每次前向产出的 token 数
+            "tokens_per_forward": generated / max(forward_passes - 1, 1),
+            "seconds": time.perf_counter() - start_time,
+        }
+        return torch.tensor([ids], device=input_ids.device)
+
+    def report(self):
+        s = self.stats
+        if not s:
+            return "尚未生成"
+        return (f"Prompt Lookup: 生成 {s['new_tokens']} 个 token，前向 {s['forward_passes']} 次，"
+                f"候选命中率 {s['accept_rate']:.1%}，平均每次前向 {s['tokens_per_forward']:.2f} 个 token，"
+                f"用时 {s['seconds']:.2f}s")
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model_name = "Qwen/Qwen2.5-0.5B-Instruct"
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, device_map={"": "cpu"})
+
+    # 让模型复述/改写上下文，是 prompt lookup 最擅长的场景
+    article = ("夜色渐深，长安城的灯火一盏盏熄灭。李白独自坐在酒肆的角落里，望着窗外的月亮，"
+               "手中的酒杯迟迟没有放下。他想起了远方的故乡，想起了少年时仗剑远游的日子。") * 3
+    messages = [{"role": "user", "content": f"请把下面这段文字原样抄写一遍，只修改错别字：\n{article}"}]
+    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    inputs = tokenizer([text], return_tensors="pt")
+    gen_kwargs = dict(max_new_tokens=256, do_sample=False, repetition_penalty=1.0)
+
+    start = time.perf_counter()
+    baseline = model.generate(**inputs, **gen_kwargs)
+    baseline_time = time.perf_counter() - start
+
+    decoder = PromptLookupDecoder(model)
+    output = decoder.generate(**inputs, **gen_kwargs)
+    print(decoder.report())
+    print(f"普通解码 {baseline_time:.2f}s -> Prompt Lookup {decoder.stats['seconds']:.2f}s，"
+          f"加速 {baseline_time / decoder.stats['seconds']:.2f}x")
+    print(f"贪心解码结果一致: {baseline[0].tolist() == output[0].tolist()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import torch
+
+
+def sample_next_token(logits, prev_ids, do_sample=True, temperature=1.0, top_p=1.0,
+                      repetition_penalty=1.0, generator=None):
+    """
+    对单个位置的 logits 采样下一个 token，行为与 model.generate 的同名参数一致：
+    repetition_penalty -> temperature -> top_p -> 采样（do_sample=False 时直接取最大值）
+    """
+    logits = logits.float()
+
+    if repetition_penalty != 1.0 and len(prev_ids):
+        idx = torch.as_tensor(list(set(prev_ids)), dtype=torch.long)
+        picked = logits[idx]
+        logits[idx] = torch.where(picked < 0, picked * repetition_penalty, picked / repetition_penalty)
+
+    if not do_sample:
+        return int(logits.argmax())
+
+    logits = logits / max(temperature, 1e-5)
+
+    if top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, descending=True)
+        cum_probs = sorted_logits.softmax(-1).cumsum(-1)
+        # 保留累计概率刚好超过 top_p 的最小集合（至少保留 1 个）
+        remove = cum_probs - sorted_logits.softmax(-1) > top_p
+        sorted_logits[remove] = float("-inf")
+        logits = torch.full_like(logits, float("-inf")).scatter(0, sorted_idx, sorted_logits)
+
+    probs = logits.softmax(-1)
+    return int(torch.multinomial(probs, 1, generator=generator))
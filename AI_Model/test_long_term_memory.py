@@ -0,0 +1,28 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from long_term_memory import MemoryStore
+
+
+def test_concurrent_build_context_indexes_each_turn_once():
+    """/chat 和 /draft 同时带着同一段历史进来时，每轮旧对话只建一次索引"""
+    store = MemoryStore(window=2)
+    history = []
+    for i in range(400):
+        history += [{"role": "user", "content": f"问题{i} 苹果{i}"}, {"role": "assistant", "content": f"回答{i}"}]
+    barrier = threading.Barrier(8)
+
+    def call():
+        barrier.wait()
+        store.build_context("s", history, "苹果")
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    memory = store.sessions["s"]
+    assert len(memory) == (len(history) - 2) // 2
+    assert len({user for user, _ in memory.turns}) == len(memory)
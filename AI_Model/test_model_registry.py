@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from model_registry import ModelRegistry
+
+
+class SlowModel(torch.nn.Linear):
+    """from_pretrained 故意很慢，模拟加载大模型"""
+    delay = 0.0
+    calls = 0
+
+    @classmethod
+    def from_pretrained(cls, model_id, **kwargs):
+        cls.calls += 1
+        time.sleep(cls.delay)
+        return cls(4, 4)
+
+
+def make_registry():
+    registry = ModelRegistry()
+    for name in ("small", "large"):
+        registry.register(name, name, model_cls=SlowModel)
+        registry.entries[name].tokenizer = object()  # 跳过分词器下载
+    return registry
+
+
+def test_loading_one_model_does_not_block_another():
+    registry = make_registry()
+    SlowModel.delay, SlowModel.calls = 0.0, 0
+    registry.get("small")
+
+    SlowModel.delay = 1.0
+    loader = threading.Thread(target=registry.get, args=("large",))
+    loader.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    with registry.use("small"):
+        pass
+    registry.stats()
+    assert time.perf_counter() - start < 0.5
+    loader.join()
+
+
+def test_concurrent_callers_share_one_load():
+    registry = make_registry()
+    SlowModel.delay, SlowModel.calls = 0.3, 0
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("large"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SlowModel.calls == 1
+    assert all(model is results[0][0] for model, _ in results)
+
+
+def test_writing_a_snapshot_does_not_block_other_models():
+    registry = ModelRegistry(budget_mb=200 / 2**20)  # 只放得下两个 4x4 的小模型（每个 80 字节）
+    for name in ("a", "b", "c"):
+        registry.register(name, name, model_cls=SlowModel)
+        registry.entries[name].tokenizer = object()
+    SlowModel.delay, SlowModel.calls = 0.0, 0
+    registry.get("a")
+    registry.get("b")
+
+    def slow_save(entry):
+        time.sleep(1.0)
+        return f"/tmp/{entry.name}"
+    registry._save_snapshot = slow_save
+
+    loader = threading.Thread(target=registry.get, args=("c",))  # 放不下，要先把最久没用的 a 换出
+    loader.start()
+    time.sleep(0.1)
+    assert registry.entries["a"].evicting is not None
+    start = time.perf_counter()
+    with registry.use("b"):
+        pass
+    registry.stats()
+    assert time.perf_counter() - start < 0.5
+    loader.join()
+    assert registry.entries["a"].model is None and registry.entries["a"].snapshot == "/tmp/a"
+    assert registry.entries["c"].model is not None
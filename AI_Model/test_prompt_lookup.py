@@ -0,0 +1,38 @@
+import os
+import sys
+
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from prompt_lookup import PromptLookupDecoder
+
+
+class RecordingStreamer:
+    def __init__(self):
+        self.chunks = []
+
+    def put(self, value):
+        self.chunks.append(value.tolist())
+
+    def end(self):
+        pass
+
+
+def tiny_model():
+    torch.manual_seed(0)
+    config = Qwen2Config(vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=256, eos_token_id=63)
+    return Qwen2ForCausalLM(config).eval()
+
+
+def test_every_generated_token_is_streamed():
+    decoder = PromptLookupDecoder(tiny_model())
+    input_ids = torch.tensor([[1, 2, 3, 4, 1, 2, 3, 4, 1, 2]])
+    for max_new_tokens in (1, 30):
+        streamer = RecordingStreamer()
+        with torch.no_grad():
+            ids = decoder.generate(input_ids, streamer=streamer, max_new_tokens=max_new_tokens, do_sample=False)
+        prompt, *generated = streamer.chunks
+        assert prompt == input_ids[0].tolist()
+        assert sum(generated, []) == ids[0, input_ids.shape[1]:].tolist()
@@ -0,0 +1,156 @@
+import math
+from functools import partial
+
+import torch
+from transformers import AttentionInterface
+from transformers.masking_utils import AttentionMaskInterface, sdpa_mask
+
+# 较新的 torch 在 CPU 上的 sdpa 本身已是分块实现，两者内存接近、sdpa 更快；
+# 旧版 torch、或者只能用 eager（完整注意力矩阵）的情况下，用它替换才明显省内存
+NAME = "tiled"
+
+
+def tiled_attention(query, key, value, attention_mask=None, scaling=None, q_tile=128, k_tile=512):
+    """
+    分块注意力（online softmax）：query 和 key 都按块处理，每次只算 q_tile x k_tile 的一小块分数，
+    边算边更新每行的最大值、分母和加权和，整个 q x k 的注意力矩阵从头到尾不会出现在内存里
+    - query [B, H, q, D]，key/value [B, KVH, k, D]，返回 [B, H, q, D]
+    - attention_mask 为 None 时按因果掩码（query 对齐 key 的末尾），完全在未来的 key 块直接跳过；
+      否则是 [B, 1 或 H, q, k] 的 bool（True 表示可见）或加性 float 掩码，只按块切片使用
+    - GQA 的 query 头按组共用 key 头，不复制 key/value；块内按 float32 累加
+    """
+    b, h, q_len, d = query.shape
+    kvh, k_len = key.shape[1], key.shape[2]
+    g = h // kvh
+    scaling = scaling if scaling is not None else 1 / math.sqrt(d)
+    offset = k_len - q_len
+    q_all = query.reshape(b, kvh, g, q_len, d)
+    k_all, v_all = key[:, :, None], value[:, :, None]
+    if attention_mask is not None:
+        # [B, 1, q, k] 广播到所有头，[B, H, q, k] 按 GQA 分组
+        attention_mask = attention_mask.reshape(b, -1, 1, q_len, k_len) if attention_mask.shape[1] == 1 \
+            else attention_mask.reshape(b, kvh, g, q_len, k_len)
+    out = torch.empty(b, kvh, g, q_len, d, dtype=query.dtype, device=query.device)
+
+    for q0 in range(0, q_len, q_tile):
+        q1 = min(q0 + q_tile, q_len)
+        q = q_all[:, :, :, q0:q1].float() * scaling
+        row_max = torch.full((b, kvh, g, q1 - q0, 1), -math.inf, device=query.device)
+        row_sum = torch.zeros_like(row_max)
+        acc = torch.zeros(b, kvh, g, q1 - q0, d, device=query.device)
+        # 因果：这块 query 最多看到第 offset + q1 - 1 个 key
+        k_end = k_len if attention_mask is not None else min(k_len, offset + q1)
+        for k0 in range(0, k_end, k_tile):
+            k1 = min(k0 + k_tile, k_end)
+            scores = q @ k_all[:, :, :, k0:k1].float().transpose(-1, -2)
+            if attention_mask is not None:
+                mask = attention_mask[..., q0:q1, k0:k1]
+                if mask.dtype == torch.bool:
+                    scores.masked_fill_(~mask, -math.inf)
+                else:
+                    scores.add_(mask)
+            elif k1 > offset + q0 + 1:
+                # 只有跨过对角线的块需要因果掩码
+                rows = torch.arange(q0 + offset, q1 + offset, device=query.device)[:, None]
+                cols = torch.arange(k0, k1, device=query.device)[None, :]
+                scores.masked_fill_(cols > rows, -math.inf)
+
+            new_max = torch.maximum(row_max, scores.amax(-1, keepdim=True))
+            # 整行都被掩掉时最大值还是 -inf，用 0 代替，避免 exp(-inf - -inf) 得到 nan
+            safe_max = new_max.masked_fill(new_max == -math.inf, 0)
+            probs = scores.sub_(safe_max).exp_()  # 原地算，块内不再多分配一份
+            correction = (row_max - safe_max).exp_()
+            row_sum.mul_(correction).add_(probs.sum(-1, keepdim=True))
+            acc.mul_(correction).add_(probs @ v_all[:, :, :, k0:k1].float())
+            row_max = new_max
+        out[:, :, :, q0:q1] = (acc / row_sum.clamp_min(1e-30)).to(out.dtype)
+    return out.view(b, h, q_len, d)
+
+
+def tiled_attention_forward(module, query, key, value, attention_mask, dropout=0.0, scaling=None,
+                            q_tile=128, k_tile=512, **kwargs):
+    """transformers 的注意力接口（只用于推理，不支持 dropout 和输出注意力权重）"""
+    out = tiled_attention(query, key, value, attention_mask, scaling, q_tile, k_tile)
+    return out.transpose(1, 2).contiguous(), None
+
+
+def register(name=NAME, q_tile=128, k_tile=512):
+    """
+    注册成 transformers 的一种注意力实现，之后 from_pretrained(attn_implementation=name)
+    或 model.set_attn_implementation(name) 就能用上。
+    掩码沿用 sdpa 的规则：没有 padding 的纯因果情况不生成掩码（由上面的函数自己处理因果），
+    分块 prefill 等必须要掩码时才生成 [B, 1, q, k] 的 bool 掩码
+    """
+    AttentionInterface.register(name, partial(tiled_attention_forward, q_tile=q_tile, k_tile=k_tile))
+    AttentionMaskInterface.register(name, sdpa_mask)
+    return name
+
+
+register()
+
+
+# ==================== 基准测试 ====================
+
+def run_trial(model_id, impl, length, chunk):
+    """子进程里跑一次：加载模型，prefill length 个 token，返回耗时和 RSS 峰值的增量"""
+    import resource
+    import time
+    from transformers import AutoModelForCausalLM, DynamicCache
+
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32, device_map={"": "cpu"},
+                                                 attn_implementation=impl)
+    model.eval()
+    ids = torch.randint(1000, 20000, (1, length), generator=torch.Generator().manual_seed(0))
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with torch.inference_mode():
+        cache = DynamicCache(config=model.config)
+        # chunk 不为 0 时像生成引擎一样分块 prefill（每块都要带掩码）
+        for i in range(0, length, chunk or length):
+            out = model(input_ids=ids[:, i:i + (chunk or length)], past_key_values=cache, use_cache=True,
+                        logits_to_keep=1)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"seconds": round(seconds, 2), "peak_delta_mb": round((peak - base) / 1024),
+            "logit": round(out.logits[0, -1, :4].float().sum().item(), 3)}
+
+
+def main():
+    import argparse
+    import json
+    import subprocess
+    import sys
+
+    parser = argparse.ArgumentParser(description="分块注意力 vs 默认实现：长上下文 prefill 的耗时和内存峰值")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--lengths", default="4096,8192,16384,32768")
+    parser.add_argument("--impls", default=f"sdpa,eager,{NAME}")
+    parser.add_argument("--chunk", type=int, default=0, help="分块 prefill 的块大小，0 表示一次 prefill")
+    parser.add_argument("--eager-max", type=int, default=4096, help="eager 会生成完整注意力矩阵，超过这个长度不测")
+    parser.add_argument("--trial", help=argparse.SUPPRESS)  # 子进程：impl,length
+    args = parser.parse_args()
+
+    if args.trial:
+        impl, length = args.trial.split(",")
+        print(json.dumps(run_trial(args.model, impl, int(length), args.chunk)))
+        return
+
+    print(f"{args.model}，prefill {'一次完成' if not args.chunk else f'每块 {args.chunk} token'}，"
+          f"每组在单独的子进程里测 RSS 峰值增量")
+    for length in map(int, args.lengths.split(",")):
+        for impl in args.impls.split(","):
+            if impl == "eager" and length > args.eager_max:
+                continue
+            # 每组单独一个进程，RSS 峰值互不影响
+            proc = subprocess.run([sys.executable, __file__, "--model", args.model, "--chunk", str(args.chunk),
+                                   "--trial", f"{impl},{length}"], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"  {length:>6} {impl:<6} 失败: {proc.stderr.strip().splitlines()[-1:]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"  {length:>6} {impl:<6} prefill {r['seconds']:>7.2f}s  RSS 峰值 +{r['peak_delta_mb']}MB  "
+                  f"(logit 校验 {r['logit']})")
+
+
+if __name__ == "__main__":
+    main()
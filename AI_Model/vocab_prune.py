@@ -0,0 +1,162 @@
+import json
+import os
+import time
+from collections import Counter
+
+import torch
+
+
+class PrunedHead:
+    """
+    裁剪后的输出层：只对常用 token 算 logits（Qwen2.5 有 15 万个 token，中文对话实际用到的只是一小部分）
+    - keep_ids 是保留的 token，采样在子集上做，选中后再映射回原来的 token id
+    - 安全兜底：prompt 里出现子集外的 token，或者每隔 verify_every 步抽查发现完整输出层的最优 token 不在子集里，
+      这个请求之后就改用完整输出层，不会因为裁剪而说不出某个字
+    """
+
+    def __init__(self, lm_head, keep_ids, verify_every=16):
+        self.lm_head = lm_head
+        vocab_size = lm_head.weight.shape[0]
+        self.keep_ids = torch.tensor(sorted(set(i for i in keep_ids if i < vocab_size)), dtype=torch.long)
+        # 子集的权重单独拷贝一份，连续存放，矩阵乘法更快
+        self.weight = lm_head.weight.detach()[self.keep_ids].contiguous()
+        self.bias = None if lm_head.bias is None else lm_head.bias.detach()[self.keep_ids].contiguous()
+        self.to_subset = torch.full((vocab_size,), -1, dtype=torch.long)
+        self.to_subset[self.keep_ids] = torch.arange(len(self.keep_ids))
+        self.verify_every = verify_every
+        self.fallbacks = 0
+
+    def __len__(self):
+        return len(self.keep_ids)
+
+    def covers(self, token_ids):
+        ids = torch.as_tensor(list(token_ids), dtype=torch.long)
+        return bool((ids < len(self.to_subset)).all() and (self.to_subset[ids] >= 0).all())
+
+    def subset_ids(self, token_ids):
+        """把原始 token id 映射到子集下标（不在子集里的丢掉），给重复惩罚用"""
+        ids = self.to_subset[torch.as_tensor(list(token_ids), dtype=torch.long)]
+        return ids[ids >= 0].tolist()
+
+    def logits(self, hidden, state):
+        """
+        返回 (logits, id_map)：id_map 为 None 表示用的是完整输出层，否则采样结果 i 对应 token id_map[i]
+        state 是每个请求自己的字典，记录是否已经退回完整输出层
+        """
+        if state.get("full"):
+            return self.lm_head(hidden), None
+        state["steps"] = state.get("steps", 0) + 1
+        if self.verify_every and state["steps"] % self.verify_every == 0:
+            full = self.lm_head(hidden)
+            if self.to_subset[int(full.argmax())] < 0:
+                state["full"] = True
+                self.fallbacks += 1
+                return full, None
+        logits = hidden @ self.weight.T
+        if self.bias is not None:
+            logits = logits + self.bias
+        return logits, self.keep_ids
+
+    def save(self, path, **meta):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({**meta, "keep_ids": self.keep_ids.tolist()}, f)
+
+    @classmethod
+    def load(cls, path, model, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(model.get_output_embeddings(), data["keep_ids"], **kwargs)
+
+
+def build_vocab(tokenizer, texts, min_count=1):
+    """从语料统计出现过的 token，再加上特殊 token 和 256 个字节 token（保证任何文字都能拼出来）"""
+    from tokenizers.pre_tokenizers import ByteLevel
+
+    counts = Counter()
+    for text in texts:
+        counts.update(tokenizer(text)["input_ids"])
+    keep = {i for i, n in counts.items() if n >= min_count}
+    keep.update(tokenizer.all_special_ids)
+    keep.update(tokenizer.convert_tokens_to_ids(list(tokenizer.get_added_vocab())))
+    byte_ids = tokenizer.convert_tokens_to_ids(ByteLevel.alphabet())
+    keep.update(i for i in byte_ids if i is not None and i != tokenizer.unk_token_id)
+    return sorted(keep), counts
+
+
+def read_corpus(paths):
+    """读取语料：.jsonl 取每行的 text/content/message 字段，其余文件按行读取"""
+    texts = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if path.endswith(".jsonl"):
+                    item = json.loads(line)
+                    line = item.get("text") or item.get("content") or item.get("message") or ""
+                texts.append(line)
+    return texts
+
+
+# ==================== 构建与基准测试 ====================
+
+def bench(model, tokenizer, head, prompt, steps=100):
+    """同一段 prompt 分别用完整输出层和裁剪输出层贪心解码，比较 tokens/s"""
+    from transformers import DynamicCache
+
+    decoder = model.get_decoder()
+    ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+    results = {}
+    for name in ("full", "pruned"):
+        cache = DynamicCache()
+        state = {"full": name == "full"}
+        with torch.inference_mode():
+            hidden = decoder(input_ids=ids, past_key_values=cache, use_cache=True).last_hidden_state[0, -1]
+            out = []
+            start = time.perf_counter()
+            for _ in range(steps):
+                logits, id_map = head.logits(hidden, state)
+                token = int(logits.argmax()) if id_map is None else int(id_map[logits.argmax()])
+                out.append(token)
+                hidden = decoder(input_ids=torch.tensor([[token]]), past_key_values=cache,
+                                 use_cache=True).last_hidden_state[0, -1]
+        results[name] = (steps / (time.perf_counter() - start), out)
+    return results
+
+
+def main():
+    import argparse
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AI_Test", "data")
+    parser = argparse.ArgumentParser(description="从语料裁剪输出层词表，并测试解码速度")
+    parser.add_argument("corpus", nargs="*", default=[os.path.join(data_dir, "intents.jsonl")])
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--min-count", type=int, default=1)
+    parser.add_argument("--out", default="vocab_subset.json")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32, device_map={"": "cpu"})
+
+    texts = read_corpus(args.corpus)
+    keep_ids, counts = build_vocab(tokenizer, texts, args.min_count)
+    head = PrunedHead(model.get_output_embeddings(), keep_ids)
+    head.save(args.out, model=args.model, corpus=args.corpus, min_count=args.min_count)
+    print(f"语料 {len(texts)} 条，出现过 {len(counts)} 种 token，保留 {len(head)} / {model.config.vocab_size} 个 "
+          f"({len(head) / model.config.vocab_size:.1%})，已保存到 {args.out}")
+
+    prompt = tokenizer.apply_chat_template([{"role": "user", "content": "你好，请介绍一下你自己。"}],
+                                           tokenize=False, add_generation_prompt=True)
+    results = bench(model, tokenizer, head, prompt)
+    full_speed, full_out = results["full"]
+    pruned_speed, pruned_out = results["pruned"]
+    same = next((i for i, (a, b) in enumerate(zip(full_out, pruned_out)) if a != b), len(full_out))
+    print(f"解码速度: 完整输出层 {full_speed:.1f} tokens/s -> 裁剪输出层 {pruned_speed:.1f} tokens/s "
+          f"({pruned_speed / full_speed:.2f}x)")
+    print(f"贪心解码前 {same} 个 token 与完整输出层一致，退回完整输出层 {head.fallbacks} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 # 规则匹配聊天机器人
+from faq_index import FaqIndex
+
 responses = {
     "你好": "你好！我是AI助手。",
     "你叫什么名字": "我是Python AI助手。",
@@ -6,7 +8,12 @@ responses = {
     "再见": "再见！祝你有个美好的一天！"
 }
 
-def simple_chatbot():
+def simple_chatbot(faq_path=None):
+    # 模糊匹配索引：多打了标点、个别错字也能找到答案；faq_path 可批量加载更多问答
+    faq = FaqIndex.from_dict(responses)
+    if faq_path:
+        faq.load_file(faq_path)
+    
     print("AI助手已启动！输入'再见'结束对话。")
     
     while True:
@@ -17,7 +24,7 @@ def simple_chatbot():
             break
         
         # 查找匹配的回复
-        reply = responses.get(user_input, "我不太明白，请换种方式问问看。")
+        reply = faq.lookup(user_input, "我不太明白，请换种方式问问看。")
         print("AI: " + reply)
 
 if __name__ == "__main__":
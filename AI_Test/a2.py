@@ -1,8 +1,9 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 import re
+from ngram_intent import NgramIntentModel
 
 class IntentClassifier:
-    def __init__(self):
+    def __init__(self, ngram_model: Optional[NgramIntentModel] = None, threshold: float = 0.6):
         # 意图和对应的模式
         self.intent_patterns = {
             "greeting": [
@@ -30,8 +31,12 @@ class IntentClassifier:
             "goodbye": "感谢咨询，再见！欢迎下次再来！",
             "default": "这个问题我需要学习一下，您可以换个方式问问吗？"
         }
+        
+        # 正则都匹配不到时的兜底：n-gram 线性分类器，置信度够高才采用
+        self.ngram_model = ngram_model or NgramIntentModel.load_or_train()
+        self.threshold = threshold
     
-    def classify_intent(self, text: str) -> str:
+    def match_patterns(self, text: str) -> Optional[str]:
         text = text.lower()
         
         for intent, patterns in self.intent_patterns.items():
@@ -39,7 +44,23 @@ class IntentClassifier:
                 if re.search(pattern, text):
                     return intent
         
-        return "default"
+        return None
+    
+    def classify_intent(self, text: str) -> str:
+        return self.classify_batch([text])[0]
+    
+    def classify_batch(self, texts: List[str]) -> List[str]:
+        """批量识别：先走正则，剩下的一次性交给 n-gram 模型打分"""
+        intents = [self.match_patterns(text) for text in texts]
+        pending = [i for i, intent in enumerate(intents) if intent is None]
+        
+        if pending and self.ngram_model is not None:
+            predictions = self.ngram_model.predict([texts[i] for i in pending])
+            for i, (intent, conf) in zip(pending, predictions):
+                if conf >= self.threshold and intent in self.intent_responses:
+                    intents[i] = intent
+        
+        return [intent or "default" for intent in intents]
     
     def respond(self, user_input: str) -> str:
         intent = self.classify_intent(user_input)
@@ -1,11 +1,16 @@
 from typing import Dict, List, Optional, Tuple
+import os
 import re
 import json
-from datetime import datetime
+import time
 import random
+from session_manager import SessionManager, SessionState
+from gazetteer import DATA_DIR, Gazetteer, WeatherStore
 
 class MultiTurnChatbot:
-    def __init__(self):
+    def __init__(self, session_manager: Optional[SessionManager] = None,
+                 gazetteer: Optional[Gazetteer] = None,
+                 weather_store: Optional[WeatherStore] = None):
         # 意图和对应的模式
         self.intent_patterns = {
             "greeting": [r"你好", r"您好", r"hi", r"hello"],
@@ -25,34 +30,29 @@ class MultiTurnChatbot:
             "default": "这个问题我需要学习一下，您可以换个方式问问吗？"
         }
         
-        # 对话状态：记录当前正在进行的任务
-        self.conversation_state = {
-            "current_intent": None,      # 当前意图
-            "waiting_for": None,         # 等待什么信息
-            "collected_info": {},        # 已收集的信息
-            "last_intent": None,         # 上一个意图
-            "user_name": None,           # 用户名（可扩展）
-            "conversation_history": []   # 对话历史
-        }
+        # 对话状态：每个用户一份，由会话管理器按 session_id 保存
+        self.sessions = session_manager or SessionManager()
         
-        # 天气数据库（模拟）
-        self.weather_data = {
+        # 天气数据库（模拟），可以换成磁盘上的 WeatherStore("weather.db")
+        self.weather_store = weather_store or WeatherStore.from_dict({
             "马来西亚": {"temp": "28-32°C", "condition": "多云转雷阵雨", "humidity": "85%"},
             "北京": {"temp": "5-12°C", "condition": "晴", "humidity": "45%"},
             "上海": {"temp": "10-18°C", "condition": "阴转小雨", "humidity": "75%"},
             "纽约": {"temp": "8-15°C", "condition": "多云", "humidity": "60%"},
             "东京": {"temp": "12-20°C", "condition": "晴", "humidity": "55%"}
-        }
+        })
         
-        # 实体识别关键词
-        self.location_keywords = ["马来西亚", "北京", "上海", "纽约", "东京", "伦敦", "巴黎"]
+        # 实体识别：地名词典（含别名），一次扫描找最长地名
+        if gazetteer is None:
+            gazetteer = Gazetteer.from_file(os.path.join(DATA_DIR, "places.tsv"))
+        self.gazetteer = gazetteer
     
-    def classify_intent(self, text: str) -> str:
+    def classify_intent(self, text: str, state: Optional[SessionState] = None) -> str:
         """识别用户意图"""
         text = text.lower()
         
         # 首先检查是否在回答之前的问题
-        if self.conversation_state["waiting_for"] == "city":
+        if state is not None and state.waiting_for == "city":
             if self.extract_location(text):
                 return "provide_city"
         
@@ -66,12 +66,10 @@ class MultiTurnChatbot:
     
     def extract_location(self, text: str) -> Optional[str]:
         """从文本中提取地点"""
-        text_lower = text.lower()
-        
-        # 简单关键词匹配
-        for location in self.location_keywords:
-            if location.lower() in text_lower:
-                return location
+        # 地名词典匹配
+        location = self.gazetteer.find_longest(text)
+        if location:
+            return location
         
         # 如果包含"天气在"或"的天气"
         if "天气" in text:
@@ -86,21 +84,21 @@ class MultiTurnChatbot:
     
     def get_weather_info(self, city: str) -> str:
         """获取天气信息"""
-        if city in self.weather_data:
-            data = self.weather_data[city]
+        data = self.weather_store.get(city)
+        if data:
             return f"{city}的天气：{data['condition']}，温度{data['temp']}，湿度{data['humidity']}"
         else:
-            return f"抱歉，我还没有{city}的天气数据。目前支持查询：{', '.join(list(self.weather_data.keys())[:5])}"
+            return f"抱歉，我还没有{city}的天气数据。目前支持查询：{', '.join(self.weather_store.sample_cities(5))}"
     
-    def handle_weather_flow(self, user_input: str) -> Tuple[str, bool]:
+    def handle_weather_flow(self, user_input: str, state: SessionState) -> Tuple[str, bool]:
         """处理天气查询的多轮对话"""
         # 检查是否已经有城市信息
-        if "city" in self.conversation_state["collected_info"]:
-            city = self.conversation_state["collected_info"]["city"]
+        if state.collected_info and "city" in state.collected_info:
+            city = state.collected_info["city"]
             weather_info = self.get_weather_info(city)
             
             # 重置状态
-            self.reset_conversation_state()
+            self.reset_conversation_state(state)
             
             # 添加后续问题
             follow_up = random.choice([
@@ -115,11 +113,11 @@ class MultiTurnChatbot:
         else:
             location = self.extract_location(user_input)
             if location:
-                self.conversation_state["collected_info"]["city"] = location
+                state.collected_info = {"city": location}
                 weather_info = self.get_weather_info(location)
                 
                 # 重置状态
-                self.reset_conversation_state()
+                self.reset_conversation_state(state)
                 
                 follow_up = random.choice([
                     "\n还想知道其他城市的天气吗？",
@@ -129,38 +127,33 @@ class MultiTurnChatbot:
                 return weather_info + follow_up, False
             else:
                 # 需要用户提供城市
-                self.conversation_state["waiting_for"] = "city"
+                state.waiting_for = "city"
                 return self.base_responses["ask_weather"], True
     
-    def reset_conversation_state(self):
+    def reset_conversation_state(self, state: SessionState):
         """重置对话状态（一轮对话结束）"""
-        self.conversation_state["current_intent"] = None
-        self.conversation_state["waiting_for"] = None
-        self.conversation_state["collected_info"] = {}
+        state.reset()
     
-    def save_conversation(self, user_input: str, ai_response: str):
-        """保存对话历史"""
-        self.conversation_state["conversation_history"].append({
-            "user": user_input,
-            "ai": ai_response,
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
-        
-        # 保持最近10轮对话
-        if len(self.conversation_state["conversation_history"]) > 10:
-            self.conversation_state["conversation_history"] = self.conversation_state["conversation_history"][-10:]
+    def save_conversation(self, state: SessionState, user_input: str, ai_response: str):
+        """保存对话历史（环形缓冲区只保留最近10条，时间戳在显示时才格式化）"""
+        state.history.append((user_input, ai_response, time.time()))
+    
+    def respond(self, user_input: str, session_id: str = "default") -> str:
+        """生成回复（核心方法），每个 session_id 各自维护对话状态"""
+        with self.sessions.session(session_id) as state:
+            return self._respond(user_input, state)
     
-    def respond(self, user_input: str) -> str:
-        """生成回复（核心方法）"""
+    def _respond(self, user_input: str, state: SessionState) -> str:
+        """单个会话内的回复逻辑（调用方已持有该会话的锁）"""
         # 识别意图
-        intent = self.classify_intent(user_input)
+        intent = self.classify_intent(user_input, state)
         
         # 更新对话状态
-        self.conversation_state["last_intent"] = self.conversation_state["current_intent"]
-        self.conversation_state["current_intent"] = intent
+        state.last_intent = state.current_intent
+        state.current_intent = intent
         
         # 保存用户输入
-        self.save_conversation(user_input, "")
+        self.save_conversation(state, user_input, "")
         
         # 根据意图和状态生成回复
         response = ""
@@ -169,7 +162,7 @@ class MultiTurnChatbot:
         if intent == "provide_city":
             location = self.extract_location(user_input)
             if location:
-                self.conversation_state["collected_info"]["city"] = location
+                state.collected_info = {"city": location}
                 weather_info = self.get_weather_info(location)
                 response = weather_info
                 
@@ -182,13 +175,13 @@ class MultiTurnChatbot:
                 response += follow_up
                 
                 # 重置状态
-                self.reset_conversation_state()
+                self.reset_conversation_state(state)
             else:
                 response = "抱歉，我没听清楚是哪个城市，请再说一遍城市名称。"
         
         # 查询天气（开始多轮对话）
         elif intent == "ask_weather":
-            response, is_waiting = self.handle_weather_flow(user_input)
+            response, is_waiting = self.handle_weather_flow(user_input, state)
         
         # 其他意图
         elif intent in self.base_responses:
@@ -196,16 +189,16 @@ class MultiTurnChatbot:
             
             # 如果是问天气，设置等待状态
             if intent == "ask_weather":
-                self.conversation_state["waiting_for"] = "city"
+                state.waiting_for = "city"
         
         else:
             # 检查是否在等待信息
-            if self.conversation_state["waiting_for"] == "city":
+            if state.waiting_for == "city":
                 location = self.extract_location(user_input)
                 if location:
                     weather_info = self.get_weather_info(location)
                     response = weather_info
-                    self.reset_conversation_state()
+                    self.reset_conversation_state(state)
                     
                     # 添加后续问题
                     follow_up = random.choice([
@@ -219,31 +212,33 @@ class MultiTurnChatbot:
                 response = self.base_responses["default"]
         
         # 保存AI回复
-        self.save_conversation("", response)
+        self.save_conversation(state, "", response)
         
         return response
     
-    def show_conversation_history(self):
+    def show_conversation_history(self, session_id: str = "default"):
         """显示对话历史"""
+        state = self.sessions.peek(session_id) or SessionState()
         print("\n" + "="*60)
         print("对话历史记录：")
         print("="*60)
-        for i, turn in enumerate(self.conversation_state["conversation_history"], 1):
-            if turn["user"]:
-                print(f"[{turn['time']}]")
-                print(f"👤 您: {turn['user']}")
-            if turn["ai"]:
-                print(f"🤖 AI: {turn['ai']}")
+        for user, ai, ts in state.history:
+            if user:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))}]")
+                print(f"👤 您: {user}")
+            if ai:
+                print(f"🤖 AI: {ai}")
                 print("-"*40)
     
-    def get_conversation_status(self):
+    def get_conversation_status(self, session_id: str = "default"):
         """获取当前对话状态"""
+        state = self.sessions.peek(session_id) or SessionState()
         status = f"""
 当前对话状态：
-- 当前意图: {self.conversation_state['current_intent']}
-- 等待信息: {self.conversation_state['waiting_for']}
-- 已收集: {json.dumps(self.conversation_state['collected_info'], ensure_ascii=False)}
-- 历史记录数: {len(self.conversation_state['conversation_history'])}
+- 当前意图: {state.current_intent}
+- 等待信息: {state.waiting_for}
+- 已收集: {json.dumps(state.collected_info or {}, ensure_ascii=False)}
+- 历史记录数: {len(state.history)}
         """
         return status
 
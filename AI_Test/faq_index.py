@@ -0,0 +1,161 @@
+import heapq
+import json
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def normalize(text: str) -> str:
+    """统一全角/半角、大小写，去掉标点和空白"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PZSC")
+
+
+def bigrams(text: str) -> List[str]:
+    text = f"^{text}$"
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein 距离，超过 limit 就提前放弃（返回 limit + 1）"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+class FaqIndex:
+    """
+    模糊问答索引：字符二元组倒排索引召回候选，再用编辑距离精排
+    标点、空格、大小写差异和个别错别字都能匹配到原问题
+    """
+
+    def __init__(self, threshold: float = 0.6, max_candidates: int = 8, max_df: int = 2000):
+        self.threshold = threshold            # 相似度低于它就当作没匹配上
+        self.max_candidates = max_candidates  # 进入精排的候选数量
+        self.max_df = max_df                  # 太常见的二元组（如“怎么”）不参与召回
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self._exact: Dict[str, int] = {}
+        self._postings = defaultdict(lambda: array("I"))
+
+    def add(self, question: str, answer: str):
+        key = normalize(question)
+        if key in self._exact:
+            self.answers[self._exact[key]] = answer
+            return
+        doc_id = len(self.questions)
+        self.questions.append(key)
+        self.answers.append(answer)
+        self._exact[key] = doc_id
+        for gram in set(bigrams(key)):
+            self._postings[gram].append(doc_id)
+
+    def add_many(self, pairs: Iterable[Tuple[str, str]]):
+        for question, answer in pairs:
+            self.add(question, answer)
+
+    def load_file(self, path: str):
+        """批量加载：.jsonl 每行 {"question": ..., "answer": ...}，其他文件按 `问题<TAB>回答` 读取"""
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                rows = (json.loads(line) for line in f if line.strip())
+                self.add_many((row["question"], row["answer"]) for row in rows)
+            else:
+                rows = (line.rstrip("\n").split("\t", 1) for line in f)
+                self.add_many((row[0], row[1]) for row in rows if len(row) == 2)
+
+    @classmethod
+    def from_dict(cls, responses: Dict[str, str], **kwargs) -> "FaqIndex":
+        index = cls(**kwargs)
+        index.add_many(responses.items())
+        return index
+
+    def search(self, query: str) -> Optional[Tuple[str, float]]:
+        """返回 (最相近的原问题, 相似度)，低于阈值返回 None"""
+        key = normalize(query)
+        if not key:
+            return None
+        if key in self._exact:
+            return self.questions[self._exact[key]], 1.0
+
+        # 1. 召回：统计候选与查询共享的二元组个数
+        grams = set(bigrams(key))
+        postings = [self._postings[g] for g in grams if g in self._postings]
+        rare = [p for p in postings if len(p) <= self.max_df]
+        counts = defaultdict(int)
+        for posting in (rare or postings):
+            for doc_id in posting:
+                counts[doc_id] += 1
+        if not counts:
+            return None
+        candidates = heapq.nlargest(self.max_candidates, counts, key=counts.get)
+
+        # 2. 精排：编辑距离换算成相似度
+        best, best_score = None, 0.0
+        for doc_id in candidates:
+            question = self.questions[doc_id]
+            longest = max(len(question), len(key))
+            limit = int(longest * (1 - self.threshold))
+            score = 1 - edit_distance(key, question, limit) / longest
+            if score > best_score:
+                best, best_score = doc_id, score
+        if best is None or best_score < self.threshold:
+            return None
+        return self.questions[best], best_score
+
+    def lookup(self, query: str, default: Optional[str] = None) -> Optional[str]:
+        """直接返回最相近问题对应的回答"""
+        key = normalize(query)
+        if key in self._exact:
+            return self.answers[self._exact[key]]
+        hit = self.search(query)
+        return self.answers[self._exact[hit[0]]] if hit else default
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    import random
+
+    print("=" * 60)
+    print("模糊问答索引基准测试：10 万条问答")
+    print("=" * 60)
+
+    rnd = random.Random(0)
+    chars = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    pairs = [("".join(rnd.choice(chars) for _ in range(rnd.randint(6, 16))), f"回答{i}")
+             for i in range(100_000)]
+
+    start = time.perf_counter()
+    index = FaqIndex()
+    index.add_many(pairs)
+    print(f"建索引: {time.perf_counter() - start:.2f}s")
+
+    # 构造带标点和错别字的变体查询
+    queries = []
+    for question, _ in rnd.sample(pairs, 2000):
+        chars_q = list(question)
+        chars_q[rnd.randrange(len(chars_q))] = rnd.choice(chars)
+        queries.append("".join(chars_q) + "？")
+
+    start = time.perf_counter()
+    hits = sum(index.lookup(q) is not None for q in queries)
+    elapsed = time.perf_counter() - start
+    print(f"模糊查询: {elapsed / len(queries) * 1000:.3f} 毫秒/次，命中率 {hits / len(queries):.1%}")
+
+
+if __name__ == "__main__":
+    main()
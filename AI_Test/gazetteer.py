@@ -0,0 +1,215 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class Gazetteer:
+    """
+    地名词典：把所有地名和别名建成 Aho-Corasick 自动机
+    对输入文本只扫描一遍，就能找出其中最长的地名，与词典大小无关
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]   # 每个节点的字符跳转
+        self._fail: List[int] = [0]               # 失配跳转
+        self._depth: List[int] = [0]              # 节点对应的字符串长度
+        self._name: List[Optional[str]] = [None]  # 以此节点结尾的地名 -> 标准名
+        self._out: List[int] = [0]                # 在此处结束的最长地名所在节点（0 表示没有）
+        self._built = True
+        self.size = 0
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return text.lower()
+
+    def add(self, name: str, canonical: Optional[str] = None):
+        """加入一个地名（或别名），canonical 是它对应的标准城市名"""
+        node = 0
+        for ch in self._normalize(name.strip()):
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._name.append(None)
+                self._out.append(0)
+                self._goto[node][ch] = nxt
+            node = nxt
+        if node and self._name[node] is None:
+            self.size += 1
+        self._name[node] = canonical or name.strip()
+        self._built = False
+
+    def add_many(self, entries: Iterable[Tuple[str, str]]):
+        for name, canonical in entries:
+            self.add(name, canonical)
+
+    def load_file(self, path: str):
+        """批量加载地名文件：每行 `标准名[\\t别名1\\t别名2...]`，# 开头为注释"""
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line or line.startswith("#"):
+                    continue
+                names = [n for n in line.split("\t") if n.strip()]
+                canonical = names[0].strip()
+                for name in names:
+                    self.add(name, canonical)
+        self.build()
+
+    def build(self):
+        """按层（BFS）计算失配跳转，加完地名后调用一次"""
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            self._out[child] = child if self._name[child] else 0
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # 自己就是地名时一定最长，否则沿失配链继承
+                self._out[child] = child if self._name[child] else self._out[self._fail[child]]
+                queue.append(child)
+        self._built = True
+
+    def find_longest(self, text: str) -> Optional[str]:
+        """一次扫描找出文本中最长的地名（等长时取靠前的），返回标准名"""
+        if not self._built:
+            self.build()
+        goto, fail, out, depth = self._goto, self._fail, self._out, self._depth
+        node = 0
+        best = 0
+        for ch in self._normalize(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = out[node]
+            if hit and depth[hit] > depth[best]:
+                best = hit
+        return self._name[best] if best else None
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def from_file(cls, path: str) -> "Gazetteer":
+        gazetteer = cls()
+        gazetteer.load_file(path)
+        return gazetteer
+
+
+class WeatherStore:
+    """
+    天气数据表：数据放在 SQLite 里（城市名为主键索引），
+    前面挡一层 LRU 热点缓存，热门城市不用每次查库
+    """
+
+    def __init__(self, path: str = ":memory:", cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS weather ("
+            "city TEXT PRIMARY KEY, temp TEXT, condition TEXT, humidity TEXT)"
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, str]], path: str = ":memory:") -> "WeatherStore":
+        store = cls(path)
+        store.put_many(data.items())
+        return store
+
+    def put_many(self, rows: Iterable[Tuple[str, Dict[str, str]]]):
+        """批量写入（已存在的城市会被覆盖）"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO weather VALUES (?, ?, ?, ?)",
+                ((city, d["temp"], d["condition"], d["humidity"]) for city, d in rows),
+            )
+            self._conn.commit()
+            self._cache.clear()
+
+    def get(self, city: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            if city in self._cache:
+                self._cache.move_to_end(city)
+                return self._cache[city]
+            row = self._conn.execute(
+                "SELECT temp, condition, humidity FROM weather WHERE city = ?", (city,)
+            ).fetchone()
+            data = {"temp": row[0], "condition": row[1], "humidity": row[2]} if row else None
+            # 查不到的城市也缓存起来，避免反复查库
+            self._cache[city] = data
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return data
+
+    def sample_cities(self, limit: int = 5) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT city FROM weather LIMIT ?", (limit,)).fetchall()
+        return [r[0] for r in rows]
+
+    def __contains__(self, city: str) -> bool:
+        return self.get(city) is not None
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    import random
+
+    print("=" * 60)
+    print("地名词典基准测试")
+    print("=" * 60)
+
+    # 用随机汉字拼出 5 万个“城市”和各自的别名
+    rnd = random.Random(0)
+    chars = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    gazetteer = Gazetteer.from_file(os.path.join(DATA_DIR, "places.tsv"))
+    names = set()
+    while len(names) < 50_000:
+        names.add("".join(rnd.choice(chars) for _ in range(rnd.randint(2, 5))))
+    start = time.perf_counter()
+    for name in names:
+        gazetteer.add(name + "市", name)
+        gazetteer.add(name, name)
+    gazetteer.build()
+    print(f"加载 {len(gazetteer)} 个地名/别名，用时 {time.perf_counter() - start:.2f}s")
+
+    queries = ["明天北京的天气怎么样", "我想知道纽约天气", "帮我查一下new york下不下雨"]
+    queries += [f"请问{name}明天会下雨吗？" for name in rnd.sample(sorted(names), 2000)]
+    start = time.perf_counter()
+    for q in queries:
+        gazetteer.find_longest(q)
+    elapsed = time.perf_counter() - start
+    print(f"地名提取: {elapsed / len(queries) * 1e6:.1f} 微秒/次")
+    for q in queries[:3]:
+        print(f"  {q} -> {gazetteer.find_longest(q)}")
+
+    store = WeatherStore.from_dict({
+        name: {"temp": "10-20°C", "condition": "晴", "humidity": "50%"} for name in names
+    })
+    hot = rnd.sample(sorted(names), 100)
+    start = time.perf_counter()
+    for _ in range(100):
+        for city in hot:
+            store.get(city)
+    elapsed = time.perf_counter() - start
+    print(f"天气查询（热点缓存）: {elapsed / 10_000 * 1e6:.1f} 微秒/次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import os
+import sys
+import time
+import zlib
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_DATA_PATH = os.path.join(DATA_DIR, "intents.jsonl")
+DEFAULT_MODEL_PATH = os.path.join(DATA_DIR, "intent_model.npz")
+
+
+class NgramIntentModel:
+    """
+    轻量意图分类器：字符 n-gram 哈希特征 + 线性 softmax 模型
+    正则匹配不到时用它兜底，整批文本一次矩阵乘法打分，不需要调用大模型
+    """
+
+    def __init__(self, dim: int = 4096, ngram_range: Tuple[int, int] = (1, 3),
+                 labels: Optional[Sequence[str]] = None):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.labels = list(labels or [])
+        self.W = np.zeros((dim, len(self.labels)), dtype=np.float32)
+        self.b = np.zeros(len(self.labels), dtype=np.float32)
+        self._bucket_cache = {}
+
+    def _bucket(self, gram: str) -> int:
+        # crc32 在不同进程间稳定（内置 hash 每次启动都会变）
+        idx = self._bucket_cache.get(gram)
+        if idx is None:
+            idx = zlib.crc32(gram.encode("utf-8")) % self.dim
+            if len(self._bucket_cache) < 200_000:
+                self._bucket_cache[gram] = idx
+        return idx
+
+    def featurize(self, texts: Sequence[str]) -> np.ndarray:
+        """把一批文本转成 (batch, dim) 的 L2 归一化 n-gram 计数矩阵"""
+        X = np.zeros((len(texts), self.dim), dtype=np.float32)
+        lo, hi = self.ngram_range
+        for row, text in enumerate(texts):
+            text = f"^{text.lower().strip()}$"
+            idx = [self._bucket(text[i:i + n])
+                   for n in range(lo, hi + 1)
+                   for i in range(len(text) - n + 1)]
+            np.add.at(X[row], idx, 1.0)
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        return X / np.maximum(norms, 1e-6)
+
+    def predict_proba(self, texts: Sequence[str], batch_size: int = 256) -> np.ndarray:
+        """批量打分，返回 (batch, 意图数) 的概率矩阵"""
+        out = np.empty((len(texts), len(self.labels)), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            logits = self.featurize(texts[start:start + batch_size]) @ self.W + self.b
+            logits -= logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            out[start:start + batch_size] = probs / probs.sum(axis=1, keepdims=True)
+        return out
+
+    def predict(self, texts: Sequence[str]) -> List[Tuple[str, float]]:
+        """返回每条文本的 (意图, 置信度)"""
+        if not texts:
+            return []
+        probs = self.predict_proba(texts)
+        best = probs.argmax(axis=1)
+        return [(self.labels[i], float(probs[row, i])) for row, i in enumerate(best)]
+
+    def fit(self, texts: Sequence[str], intents: Sequence[str], epochs: int = 300,
+            lr: float = 2.0, l2: float = 1e-4):
+        """全批量梯度下降训练 softmax 回归（数据量小，几秒内完成）"""
+        self.labels = sorted(set(intents))
+        index = {label: i for i, label in enumerate(self.labels)}
+        X = self.featurize(texts)
+        Y = np.zeros((len(texts), len(self.labels)), dtype=np.float32)
+        Y[np.arange(len(texts)), [index[i] for i in intents]] = 1.0
+
+        self.W = np.zeros((self.dim, len(self.labels)), dtype=np.float32)
+        self.b = np.zeros(len(self.labels), dtype=np.float32)
+        for _ in range(epochs):
+            logits = X @ self.W + self.b
+            logits -= logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            probs /= probs.sum(axis=1, keepdims=True)
+            grad = (probs - Y) / len(texts)
+            self.W -= lr * (X.T @ grad + l2 * self.W)
+            self.b -= lr * grad.sum(axis=0)
+        return self
+
+    def save(self, path: str):
+        np.savez_compressed(path, W=self.W, b=self.b, labels=np.array(self.labels),
+                            dim=self.dim, ngram_range=np.array(self.ngram_range))
+
+    @classmethod
+    def load(cls, path: str) -> "NgramIntentModel":
+        data = np.load(path)
+        model = cls(int(data["dim"]), tuple(int(n) for n in data["ngram_range"]),
+                    [str(label) for label in data["labels"]])
+        model.W = data["W"].astype(np.float32)
+        model.b = data["b"].astype(np.float32)
+        return model
+
+    @classmethod
+    def load_or_train(cls, model_path: str = DEFAULT_MODEL_PATH,
+                      data_path: str = DEFAULT_DATA_PATH) -> Optional["NgramIntentModel"]:
+        """优先加载离线训练好的模型；没有的话用标注数据现场训练一个"""
+        if os.path.exists(model_path):
+            return cls.load(model_path)
+        if os.path.exists(data_path):
+            texts, intents = read_jsonl(data_path)
+            return cls().fit(texts, intents)
+        return None
+
+
+def read_jsonl(path: str) -> Tuple[List[str], List[str]]:
+    """读取标注文件：每行 {"text": "...", "intent": "..."}"""
+    texts, intents = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                texts.append(item["text"])
+                intents.append(item["intent"])
+    return texts, intents
+
+
+# ==================== 训练 / 基准测试 ====================
+
+def train(data_path: str = DEFAULT_DATA_PATH, model_path: str = DEFAULT_MODEL_PATH):
+    texts, intents = read_jsonl(data_path)
+    start = time.perf_counter()
+    model = NgramIntentModel().fit(texts, intents)
+    model.save(model_path)
+    acc = np.mean([p == y for (p, _), y in zip(model.predict(texts), intents)])
+    print(f"训练完成：{len(texts)} 条样本，{len(model.labels)} 个意图，"
+          f"用时 {time.perf_counter() - start:.2f}s，训练集准确率 {acc:.1%}")
+    print(f"模型已保存至 {model_path}")
+
+
+def bench(model: NgramIntentModel, queries: Iterable[str]):
+    queries = list(queries) * 100
+    start = time.perf_counter()
+    model.predict(queries)
+    elapsed = time.perf_counter() - start
+    print(f"批量打分 {len(queries)} 条：{elapsed * 1000:.1f}ms，"
+          f"{len(queries) / elapsed:,.0f} 条/秒")
+
+
+def main():
+    # 用法：python ngram_intent.py train [标注文件] [模型文件]   离线训练并保存
+    #       python ngram_intent.py                               试跑 + 批量打分基准
+    if len(sys.argv) > 1 and sys.argv[1] == "train":
+        train(*sys.argv[2:4])
+        return
+
+    model = NgramIntentModel.load_or_train()
+    samples = ["哈喽呀", "明天会不会下大雨", "这个要几块钱", "先走了回头聊", "给我讲个笑话", "你怎么称呼"]
+    for text, (intent, conf) in zip(samples, model.predict(samples)):
+        print(f"{text} -> {intent} ({conf:.2f})")
+    bench(model, samples)
+
+
+if __name__ == "__main__":
+    main()
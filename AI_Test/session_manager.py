@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+
+class ConversationRing:
+    """固定容量的对话环形缓冲区：追加是 O(1)，满了自动覆盖最旧的一条"""
+
+    __slots__ = ("_buf", "_start", "_size")
+
+    def __init__(self, capacity: int = 10):
+        self._buf = [None] * capacity
+        self._start = 0
+        self._size = 0
+
+    def append(self, turn: Tuple[str, str, float]):
+        capacity = len(self._buf)
+        if self._size < capacity:
+            self._buf[(self._start + self._size) % capacity] = turn
+            self._size += 1
+        else:
+            # 已满：覆盖最旧的位置，起点后移
+            self._buf[self._start] = turn
+            self._start = (self._start + 1) % capacity
+
+    def clear(self):
+        self._buf = [None] * len(self._buf)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Tuple[str, str, float]]:
+        capacity = len(self._buf)
+        for i in range(self._size):
+            yield self._buf[(self._start + i) % capacity]
+
+
+class SessionState:
+    """单个用户的对话状态（__slots__ 省掉每个实例的 __dict__）"""
+
+    __slots__ = ("current_intent", "waiting_for", "collected_info",
+                 "last_intent", "user_name", "history", "last_access")
+
+    def __init__(self, history_len: int = 10):
+        self.current_intent = None      # 当前意图
+        self.waiting_for = None         # 等待什么信息
+        self.collected_info = None      # 已收集的信息（用到时才建 dict）
+        self.last_intent = None         # 上一个意图
+        self.user_name = None           # 用户名（可扩展）
+        self.history = ConversationRing(history_len)  # 对话历史 (user, ai, 时间戳)
+        self.last_access = 0.0
+
+    def reset(self):
+        """重置对话状态（一轮对话结束）"""
+        self.current_intent = None
+        self.waiting_for = None
+        self.collected_info = None
+
+
+class _Stripe:
+    __slots__ = ("lock", "sessions")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # session_id -> SessionState，按最近访问排序
+
+
+class SessionManager:
+    """
+    多用户会话管理器
+    - 每个用户一份紧凑的 SessionState
+    - 超过 ttl 秒没说话的会话过期，超过容量时淘汰最久未访问的会话 (LRU)
+    - 会话按 hash 分散到多个分段 (lock striping)，不同分段的用户互不阻塞
+    """
+
+    def __init__(self, max_sessions: int = 200_000, ttl: float = 1800.0,
+                 num_stripes: int = 64, history_len: int = 10, clock=time.monotonic):
+        self.ttl = ttl
+        self.history_len = history_len
+        self.clock = clock
+        self._stripes = [_Stripe() for _ in range(num_stripes)]
+        self._stripe_capacity = max(1, max_sessions // num_stripes)
+
+    def _stripe(self, session_id: str) -> _Stripe:
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    def _get_locked(self, stripe: _Stripe, session_id: str) -> SessionState:
+        """在已持有分段锁的前提下取出（或新建）会话"""
+        now = self.clock()
+        sessions = stripe.sessions
+        state = sessions.get(session_id)
+
+        if state is not None and now - state.last_access > self.ttl:
+            del sessions[session_id]
+            state = None
+
+        if state is None:
+            # 最久未访问的在最前面：先清掉过期的，再按容量淘汰
+            while sessions:
+                oldest = next(iter(sessions.values()))
+                if now - oldest.last_access <= self.ttl and len(sessions) < self._stripe_capacity:
+                    break
+                sessions.popitem(last=False)
+            state = SessionState(self.history_len)
+            sessions[session_id] = state
+        else:
+            sessions.move_to_end(session_id)
+
+        state.last_access = now
+        return state
+
+    @contextmanager
+    def session(self, session_id: str):
+        """持有该用户所在分段的锁，保证同一用户的一轮对话不会被并发打乱"""
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            yield self._get_locked(stripe, session_id)
+
+    def get(self, session_id: str) -> SessionState:
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            return self._get_locked(stripe, session_id)
+
+    def peek(self, session_id: str) -> Optional[SessionState]:
+        """只读查看，不刷新访问时间，也不创建新会话"""
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            return stripe.sessions.get(session_id)
+
+    def drop(self, session_id: str):
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            stripe.sessions.pop(session_id, None)
+
+    def evict_expired(self) -> int:
+        """主动清理所有过期会话，返回清理数量"""
+        now = self.clock()
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                sessions = stripe.sessions
+                while sessions:
+                    oldest = next(iter(sessions.values()))
+                    if now - oldest.last_access <= self.ttl:
+                        break
+                    sessions.popitem(last=False)
+                    removed += 1
+        return removed
+
+    def __len__(self) -> int:
+        return sum(len(stripe.sessions) for stripe in self._stripes)
+
+
+# ==================== 基准测试 ====================
+
+def main():
+    import random
+    import tracemalloc
+    from a3 import MultiTurnChatbot
+
+    num_users = 100_000
+    num_threads = 8
+    turns_per_thread = 25_000
+    messages = ["你好", "天气怎么样", "北京", "东京的天气", "你叫什么名字", "多少钱", "再见", "随便聊聊"]
+
+    print("=" * 60)
+    print(f"会话管理器基准测试：{num_users} 个模拟用户")
+    print("=" * 60)
+
+    # 1. 每个会话的内存占用（每个用户聊 3 轮）
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    chatbot = MultiTurnChatbot(SessionManager(max_sessions=num_users * 2))
+    for i in range(num_users):
+        sid = f"user-{i}"
+        for text in messages[:3]:
+            chatbot.respond(text, session_id=sid)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"活跃会话数: {len(chatbot.sessions)}")
+    print(f"每个会话内存: {total / num_users:.0f} 字节（含 3 轮对话历史）")
+
+    # 2. 多线程并发吞吐
+    def worker(seed):
+        rnd = random.Random(seed)
+        for _ in range(turns_per_thread):
+            chatbot.respond(rnd.choice(messages), session_id=f"user-{rnd.randrange(num_users)}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total_turns = num_threads * turns_per_thread
+    print(f"{num_threads} 线程共 {total_turns} 轮对话，用时 {elapsed:.2f}s")
+    print(f"吞吐: {total_turns / elapsed:,.0f} 轮/秒")
+
+
+if __name__ == "__main__":
+    main()
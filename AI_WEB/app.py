@@ -1,12 +1,54 @@
-from flask import Flask, render_template, request, Response, stream_with_context
-from chatbot_logic import SuperChatbot
+from flask import Flask, render_template, request, Response, stream_with_context, jsonify
+from chatbot_logic import SuperChatbot, ModelRegistry, MemoryStore
+from engine import INTERACTIVE, BULK
+from model_router import ModelRouter
+from mem_monitor import MemoryMonitor
+from stream_buffer import StreamRegistry
+from autotune import load_profile, apply_threads, engine_options
+from load_governor import LoadGovernor, RuleResponder
+from traffic_capture import TrafficCapture
+from hot_reload import HotReloader
 import json
+import os
+import torch
 
 app = Flask(__name__)
 
-# 全局初始化 AI 引擎 (0.5B 版本)
+# 全局初始化 AI 引擎：默认只加载 0.5B；设置 AI_ENABLE_LARGE=1 再挂上 1.5B（第一次用到时才加载），
+# 由路由器按问题复杂度和当前负载分配。
+# AI_MODEL_BUDGET_MB 限制模型权重的总内存，超出时把最久没用的模型换出，下次用到再从快照映射回来
 print("正在初始化 AI，请稍候...")
-bot = SuperChatbot()
+budget = os.environ.get("AI_MODEL_BUDGET_MB")
+registry = ModelRegistry(budget_mb=float(budget) if budget else None)
+memory = MemoryStore()  # 各级模型共用同一份长期记忆
+# AI_KV_QUANT=int8 时 KV 缓存按 int8 存，同样内存下能同时服务更多长对话
+# AI_VOCAB_PATH 指向 vocab_prune.py 生成的常用词表时，输出层只算这些 token（两个模型共用同一个分词器）
+# AI_ATTENTION=tiled 时用分块注意力（online softmax），长历史 prefill 不生成完整的注意力矩阵
+# AI_COMPRESS_RATIO=0.5 时较早的历史在 prefill 前压缩到一半左右的字数（丢掉口语填充等低信息片段）
+compress_ratio = os.environ.get("AI_COMPRESS_RATIO")
+options = dict(kv_quant=os.environ.get("AI_KV_QUANT") or None, vocab_path=os.environ.get("AI_VOCAB_PATH") or None,
+               registry=registry, memory=memory, compress_ratio=float(compress_ratio) if compress_ratio else None,
+               attn_implementation=os.environ.get("AI_ATTENTION") or None)
+# autotune.py 在本机测出的线程数、并发数、prefill 分块和精度（host_profile.json），要在加载模型之前应用
+profile_path = os.environ.get("AI_HOST_PROFILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "host_profile.json"))
+profile = load_profile(profile_path, "Qwen/Qwen2.5-0.5B-Instruct")
+if profile:
+    apply_threads(profile)
+    print(f"✅ 已加载本机调优配置: {profile}")
+tiers = {"0.5B": SuperChatbot("Qwen/Qwen2.5-0.5B-Instruct", **options, **(engine_options(profile) if profile else {}))}
+if os.environ.get("AI_ENABLE_LARGE") == "1":
+    tiers["1.5B"] = SuperChatbot("Qwen/Qwen2.5-1.5B-Instruct", lazy=True, **options)
+# 过载时按 SLO 逐级降级（AI_SLO_TTFT / AI_SLO_ITL 秒，p95），负载回落后自动恢复
+governor = LoadGovernor(slo_ttft=float(os.environ.get("AI_SLO_TTFT", 2.0)), slo_itl=float(os.environ.get("AI_SLO_ITL", 0.15)))
+bot = ModelRouter(tiers, governor=governor, rules=RuleResponder())
+# /admin/reload 不停机换模型：后台加载、预热，切换后等旧模型上的请求跑完再释放
+reloader = HotReloader(bot, registry, lambda model_id, **kwargs: SuperChatbot(model_id, **{**options, **kwargs}))
+monitor = MemoryMonitor()  # 每个请求的内存账，/debug/memory 查看
+streams = StreamRegistry()  # 生成结果在服务端缓冲一段时间，断线重连可以接着读
+# 设置 AI_CAPTURE_PATH 时记录匿名的流量形状（长度、间隔、断开时间，不含内容），用 replay.py 回放
+capture_path = os.environ.get("AI_CAPTURE_PATH")
+capture = TrafficCapture(capture_path, float(os.environ.get("AI_CAPTURE_SAMPLE", 1.0)),
+                         tiers["0.5B"].tokenizer) if capture_path else None
 
 @app.route('/')
 def index():
@@ -16,20 +58,101 @@ def index():
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.json
+    record = capture.start(data) if capture else None
     user_query = data.get('message', '')
     history = data.get('history', [])
+    mode = data.get('mode', 'assistant')  # "assistant" 或 "novel"
+    session_id = data.get('session_id')   # 前端生成的会话 id，用来区分长期记忆
+    # 批量任务（比如长篇小说）传 priority="bulk"：有交互聊天排队时会被暂时换出，之后接着写
+    priority = BULK if data.get('priority') == 'bulk' else INTERACTIVE
 
-    def generate():
-        try:
-            # 调用 chatbot_logic 中的流式生成
-            for token in bot.chat_stream(user_query, history):
-                # 按照 SSE 协议格式发送数据
-                yield f"data: {json.dumps({'token': token})}\n\n"
-        except Exception as e:
-            print(f"生成出错: {e}")
-            yield f"data: {json.dumps({'token': '[发生错误]'})}\n\n"
-            
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # 经路由器选择模型后在后台生成，连接断开也不会中断
+    stream = monitor.track(bot.chat_stream(user_query, history, mode, session_id, priority), mode=mode, chars=len(user_query))
+    buffer = streams.start(stream)
+    events = capture.wrap(sse_events(buffer, 0), record) if record else sse_events(buffer, 0)
+    return Response(stream_with_context(events), mimetype='text/event-stream')
+
+@app.route('/draft', methods=['POST'])
+def draft():
+    # 用户还在输入：把历史 + 草稿的稳定部分预先 prefill 进 KV 前缀缓存，正式发送时只剩最后几个 token 要算
+    data = request.json
+    tier, tokens = bot.draft(data.get('message', ''), data.get('history', []), data.get('mode', 'assistant'),
+                             data.get('session_id'))
+    return jsonify({"tier": tier, "prefill_tokens": tokens})
+
+@app.route('/chat/resume')
+def chat_resume():
+    # 断线重连：Last-Event-ID 形如 "<stream_id>:<序号>"，从下一个片段接着发
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '')
+    stream_id, _, index = last_event_id.rpartition(':')
+    buffer = streams.get(stream_id)
+    if buffer is None or not index.lstrip('-').isdigit():
+        return jsonify({"error": "stream 不存在或已过期"}), 404
+    return Response(stream_with_context(sse_events(buffer, int(index) + 1)), mimetype='text/event-stream')
+
+def sse_events(buffer, start):
+    # 按照 SSE 协议格式发送数据，每条都带 id，客户端据此断点续传
+    if start == 0:
+        yield f"id: {buffer.stream_id}:-1\ndata: {json.dumps({'stream_id': buffer.stream_id})}\n\n"
+    for index, token in buffer.read(start):
+        yield f"id: {buffer.stream_id}:{index}\ndata: {json.dumps({'token': token})}\n\n"
+    if buffer.error is not None:
+        print(f"生成出错: {buffer.error}")
+        yield f"data: {json.dumps({'token': '[发生错误]'})}\n\n"
+    if buffer.abandoned:
+        # 断线太久生成已被取消，重连回来的客户端只能拿到前半段，不能当作正常结束
+        yield f"data: {json.dumps({'truncated': True, 'error': '连接断开太久，生成已取消'})}\n\n"
+        return
+    yield f"data: {json.dumps({'done': True})}\n\n"
+
+def admin_allowed():
+    # 设置了 AI_ADMIN_TOKEN 时要带 X-Admin-Token 请求头，否则只允许本机访问
+    token = os.environ.get("AI_ADMIN_TOKEN")
+    if token:
+        return request.headers.get('X-Admin-Token') == token
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/admin/reload', methods=['GET', 'POST'])
+def admin_reload():
+    # POST {"tier": "0.5B", "model_id": "Qwen/Qwen2.5-1.5B-Instruct", "torch_dtype": "bfloat16", "kv_quant": "int8"}
+    # 开始热更新（202；内存不够或正在更新时 409），GET 查看进度
+    if not admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    if request.method == 'GET':
+        return jsonify(reloader.status())
+    data = request.json or {}
+    if not data.get('model_id'):
+        return jsonify({"error": "缺少 model_id"}), 400
+    overrides = {k: data[k] for k in ('kv_quant', 'kv_cache_mb', 'max_running', 'prefill_chunk_size', 'vocab_path',
+                                      'attn_implementation') if k in data}
+    if data.get('torch_dtype'):
+        overrides['torch_dtype'] = getattr(torch, data['torch_dtype'])
+    started, status = reloader.start(data.get('tier', '0.5B'), data['model_id'], **overrides)
+    return jsonify(status), 202 if started else 409
+
+@app.route('/stats')
+def stats():
+    # 路由决策记录、各级模型的延迟、模型的常驻情况，以及长期记忆的检索延迟和内存
+    return jsonify({**bot.stats(), "models": registry.stats(), "memory": memory.stats(), "streams": streams.stats(),
+                    "capture": capture.stats() if capture else None, "reload": reloader.status(),
+                    "compression": {name: t.compressor.stats() for name, t in tiers.items() if t.compressor}})
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus 格式：降级档位、档位切换次数、进行中的请求数、最近的延迟 p95
+    return Response(governor.prometheus(bot.in_flight), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/memory')
+def debug_memory():
+    # RSS、线程、每个请求的内存账；不带 light=1 时还会 gc 并扫描所有存活的张量和对象（较慢），
+    # 这一步只对管理员开放，其他人只拿到轻量报告
+    heavy = not request.args.get('light') and admin_allowed()
+    report = monitor.snapshot() if heavy else monitor.report()
+    report["engines"] = {
+        name: {**tier.engine.metrics(), "recent_requests": tier.engine.request_records()}
+        for name, tier in tiers.items() if tier.engine is not None
+    }
+    return jsonify(report)
 
 if __name__ == '__main__':
     # host='0.0.0.0' 允许局域网访问
@@ -0,0 +1,274 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import torch
+
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "host_profile.json")
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+DEFAULT_SETTINGS = {"num_threads": None, "interop_threads": None, "max_running": 4,
+                    "prefill_chunk_size": 256, "dtype": "float32"}
+
+
+def cpu_cache_sizes():
+    """读取 CPU0 各级缓存大小（Linux 的 /sys，别的系统返回空）"""
+    caches = {}
+    base = "/sys/devices/system/cpu/cpu0/cache"
+    try:
+        for name in sorted(os.listdir(base)):
+            if not name.startswith("index"):
+                continue
+            with open(os.path.join(base, name, "level")) as f:
+                level = f.read().strip()
+            with open(os.path.join(base, name, "type")) as f:
+                kind = f.read().strip()
+            with open(os.path.join(base, name, "size")) as f:
+                caches[f"L{level}{'' if kind == 'Unified' else kind[0].lower()}"] = f.read().strip()
+    except OSError:
+        pass
+    return caches
+
+
+def host_info():
+    """机器指纹：换了机器（核数、缓存、torch 版本不同）之后旧的调优结果就不可靠了"""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "usable_cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        "caches": cpu_cache_sizes(),
+        "torch": torch.__version__,
+    }
+
+
+# ==================== 读取 / 应用调优结果 ====================
+
+def load_profile(path=PROFILE_PATH, model_id=None):
+    """读取调优结果，返回 settings 字典；文件不存在或不是这个模型的就返回 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        profile = json.load(f)
+    if model_id and profile.get("model") != model_id:
+        print(f"⚠️ {path} 是为 {profile.get('model')} 调的，当前模型 {model_id}，不使用")
+        return None
+    if profile.get("host") != host_info():
+        print(f"⚠️ {path} 来自另一台机器/环境，结果仅供参考；建议在本机重新运行 autotune.py")
+    return {**DEFAULT_SETTINGS, **profile["settings"]}
+
+
+def apply_threads(settings):
+    """设置 torch 线程数；inter-op 线程数只能在进程做并行计算之前设置一次，所以要在加载模型前调用"""
+    if settings.get("interop_threads"):
+        try:
+            torch.set_num_interop_threads(settings["interop_threads"])
+        except RuntimeError as e:
+            print(f"⚠️ inter-op 线程数设置失败（需要在任何计算之前设置）: {e}")
+    if settings.get("num_threads"):
+        torch.set_num_threads(settings["num_threads"])
+
+
+def engine_options(settings):
+    """转成 SuperChatbot 的构造参数"""
+    return dict(max_running=settings["max_running"], prefill_chunk_size=settings["prefill_chunk_size"],
+                torch_dtype=DTYPES[settings["dtype"]])
+
+
+# ==================== 合成负载 ====================
+
+def make_prompts(tokenizer, lengths=(32, 128, 512), count=8, seed=0):
+    """长短混合的随机 prompt，模拟普通提问和带长历史的对话"""
+    rnd = random.Random(seed)
+    vocab = range(min(1000, len(tokenizer) // 4), len(tokenizer) - len(tokenizer.all_special_ids))
+    return [[rnd.choice(vocab) for _ in range(lengths[i % len(lengths)])] for i in range(count)]
+
+
+def run_workload(model, tokenizer, max_running, prefill_chunk_size, prompts, max_new_tokens=32):
+    """所有 prompt 同时提交给一个新引擎，跑完后统计吞吐和 p95 延迟"""
+    from engine import GenerationEngine
+
+    engine = GenerationEngine(model, tokenizer, prefill_chunk_size=prefill_chunk_size, max_running=max_running)
+    try:
+        # 先跑一个小请求预热（第一次调用有初始化开销）
+        list(engine.stream(prompts[0][:16], max_new_tokens=2, do_sample=False))
+        engine.ttft.clear()
+        engine.itl.clear()
+        start = time.perf_counter()
+        seqs = [engine.submit(ids, max_new_tokens=max_new_tokens, do_sample=False) for ids in prompts]
+        for seq in seqs:
+            while True:
+                item = seq.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.shutdown()
+
+    def p95(values):
+        values = sorted(values)
+        return values[min(int(len(values) * 0.95), len(values) - 1)] if values else float("inf")
+
+    return {
+        "tokens_per_s": round(sum(len(seq.output_ids) for seq in seqs) / elapsed, 2),
+        "ttft_p95": round(p95(engine.ttft), 4),
+        "itl_p95": round(p95(engine.itl), 4),
+        "seconds": round(elapsed, 2),
+    }
+
+
+def meets_slo(result, slo):
+    return result["ttft_p95"] <= slo["ttft_p95"] and result["itl_p95"] <= slo["itl_p95"]
+
+
+def better(a, b, slo):
+    """满足 SLO 的里面吞吐最高；都不满足时，离 SLO 最近（超出比例最小）的优先"""
+    if b is None:
+        return True
+    ok_a, ok_b = meets_slo(a, slo), meets_slo(b, slo)
+    if ok_a != ok_b:
+        return ok_a
+    if ok_a:
+        return a["tokens_per_s"] > b["tokens_per_s"]
+
+    def excess(r):
+        return max(r["ttft_p95"] / slo["ttft_p95"], r["itl_p95"] / slo["itl_p95"])
+    return excess(a) < excess(b)
+
+
+# ==================== 参数扫描 ====================
+
+def thread_candidates():
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    candidates = {cpus, max(1, cpus // 2)}
+    n = 1
+    while n < cpus:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def sweep(load_model, tokenizer, slo, dtypes=("float32", "bfloat16"), max_running=(1, 2, 4, 8),
+          chunk_sizes=(128, 256, 512), repeat=2, log=print):
+    """
+    逐个参数做坐标搜索（全组合太多）：线程数 -> 并发数 -> prefill 分块 -> dtype，
+    每一步固定其他参数，选出当前最好的值再往下扫；每个配置跑 repeat 次取最好的一次，减少偶然的干扰
+    load_model(dtype 名字) 返回对应精度的模型
+    """
+    prompts = make_prompts(tokenizer)
+    best = {**DEFAULT_SETTINGS, "num_threads": torch.get_num_threads(), "dtype": dtypes[0]}
+    trials = []
+    models = {dtypes[0]: load_model(dtypes[0])}
+
+    def trial(**changes):
+        settings = {**best, **changes}
+        if settings["dtype"] not in models:
+            models.clear()  # 同时只留一份权重
+            models[settings["dtype"]] = load_model(settings["dtype"])
+        torch.set_num_threads(settings["num_threads"])
+        try:
+            result = None
+            for _ in range(repeat):
+                r = run_workload(models[settings["dtype"]], tokenizer, settings["max_running"],
+                                 settings["prefill_chunk_size"], prompts)
+                result = r if better(r, result, slo) else result
+        except Exception as e:
+            log(f"  ❌ {changes} 失败: {e}")
+            return None
+        trials.append({"settings": settings, "result": result})
+        flag = "✅" if meets_slo(result, slo) else "⚠️"
+        log(f"  {flag} {changes}  {result['tokens_per_s']:7.1f} tokens/s  "
+            f"TTFT p95 {result['ttft_p95']:.2f}s  ITL p95 {result['itl_p95'] * 1000:.0f}ms")
+        return result
+
+    best_result = None
+    for name, values in (("num_threads", thread_candidates()), ("max_running", max_running),
+                         ("prefill_chunk_size", chunk_sizes), ("dtype", dtypes)):
+        log(f"扫描 {name}: {list(values)}")
+        winner = None
+        for value in values:
+            result = trial(**{name: value})
+            if result is not None and better(result, winner, slo):
+                winner, chosen = result, value
+        if winner is not None:
+            best[name], best_result = chosen, winner
+    return best, best_result, trials
+
+
+def interop_trial(model_id, settings):
+    """inter-op 线程数每个进程只能设一次，所以放到子进程里测"""
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--model", model_id,
+                          "--trial", json.dumps(settings)], capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "子进程失败")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    import argparse
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="在本机扫描线程数、并发数、prefill 分块和精度，生成 host_profile.json")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--slo-ttft", type=float, default=2.0, help="首 token 延迟 p95 上限（秒）")
+    parser.add_argument("--slo-itl", type=float, default=0.15, help="token 间隔 p95 上限（秒）")
+    parser.add_argument("--dtypes", default="float32,bfloat16")
+    parser.add_argument("--interop", default="1,2", help="要比较的 inter-op 线程数，留空则不测")
+    parser.add_argument("--out", default=PROFILE_PATH)
+    parser.add_argument("--trial", help=argparse.SUPPRESS)  # 子进程：按给定参数跑一次负载
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    def load_model(dtype):
+        return AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=DTYPES[dtype], device_map={"": "cpu"})
+
+    if args.trial:
+        settings = json.loads(args.trial)
+        apply_threads(settings)
+        result = run_workload(load_model(settings["dtype"]), tokenizer, settings["max_running"],
+                              settings["prefill_chunk_size"], make_prompts(tokenizer))
+        print(json.dumps(result))
+        return
+
+    slo = {"ttft_p95": args.slo_ttft, "itl_p95": args.slo_itl}
+    print(f"机器: {host_info()}")
+    print(f"目标 SLO: TTFT p95 <= {args.slo_ttft}s，ITL p95 <= {args.slo_itl * 1000:.0f}ms")
+    best, best_result, trials = sweep(load_model, tokenizer, slo, dtypes=tuple(args.dtypes.split(",")))
+
+    interops = [int(n) for n in args.interop.split(",") if n]
+    if interops:
+        print(f"扫描 interop_threads: {interops}（子进程）")
+        winner = None
+        for n in interops:
+            settings = {**best, "interop_threads": n}
+            try:
+                result = interop_trial(args.model, settings)
+            except Exception as e:
+                print(f"  ❌ interop_threads={n} 失败: {e}")
+                continue
+            trials.append({"settings": settings, "result": result})
+            print(f"  {'✅' if meets_slo(result, slo) else '⚠️'} interop_threads={n}  "
+                  f"{result['tokens_per_s']:7.1f} tokens/s  TTFT p95 {result['ttft_p95']:.2f}s  "
+                  f"ITL p95 {result['itl_p95'] * 1000:.0f}ms")
+            if better(result, winner, slo):
+                winner, best["interop_threads"] = result, n
+        best_result = winner or best_result
+
+    profile = {"host": host_info(), "model": args.model, "slo": slo, "settings": best,
+               "result": best_result, "trials": trials, "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    flag = "✅" if meets_slo(best_result, slo) else "⚠️ 没有配置能满足 SLO，选了最接近的"
+    print(f"{flag} 最佳配置: {best}")
+    print(f"   {best_result['tokens_per_s']} tokens/s，TTFT p95 {best_result['ttft_p95']}s，"
+          f"ITL p95 {best_result['itl_p95'] * 1000:.0f}ms；已保存到 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,149 @@
+import os
+import sys
+import threading
+
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
-from threading import Thread
+from engine import GenerationEngine, FINISHED, INTERACTIVE
+
+# 共用 AI_Model 目录下的推理组件
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AI_Model"))
+from long_term_memory import MemoryStore
+from model_registry import ModelRegistry
+from prompt_compressor import PromptCompressor
+from vocab_prune import PrunedHead
+
+SYSTEM_PROMPTS = {
+    # 系统提示词稍微加强，弥补模型参数小的不足
+    "assistant": "你是一个简明扼要、专业的 AI 助手。",
+    "novel": "你是一位获得诺贝尔文学奖的小说家。请根据用户的要求创作情节跌宕起伏、描写细腻、人物性格鲜明的小说。",
+}
 
 class SuperChatbot:
-    def __init__(self):
-        # 降级到 0.5B，这是目前能跑的最轻量且有智商的版本
-        self.model_id = "Qwen/Qwen2.5-0.5B-Instruct"
-        
-        print(f"🚀 正在启动轻量版引擎 (Qwen2.5-0.5B)...")
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
-        
-        # 强制 CPU 运行，且关闭所有不必要的加载项
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_id,
-            torch_dtype=torch.float32,
-            device_map={"": "cpu"} 
-        )
-        print("✅ 引擎启动成功！现在系统应该非常流畅。")
-
-    def chat_stream(self, user_input, history):
-        # 系统提示词稍微加强，弥补模型参数小的不足
-        messages = [{"role": "system", "content": "你是一个简明扼要、专业的 AI 助手。"}]
-        # 0.5B 记不住太长的东西，只保留最近 2 轮对话
-        messages.extend(history[-4:]) 
+    def __init__(self, model_id="Qwen/Qwen2.5-0.5B-Instruct", prefill_chunk_size=256, max_running=4,
+                 kv_cache_mb=512, kv_quant=None, vocab_path=None, registry=None, memory=None, lazy=False,
+                 torch_dtype=torch.float32, compress_ratio=None, name=None, attn_implementation=None):
+        # 默认 0.5B，这是目前能跑的最轻量且有智商的版本
+        self.model_id = model_id
+        self.name = name or model_id  # 在注册表里的名字；热更新时同一个模型 id 的新旧两份要用不同的名字
+        self.engine_kwargs = dict(prefill_chunk_size=prefill_chunk_size, max_running=max_running,
+                                  kv_cache_mb=kv_cache_mb, kv_quant=kv_quant, attn_implementation=attn_implementation)
+        self.vocab_path = vocab_path  # vocab_prune.py 生成的常用词表，输出层只算这些 token
+        self.torch_dtype = torch_dtype
+        self.model = self.tokenizer = self.engine = None
+        self._engine_lock = threading.Lock()
+        self.drafts = {}  # session_id -> 正在进行的预先 prefill
+        self.draft_contexts = {}  # session_id -> (草稿, 历史条数, 草稿检索到的历史消息)
+        # 更早的对话不直接丢掉，按当前问题检索相关的几轮放回 prompt（多个模型可以共用一个）
+        self.memory = memory or MemoryStore()
+        # 可选：prefill 前把较早的历史压缩到 compress_ratio 左右（最近 1 轮和当前问题不动）
+        self.compressor = PromptCompressor(ratio=compress_ratio, keep_recent_turns=1) if compress_ratio else None
+
+        # 模型由注册表统一加载和换出；单独使用时自己建一个不限预算的注册表
+        self.registry = registry or ModelRegistry()
+        if self.name not in self.registry.entries:
+            # 强制 CPU 运行，且关闭所有不必要的加载项
+            self.registry.register(self.name, model_id, torch_dtype=torch_dtype, device_map={"": "cpu"})
+        self.registry.on_evict(self.name, self._on_evict)
+
+        if not lazy:
+            self._ensure_engine(*self.registry.get(self.name))
+
+    def _ensure_engine(self, model, tokenizer):
+        """模型（重新）加载后，为它建一个生成引擎"""
+        with self._engine_lock:
+            if self.engine is None or self.engine.model is not model:
+                print(f"🚀 正在启动引擎 ({self.model_id})...")
+                self.model, self.tokenizer = model, tokenizer
+                # 所有用户共用一个生成引擎：长 prompt 分块 prefill，和其他人的 decode 交替进行
+                # KV 缓存池按 kv_cache_mb 一次性预分配，满了新请求就排队
+                vocab_head = PrunedHead.load(self.vocab_path, model) if self.vocab_path else None
+                self.engine = GenerationEngine(model, tokenizer, vocab_head=vocab_head, **self.engine_kwargs)
+                print("✅ 引擎启动成功！现在系统应该非常流畅。")
+            return self.engine
+
+    def _on_evict(self, name):
+        # 模型被换出：停掉引擎，释放对模型和 KV 缓存池的引用
+        with self._engine_lock:
+            if self.engine is not None:
+                self.engine.shutdown()
+            self.model = self.engine = None
+
+    def _build_messages(self, user_input, history, mode, session_id, history_turns=None, context=None):
+        messages = [{"role": "system", "content": SYSTEM_PROMPTS.get(mode, SYSTEM_PROMPTS["assistant"])}]
+        # 0.5B 记不住太长的东西，只保留最近 2 轮对话，再加上从更早的对话里检索到的几轮
+        # （过载降级时由调用方指定只保留最近 history_turns 轮，也不做检索；context 是已经检索好的结果）
+        if history_turns is not None:
+            messages.extend(history[-2 * history_turns:] if history_turns else [])
+        elif context is not None:
+            messages.extend(context)
+        elif session_id:
+            messages.extend(self.memory.build_context(session_id, history, user_input))
+        else:
+            messages.extend(history[-4:])
         messages.append({"role": "user", "content": user_input})
+        if self.compressor is not None:
+            messages, _ = self.compressor.compress(messages)
+        return messages
+
+    def draft(self, draft_text, history, mode="assistant", session_id=None, margin=2):
+        """
+        用户还在输入时，把 历史 + 草稿里已经稳定的部分 预先 prefill 进 KV 前缀缓存，
+        真正发送时只需要算最后几个 token。草稿末尾 margin 个 token 可能和接下来输入的字合并成别的 token，不算。
+        同一会话的新草稿会取消旧的（旧的已经算完的 block 仍然保留，新草稿直接复用）
+        """
+        engine, tokenizer = self.engine, self.tokenizer
+        if engine is None or tokenizer is None or not session_id or not draft_text.strip():
+            return 0  # 模型没加载（或被换出）时不为了猜测去加载它
+        context = self.memory.build_context(session_id, history, draft_text, record_latency=False)
+        messages = self._build_messages(draft_text, history, mode, session_id, context=context)
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
+        text = text[:text.rindex(draft_text) + len(draft_text)]
+        prompt_ids = tokenizer(text)["input_ids"][:-margin or None]
 
-        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        model_inputs = self.tokenizer([text], return_tensors="pt")
+        with self._engine_lock:
+            # 检索用的是草稿，正式发送时的问题往往会检索到别的几轮，而检索结果紧跟在系统提示词后面，
+            # 一变整个预先 prefill 就白算了；所以记下这次检索的结果，正式发送的问题接着草稿写时沿用
+            self.draft_contexts.pop(session_id, None)
+            self.draft_contexts[session_id] = (draft_text, len(history), context)
+            while len(self.draft_contexts) > 1024:  # 打了草稿但一直没发送的会话
+                del self.draft_contexts[next(iter(self.draft_contexts))]
+            old = self.drafts.pop(session_id, None)
+            if old is not None and old.prompt_ids == prompt_ids and not old.cancelled:
+                self.drafts[session_id] = old
+                return 0
+            if old is not None:
+                engine.cancel(old)
+            # 顺便清掉已经结束的会话的记录
+            for sid in [sid for sid, seq in self.drafts.items() if seq.status == FINISHED]:
+                del self.drafts[sid]
+            self.drafts[session_id] = engine.prefill(prompt_ids)
+        return len(prompt_ids)
 
-        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
-        generate_kwargs = dict(
-            **model_inputs,
-            streamer=streamer,
-            max_new_tokens=300, # 缩短单次回复长度，进一步提升速度
-            do_sample=True,
-            temperature=0.7,
-            top_p=0.8
-        )
+    def chat_stream(self, user_input, history, mode="assistant", session_id=None, max_new_tokens=300,
+                    history_turns=None, priority=INTERACTIVE):
+        with self._engine_lock:
+            draft = self.draft_contexts.pop(session_id, None) if session_id else None
+        context = None
+        if draft is not None and user_input.startswith(draft[0]) and len(history) == draft[1]:
+            context = draft[2]  # 沿用草稿的检索结果，prompt 和预先 prefill 的前缀保持一致
+        messages = self._build_messages(user_input, history, mode, session_id, history_turns, context)
 
-        thread = Thread(target=self.model.generate, kwargs=generate_kwargs)
-        thread.start()
+        # 生成期间占用这个模型，注册表不会把它换出
+        with self.registry.use(self.name) as (model, tokenizer):
+            engine = self._ensure_engine(model, tokenizer)
+            # 正式发送了：停掉这个会话的预先 prefill，已经算完的 block 留在前缀缓存里给这次请求用
+            with self._engine_lock:
+                old = self.drafts.pop(session_id, None)
+            if old is not None:
+                engine.cancel(old)
+            text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            prompt_ids = tokenizer(text)["input_ids"]
 
-        for new_text in streamer:
-            yield new_text
\ No newline at end of file
+            yield from engine.stream(
+                prompt_ids,
+                max_new_tokens=max_new_tokens, # 缩短单次回复长度，进一步提升速度
+                do_sample=True,
+                temperature=0.7,
+                top_p=0.8,
+                priority=priority  # 批量任务（BULK）会在交互聊天排队时被抢占
+            )
\ No newline at end of file
@@ -0,0 +1,129 @@
+import gc
+import threading
+import time
+
+from mem_monitor import available_bytes
+
+
+class HotReloader:
+    """
+    不停机换模型（/admin/reload 触发），比如 0.5B 换 1.5B、换一份新量化的权重：
+    1. 先查内存余量：新模型权重 + KV 缓存池（乘上 headroom 的安全系数）放不下就直接拒绝，
+       因为切换期间新旧两份模型要同时在内存里
+    2. 后台线程加载新模型、建引擎，跑一条短对话预热，期间所有请求照常走旧模型
+    3. 路由器把这一级换成新 bot，之后的新请求都走新模型
+    4. 旧模型上进行中的流式回复照常跑完，全部结束后才注销旧模型、释放内存
+    同一时间只做一次热更新
+    """
+
+    def __init__(self, router, registry, factory, headroom=1.2, poll=0.5):
+        self.router = router
+        self.registry = registry
+        self.factory = factory          # factory(model_id, name=..., lazy=True, **参数) -> SuperChatbot
+        self.headroom = headroom
+        self.poll = poll
+        self.generation = 0
+        self.state = {"state": "idle"}
+        self.history = []
+        self._thread = None
+        self._starting = False          # start() 正在检查内存余量（在锁外面做），这期间也算忙
+        self._lock = threading.Lock()
+
+    def busy(self):
+        return self._starting or (self._thread is not None and self._thread.is_alive())
+
+    def start(self, tier, model_id, **overrides):
+        """开始热更新，返回 (是否已开始, 状态)；内存不够或已有热更新在进行时不开始"""
+        with self._lock:
+            if self.busy():
+                return False, self.status()
+            self._starting = True
+            old = self.router.tiers.get(tier)
+            # 没指定的参数沿用旧 bot 的（并发数、KV 池大小、KV 量化、词表裁剪、权重精度）
+            kwargs = {**old.engine_kwargs, "vocab_path": old.vocab_path,
+                      "torch_dtype": old.torch_dtype} if old is not None else {}
+            kwargs.update(overrides)
+
+            self.generation += 1
+            name = model_id if model_id not in self.registry.entries else f"{model_id}@{self.generation}"
+            self.state = {"state": "checking", "tier": tier, "model_id": model_id, "name": name,
+                          "old": old.name if old is not None else None, "started": time.time(), "seconds": {}}
+
+        # 估算大小可能要联网下载 config，不能拿着锁做（_starting 已经挡住了并发的 start）
+        try:
+            try:
+                bot = self.factory(model_id, name=name, lazy=True, **kwargs)  # 只登记，不加载
+                ok, reason = self._check_headroom(name, bot)
+            except Exception as e:
+                ok, reason = False, f"{type(e).__name__}: {e}"
+                bot = None
+            if not ok:
+                if name in self.registry.entries:
+                    self.registry.remove(name)
+                self._finish("rejected", error=reason)
+                return False, self.status()
+
+            self._thread = threading.Thread(target=self._run, args=(tier, bot, old), daemon=True)
+            self._thread.start()
+            return True, self.status()
+        finally:
+            self._starting = False
+
+    def _check_headroom(self, name, bot):
+        need = self.registry.estimate_bytes(name) + bot.engine_kwargs["kv_cache_mb"] * 2**20
+        available = available_bytes()
+        self.state.update(need_mb=round(need / 2**20), available_mb=available and round(available / 2**20))
+        if available is not None and need * self.headroom > available:
+            return False, (f"内存不够：新模型约需 {need / 2**20:.0f}MB（x{self.headroom} 安全系数），"
+                           f"可用 {available / 2**20:.0f}MB")
+        budget = self.registry.budget
+        if budget is not None and self.registry.resident_bytes() + need > budget:
+            return False, (f"超出模型内存预算：常驻 {self.registry.resident_bytes() / 2**20:.0f}MB + "
+                           f"新模型 {need / 2**20:.0f}MB > 预算 {budget / 2**20:.0f}MB")
+        return True, None
+
+    def _run(self, tier, bot, old):
+        step = time.perf_counter()
+
+        def mark(state):
+            nonlocal step
+            now = time.perf_counter()
+            self.state["seconds"][self.state["state"]] = round(now - step, 2)
+            self.state["state"], step = state, now
+
+        try:
+            mark("loading")
+            print(f"🔄 热更新 {tier}: 后台加载 {bot.name}...")
+            bot._ensure_engine(*self.registry.get(bot.name))
+            mark("warming")
+            # 预热：第一次前向的内存分配、线程池启动都在切换前做完，切过去的第一个用户不用等
+            for _ in bot.chat_stream("你好", [], max_new_tokens=4):
+                pass
+        except Exception as e:
+            print(f"❌ 热更新失败，继续使用旧模型: {e}")
+            if bot.name in self.registry.entries:
+                self.registry.remove(bot.name)
+            self._finish("failed", error=f"{type(e).__name__}: {e}")
+            return
+
+        mark("draining")
+        self.router.swap(tier, bot)
+        print(f"✅ 热更新 {tier}: 新请求已切到 {bot.name}")
+        if old is not None:
+            # 路由器里的计数归零后，再等注册表里的占用也归零（请求可能刚取到 bot 还没开始生成）
+            while self.router.active(old) or self.registry.entries[old.name].users:
+                self.state["old_in_flight"] = self.router.active(old)
+                time.sleep(self.poll)
+            self.state["old_in_flight"] = 0
+            self.registry.remove(old.name)
+            gc.collect()
+        mark("done")
+        self._finish("done")
+
+    def _finish(self, state, error=None):
+        self.state.update(state=state, error=error, finished=time.time())
+        self.history.append(dict(self.state))
+        self.history = self.history[-20:]
+
+    def status(self):
+        return {**self.state, "busy": self.busy(), "recent": self.history[-5:]}
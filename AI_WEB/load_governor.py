@@ -0,0 +1,158 @@
+import importlib.util
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# 从正常到最省资源的降级档位：每降一档都更便宜一些，最后一档完全不用模型
+LEVELS = [
+    {"name": "normal", "max_new_tokens": 300, "history_turns": None, "small_only": False, "rules_only": False},
+    {"name": "short_answers", "max_new_tokens": 150, "history_turns": None, "small_only": False, "rules_only": False},
+    {"name": "short_history", "max_new_tokens": 150, "history_turns": 1, "small_only": False, "rules_only": False},
+    {"name": "small_model", "max_new_tokens": 100, "history_turns": 1, "small_only": True, "rules_only": False},
+    {"name": "rules_only", "max_new_tokens": 0, "history_turns": 0, "small_only": True, "rules_only": True},
+]
+
+
+class LoadGovernor:
+    """
+    按 SLO 自动降级/恢复
+    - 看进行中的请求数和最近一段时间的首 token 延迟 (TTFT)、token 间隔 (ITL) 的 p95
+    - 超过 SLO 就降一档（回复变短 -> 历史变短 -> 只用小模型 -> 只用规则回答），
+      明显低于 SLO（recover_ratio 倍以内）就升一档；两次调整至少间隔 hold 秒，避免来回抖动
+    - 换档后清空延迟样本，只根据新档位下的表现做下一次判断
+    """
+
+    def __init__(self, slo_ttft=2.0, slo_itl=0.15, max_depth=6, window=30, hold=5,
+                 recover_ratio=0.5, min_samples=3, levels=LEVELS):
+        self.slo_ttft = slo_ttft
+        self.slo_itl = slo_itl
+        self.max_depth = max_depth          # 进行中的请求超过这个数就算过载
+        self.window = window                # 只看最近 window 秒的样本
+        self.hold = hold
+        self.recover_ratio = recover_ratio
+        self.min_samples = min_samples      # 样本太少时不根据延迟下结论
+        self.levels = levels
+        self.level = 0
+        self.changed_at = time.monotonic()
+        self.samples = deque()              # (时间, ttft, 平均 itl)
+        self.changes = deque(maxlen=200)
+        self.change_count = 0
+        self.time_in_level = [0.0] * len(levels)
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        return self.levels[self.level]
+
+    def record(self, ttft, itl=None):
+        """记录一个由模型回答的请求的延迟"""
+        with self._lock:
+            self.samples.append((time.monotonic(), ttft, itl))
+
+    def signals(self, depth):
+        now = time.monotonic()
+        with self._lock:
+            while self.samples and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+            ttft = [s[1] for s in self.samples if s[1] is not None]
+            itl = [s[2] for s in self.samples if s[2] is not None]
+
+        def p95(values):
+            if len(values) < self.min_samples:
+                return None
+            values = sorted(values)
+            return values[min(int(len(values) * 0.95), len(values) - 1)]
+        return {"depth": depth, "ttft_p95": p95(ttft), "itl_p95": p95(itl), "samples": len(ttft)}
+
+    def update(self, depth):
+        """每个新请求进来时调用：按当前负载决定是否换档，返回当前档位"""
+        s = self.signals(depth)
+        over = []
+        if depth > self.max_depth:
+            over.append(f"进行中 {depth} > {self.max_depth}")
+        if s["ttft_p95"] is not None and s["ttft_p95"] > self.slo_ttft:
+            over.append(f"TTFT p95 {s['ttft_p95']:.2f}s > {self.slo_ttft}s")
+        if s["itl_p95"] is not None and s["itl_p95"] > self.slo_itl:
+            over.append(f"ITL p95 {s['itl_p95'] * 1000:.0f}ms > {self.slo_itl * 1000:.0f}ms")
+        calm = (depth <= self.max_depth * self.recover_ratio
+                and (s["ttft_p95"] is None or s["ttft_p95"] <= self.slo_ttft * self.recover_ratio)
+                and (s["itl_p95"] is None or s["itl_p95"] <= self.slo_itl * self.recover_ratio))
+
+        with self._lock:
+            if time.monotonic() - self.changed_at >= self.hold:
+                if over and self.level < len(self.levels) - 1:
+                    self._set(self.level + 1, "；".join(over), s)
+                elif calm and self.level > 0:
+                    self._set(self.level - 1, "负载回落", s)
+            return self.current
+
+    def _set(self, level, reason, signals):
+        now = time.monotonic()
+        old = self.level
+        self.time_in_level[old] += now - self.changed_at
+        self.level, self.changed_at = level, now
+        self.samples.clear()
+        self.change_count += 1
+        self.changes.append({"time": time.time(), "from": self.levels[old]["name"],
+                             "to": self.levels[level]["name"], "reason": reason, "signals": signals})
+        flag = "⚠️ 负载降级" if level > old else "✅ 负载恢复"
+        print(f"{flag}: {self.levels[old]['name']} -> {self.levels[level]['name']}（{reason}）")
+
+    def stats(self):
+        with self._lock:
+            in_level = list(self.time_in_level)
+            in_level[self.level] += time.monotonic() - self.changed_at
+            return {
+                "level": self.level,
+                "level_name": self.current["name"],
+                "settings": self.current,
+                "slo": {"ttft_p95": self.slo_ttft, "itl_p95": self.slo_itl, "max_depth": self.max_depth},
+                "level_changes": self.change_count,
+                "seconds_in_level": {lv["name"]: round(t, 1) for lv, t in zip(self.levels, in_level)},
+                "recent_changes": list(self.changes)[-20:],
+            }
+
+    def prometheus(self, depth):
+        """Prometheus 文本格式的指标，给 /metrics 用"""
+        s = self.signals(depth)
+        stats = self.stats()
+        lines = [
+            "# HELP chat_degradation_level 当前降级档位（0 为正常）",
+            "# TYPE chat_degradation_level gauge",
+            f"chat_degradation_level {stats['level']}",
+            "# HELP chat_degradation_level_changes_total 档位切换次数",
+            "# TYPE chat_degradation_level_changes_total counter",
+            f"chat_degradation_level_changes_total {stats['level_changes']}",
+            "# TYPE chat_degradation_seconds_in_level counter",
+        ]
+        lines += [f'chat_degradation_seconds_in_level{{level="{name}"}} {t}'
+                  for name, t in stats["seconds_in_level"].items()]
+        lines += ["# TYPE chat_in_flight_requests gauge", f"chat_in_flight_requests {depth}"]
+        for name in ("ttft_p95", "itl_p95"):
+            if s[name] is not None:
+                lines += [f"# TYPE chat_{name}_seconds gauge", f"chat_{name}_seconds {s[name]:.4f}"]
+        return "\n".join(lines) + "\n"
+
+
+class RuleResponder:
+    """最低一档：不调用模型，用 AI_Test 里的规则意图分类器回答常见问题，其他的请用户稍后再试"""
+
+    BUSY_REPLY = "当前访问人数较多，我暂时只能回答简单的问题，请稍后再试。"
+
+    def __init__(self):
+        test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AI_Test")
+        if test_dir not in sys.path:
+            sys.path.append(test_dir)
+        # AI_Model 里也有 a2.py，按路径加载才不会拿错
+        spec = importlib.util.spec_from_file_location("ai_test_a2", os.path.join(test_dir, "a2.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.classifier = module.IntentClassifier()
+
+    def respond(self, message):
+        intent = self.classifier.classify_intent(message)
+        if intent == "default":
+            return self.BUSY_REPLY
+        return self.classifier.intent_responses[intent]
@@ -0,0 +1,220 @@
+import gc
+import json
+import os
+import re
+import resource
+import threading
+import time
+import warnings
+from collections import Counter, deque
+
+import torch
+
+
+def rss_bytes():
+    """当前进程的常驻内存（RSS）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # 非 Linux 没有 /proc，退而求其次用历史峰值
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def available_bytes():
+    """还能用多少内存：系统的 MemAvailable，在容器里再和 cgroup 的剩余额度取较小值；拿不到返回 None"""
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current") as f:
+                left = int(limit) - int(f.read())
+            available = left if available is None else min(available, left)
+    except (OSError, ValueError):
+        pass
+    return available
+
+
+def tensor_census(limit=15):
+    """扫描所有存活的 torch 张量：按底层存储去重后的总字节数，以及最大的几个"""
+    seen, total, tensors = set(), 0, []
+    # 对某些已弃用的模块级对象做 isinstance 会触发弃用警告，这里静默掉
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        objects = [obj for obj in gc.get_objects() if isinstance(obj, torch.Tensor)]
+    for obj in objects:
+        try:
+            if obj.device.type == "meta":
+                continue
+            storage = obj.untyped_storage()
+        except Exception:
+            continue
+        key = storage.data_ptr()
+        if key in seen:
+            continue
+        seen.add(key)
+        total += storage.nbytes()
+        tensors.append((storage.nbytes(), tuple(obj.shape), str(obj.dtype)))
+    tensors.sort(reverse=True)
+    return {
+        "count": len(tensors),
+        "total_mb": round(total / 2**20, 1),
+        "largest": [{"mb": round(n / 2**20, 2), "shape": list(shape), "dtype": dtype}
+                    for n, shape, dtype in tensors[:limit]],
+    }
+
+
+def object_census(limit=15):
+    """按类型统计存活的 Python 对象数量（找泄漏时看哪种对象一直在涨）"""
+    counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+    return dict(counts.most_common(limit))
+
+
+def thread_census():
+    """按名字统计存活线程（生成引擎、请求线程等）"""
+    counts = Counter(re.sub(r"-\d+", "", t.name) for t in threading.enumerate())
+    return {"total": threading.active_count(), "by_name": dict(counts)}
+
+
+class MemoryMonitor:
+    """
+    长期运行的服务器的内存账本
+    - 每个请求记录开始/结束时的 RSS 差值和耗时
+    - /debug/memory 可以随时查看 RSS、线程数、存活的张量和对象
+    - 周期性记录 RSS 样本，soak 测试时据此判断内存是不是在单调上涨
+    """
+
+    def __init__(self, history_size=5000, sample_every=50):
+        self.records = deque(maxlen=history_size)
+        self.samples = deque(maxlen=history_size)   # (请求序号, RSS)
+        self.sample_every = sample_every
+        self.in_flight = 0
+        self.total_requests = 0
+        self.start_rss = rss_bytes()
+        self.peak_rss = self.start_rss
+        self._lock = threading.Lock()
+
+    def track(self, stream, **tags):
+        """包住一个流式生成器，结束（包括客户端中途断开）时记一笔账"""
+        with self._lock:
+            self.in_flight += 1
+        before = rss_bytes()
+        start = time.perf_counter()
+        chunks = 0
+        try:
+            for item in stream:
+                chunks += 1
+                yield item
+        finally:
+            after = rss_bytes()
+            with self._lock:
+                self.in_flight -= 1
+                self.total_requests += 1
+                self.peak_rss = max(self.peak_rss, after)
+                self.records.append({
+                    **tags, "rss_delta_kb": (after - before) // 1024, "chunks": chunks,
+                    "seconds": round(time.perf_counter() - start, 3),
+                })
+                if self.total_requests % self.sample_every == 0:
+                    self.samples.append((self.total_requests, after))
+
+    def report(self):
+        rss = rss_bytes()
+        with self._lock:
+            records = list(self.records)
+            return {
+                "rss_mb": round(rss / 2**20, 1),
+                "peak_rss_mb": round(max(self.peak_rss, rss) / 2**20, 1),
+                "growth_since_start_mb": round((rss - self.start_rss) / 2**20, 1),
+                "requests": self.total_requests,
+                "in_flight": self.in_flight,
+                "threads": thread_census(),
+                "rss_samples_mb": [(n, round(b / 2**20, 1)) for n, b in self.samples],
+                "recent_requests": records[-20:],
+                "growth": detect_growth([b for _, b in self.samples]),
+            }
+
+    def snapshot(self, limit=15):
+        """完整的内存快照（扫描所有对象，比较慢，只在调试时用）"""
+        gc.collect()
+        return {**self.report(), "tensors": tensor_census(limit), "objects": object_census(limit)}
+
+
+def detect_growth(samples, warmup=0.2, min_growth_mb=20, min_rising=0.8):
+    """
+    判断内存是不是在持续上涨：跳过前面预热的部分，看剩下的样本
+    总共涨了超过 min_growth_mb 且大部分相邻样本都在上升，就认为有泄漏
+    """
+    samples = list(samples)[int(len(samples) * warmup):]
+    if len(samples) < 5:
+        return {"verdict": "样本不足", "leak": False}
+    rising = sum(b >= a for a, b in zip(samples, samples[1:])) / (len(samples) - 1)
+    growth_mb = (samples[-1] - samples[0]) / 2**20
+    leak = growth_mb > min_growth_mb and rising >= min_rising
+    return {
+        "verdict": "疑似内存泄漏" if leak else "稳定",
+        "leak": leak,
+        "growth_mb": round(growth_mb, 1),
+        "rising_ratio": round(rising, 2),
+    }
+
+
+# ==================== Soak 测试 ====================
+
+def soak(url="http://127.0.0.1:5000", requests=2000, concurrency=4, check_every=50, message="你好，介绍一下你自己"):
+    """对运行中的服务器连续发请求，定期读 /debug/memory 的 RSS，最后判断内存是否单调上涨"""
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.request import Request, urlopen
+
+    def one(i):
+        body = json.dumps({"message": f"{message}（{i}）", "history": [], "session_id": f"soak-{i % 100}"})
+        req = Request(f"{url}/chat", data=body.encode("utf-8"), headers={"Content-Type": "application/json"})
+        with urlopen(req) as resp:
+            resp.read()
+
+    def server_rss():
+        with urlopen(f"{url}/debug/memory?light=1") as resp:
+            return json.loads(resp.read())
+
+    samples = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for done in range(0, requests, check_every):
+            list(pool.map(one, range(done, min(done + check_every, requests))))
+            report = server_rss()
+            samples.append(report["rss_mb"] * 2**20)
+            print(f"  {min(done + check_every, requests):>6} 个请求  RSS {report['rss_mb']:8.1f}MB  "
+                  f"线程 {report['threads']['total']:>3}  {time.perf_counter() - start:7.1f}s")
+
+    result = detect_growth(samples)
+    flag = "❌" if result["leak"] else "✅"
+    print(f"{flag} {result['verdict']}：预热后共增长 {result.get('growth_mb')}MB，"
+          f"上升样本占比 {result.get('rising_ratio')}")
+    return result
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="聊天服务器的内存 soak 测试")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--check-every", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"Soak 测试：{args.requests} 个请求，并发 {args.concurrency}，目标 {args.url}")
+    result = soak(args.url, args.requests, args.concurrency, args.check_every)
+    sys.exit(1 if result["leak"] else 0)
+
+
+if __name__ == "__main__":
+    main()
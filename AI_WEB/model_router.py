@@ -0,0 +1,152 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+
+# 这些字眼出现时，问题通常需要更强的推理/写作能力
+COMPLEX_PATTERNS = [
+    r"代码", r"编程", r"程序", r"算法", r"证明", r"推导", r"计算", r"分析", r"比较",
+    r"为什么", r"原理", r"详细", r"步骤", r"写一篇", r"写一段", r"小说", r"故事", r"翻译",
+    r"code", r"python", r"explain",
+]
+
+
+class ModelRouter:
+    """
+    模型分级路由：小模型 (0.5B) 快、大模型 (1.5B) 聪明
+    - 按问题复杂度（长度、历史轮数、关键词、novel 模式）打分
+    - 按当前排队/生成中的请求数判断负载：忙的时候都交给小模型，空闲时把稍难的问题升级给大模型
+    - 每次路由决策和各级模型的延迟都会记录下来，/stats 可以查看
+    - 配了 governor（LoadGovernor）时，超出 SLO 会逐级降级：回复变短、历史变短、只用小模型、只用规则回答
+    """
+
+    def __init__(self, tiers, overload_depth=2, idle_depth=0,
+                 busy_threshold=0.7, idle_threshold=0.3, history_size=1000, governor=None, rules=None):
+        self.tiers = tiers                    # {"0.5B": bot, "1.5B": bot}，按从小到大排列
+        self.governor = governor
+        self.rules = rules                    # RuleResponder：最低一档时不用模型
+        self.overload_depth = overload_depth  # 进行中的请求达到这个数就只用小模型
+        self.idle_depth = idle_depth          # 进行中的请求不超过这个数算空闲
+        self.busy_threshold = busy_threshold  # 不空闲时，复杂度超过它才用大模型
+        self.idle_threshold = idle_threshold  # 空闲时，复杂度超过它就用大模型
+        self._pattern = re.compile("|".join(COMPLEX_PATTERNS), re.IGNORECASE)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.bot_in_flight = Counter()        # 每个 bot 实例上进行中的请求数，热更新时据此等旧模型的请求结束
+        self.decisions = deque(maxlen=history_size)
+        self.latency = {name: deque(maxlen=history_size) for name in tiers}
+
+    def complexity(self, message, history, mode="assistant"):
+        """0~1 的复杂度分数"""
+        score = min(len(message) / 200, 0.4)
+        score += min(len(history) / 20, 0.2)
+        if self._pattern.search(message):
+            score += 0.4
+        if mode == "novel":
+            score += 0.5
+        return min(score, 1.0)
+
+    def route(self, message, history, mode="assistant"):
+        """返回 (模型级别, 原因, 复杂度)"""
+        names = list(self.tiers)
+        small, large = names[0], names[-1]
+        score = self.complexity(message, history, mode)
+        depth = self.in_flight
+
+        if len(names) == 1:
+            return small, "single", score
+        if depth >= self.overload_depth:
+            return small, "overload", score
+        if depth <= self.idle_depth and score >= self.idle_threshold:
+            return large, "idle_escalate", score
+        if score >= self.busy_threshold:
+            return large, "complex", score
+        return small, "simple", score
+
+    def chat_stream(self, message, history, mode="assistant", session_id=None, priority=None):
+        with self._lock:
+            level = self.governor.update(self.in_flight) if self.governor else None
+            tier, reason, score = self.route(message, history, mode)
+            if level is not None and level["rules_only"] and self.rules is not None:
+                tier, reason = "rules", "degraded"
+            elif level is not None and level["small_only"]:
+                tier, reason = list(self.tiers)[0], "degraded"
+            self.decisions.append({
+                "time": time.time(), "tier": tier, "reason": reason,
+                "complexity": round(score, 2), "depth": self.in_flight, "mode": mode,
+                "level": level["name"] if level else None,
+            })
+            if tier != "rules":
+                self.in_flight += 1
+                bot = self.tiers[tier]        # 在锁里取定实例：热更新换上新模型后，已经开始的请求仍在旧模型上跑完
+                self.bot_in_flight[bot] += 1
+
+        if tier == "rules":
+            yield self.rules.respond(message)
+            return
+
+        options = {} if level is None else dict(max_new_tokens=level["max_new_tokens"],
+                                                history_turns=level["history_turns"])
+        if priority is not None:
+            options["priority"] = priority
+        start = time.perf_counter()
+        first_token = None
+        chunks = 0
+        try:
+            for text in bot.chat_stream(message, history, mode, session_id, **options):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                chunks += 1
+                yield text
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.bot_in_flight[bot] -= 1
+                if not self.bot_in_flight[bot]:
+                    del self.bot_in_flight[bot]
+                total = time.perf_counter() - start
+                self.latency[tier].append({"ttft": first_token, "total": total, "chunks": chunks})
+            if self.governor is not None and first_token is not None:
+                itl = (total - first_token) / (chunks - 1) if chunks > 1 else None
+                self.governor.record(first_token, itl)
+
+    def swap(self, tier, bot):
+        """把某一级换成新的 bot，之后的请求都交给它；返回旧的 bot"""
+        with self._lock:
+            old, self.tiers[tier] = self.tiers.get(tier), bot
+            self.latency.setdefault(tier, deque(maxlen=self.decisions.maxlen))
+            return old
+
+    def active(self, bot):
+        """这个 bot 上还有几个请求没结束"""
+        with self._lock:
+            return self.bot_in_flight[bot]
+
+    def draft(self, message, history, mode="assistant", session_id=None):
+        """用户输入中的草稿：按当前草稿预测会用哪一级模型，交给它预先 prefill（不记路由决策）"""
+        with self._lock:
+            tier, _, _ = self.route(message, history, mode)
+            if self.governor is not None and self.governor.level > 0:
+                return tier, 0  # 已经在降级了，不做投机的计算
+        return tier, self.tiers[tier].draft(message, history, mode, session_id)
+
+    def stats(self):
+        """各级模型的请求数和延迟分位数，以及最近的路由决策"""
+        def pct(values, p):
+            values = sorted(v for v in values if v is not None)
+            return round(values[min(int(len(values) * p), len(values) - 1)], 3) if values else None
+
+        with self._lock:
+            tiers = {}
+            for name, records in self.latency.items():
+                tiers[name] = {
+                    "requests": len(records),
+                    "ttft_p50": pct([r["ttft"] for r in records], 0.5),
+                    "ttft_p95": pct([r["ttft"] for r in records], 0.95),
+                    "total_p50": pct([r["total"] for r in records], 0.5),
+                    "total_p95": pct([r["total"] for r in records], 0.95),
+                }
+            result = {"in_flight": self.in_flight, "tiers": tiers, "recent_decisions": list(self.decisions)[-20:]}
+        if self.governor is not None:
+            result["governor"] = self.governor.stats()
+        return result
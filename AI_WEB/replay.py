@@ -0,0 +1,151 @@
+import json
+import random
+import threading
+import time
+
+FILLER = ("夜色渐深，长安城的灯火一盏盏熄灭。李白独自坐在酒肆的角落里，望着窗外的月亮，手中的酒杯迟迟没有放下。"
+          "请帮我查一下明天的天气，顺便写一个 Python 函数计算斐波那契数列。机器学习是人工智能的一个分支。")
+
+
+def load_trace(path, limit=None):
+    """读取 traffic_capture 写的记录，按到达时间排序"""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r["arrival"])
+    return records[:limit] if limit else records
+
+
+def synth_text(chars, rnd):
+    """按长度造一段文字（抓包里没有内容，只有长度）"""
+    if chars <= 0:
+        return ""
+    start = rnd.randrange(len(FILLER))
+    return ((FILLER * (chars // len(FILLER) + 2))[start:start + chars])
+
+
+def build_request(record, rnd):
+    """按记录的形状还原一个 /chat 请求：同样的消息长度、历史条数和历史总字数、同一会话"""
+    n = record["history_messages"]
+    per_message = record["history_chars"] // n if n else 0
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": synth_text(per_message, rnd)}
+               for i in range(n)]
+    body = {"message": synth_text(max(record["message_chars"], 1), rnd), "history": history,
+            "mode": record.get("mode", "assistant")}
+    if record.get("session"):
+        body["session_id"] = f"replay-{record['session']}"
+    return body
+
+
+def send(url, body, disconnect_after=None, timeout=600):
+    """发一个 /chat 请求并读 SSE 流；disconnect_after 秒后主动断开（模拟用户中途关掉页面）"""
+    from urllib.request import Request, urlopen
+
+    req = Request(f"{url}/chat", data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    result = {"ttft": None, "tokens": 0, "disconnected": False, "error": None}
+    try:
+        with urlopen(req, timeout=timeout) as resp:
+            for line in resp:
+                if disconnect_after is not None and time.perf_counter() - start >= disconnect_after:
+                    result["disconnected"] = True
+                    break
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[6:])
+                if "token" in data:
+                    if result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - start
+                    result["tokens"] += 1
+                if data.get("done"):
+                    break
+    except Exception as e:
+        result["error"] = str(e)
+    result["total"] = time.perf_counter() - start
+    return result
+
+
+def replay(url, records, speed=1.0, seed=0, log=print):
+    """
+    按抓包里的到达间隔回放（speed=2 表示间隔缩短一半、压力翻倍），每个请求一个线程，
+    并发情况和线上一致；客户端断开的时间点原样保留（用户的耐心不随回放速度变化）
+    """
+    rnd = random.Random(seed)
+    plan, offset = [], 0.0
+    for i, record in enumerate(records):
+        if i > 0:
+            offset += (record.get("gap") or 0) / speed
+        plan.append((offset, build_request(record, rnd), record.get("disconnect_after")))
+
+    results = [None] * len(plan)
+    threads = []
+    start = time.perf_counter()
+
+    def run(i, scheduled, body, disconnect_after):
+        result = send(url, body, disconnect_after)
+        result["lag"] = round(time.perf_counter() - start - scheduled - result["total"], 3)
+        results[i] = result
+
+    for i, (scheduled, body, disconnect_after) in enumerate(plan):
+        delay = scheduled - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=run, args=(i, scheduled, body, disconnect_after), daemon=True)
+        thread.start()
+        threads.append(thread)
+        if log and (i + 1) % 50 == 0:
+            log(f"  已发出 {i + 1}/{len(plan)} 个请求（{time.perf_counter() - start:.1f}s）")
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    def pct(values, p):
+        values = sorted(values)
+        return round(values[min(int(len(values) * p), len(values) - 1)], 3) if values else None
+
+    ok = [r for r in results if r["error"] is None]
+    ttft = [r["ttft"] for r in ok if r["ttft"] is not None]
+    total = [r["total"] for r in ok if not r["disconnected"]]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "disconnected": sum(r["disconnected"] for r in ok),
+        "seconds": round(elapsed, 1),
+        "requests_per_s": round(len(results) / elapsed, 2) if elapsed else None,
+        "tokens_per_s": round(sum(r["tokens"] for r in ok) / elapsed, 1) if elapsed else None,
+        "ttft": {p: pct(ttft, q) for p, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+        "total": {p: pct(total, q) for p, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+        "send_lag_p99": pct([r["lag"] for r in results], 0.99),  # 回放端自己有没有跟上计划的发送时间
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="按抓到的线上流量形状回放 /chat 请求，统计延迟分布")
+    parser.add_argument("trace", help="AI_CAPTURE_PATH 写出的 jsonl 文件")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，2 表示请求间隔缩短一半")
+    parser.add_argument("--limit", type=int, help="只回放前 N 个请求")
+    parser.add_argument("--out", help="把汇总结果写成 JSON")
+    args = parser.parse_args()
+
+    records = load_trace(args.trace, args.limit)
+    span = records[-1]["arrival"] - records[0]["arrival"] if records else 0
+    print(f"回放 {len(records)} 个请求（原始时长 {span:.0f}s，{args.speed}x 速度）-> {args.url}")
+    results, elapsed = replay(args.url, records, args.speed)
+    summary = summarize(results, elapsed)
+    print(f"✅ 完成：{summary['requests']} 个请求，失败 {summary['errors']}，中途断开 {summary['disconnected']}，"
+          f"用时 {summary['seconds']}s，{summary['tokens_per_s']} tokens/s")
+    print(f"   TTFT  p50 {summary['ttft']['p50']}s  p90 {summary['ttft']['p90']}s  p99 {summary['ttft']['p99']}s")
+    print(f"   总耗时 p50 {summary['total']['p50']}s  p90 {summary['total']['p90']}s  p99 {summary['total']['p99']}s")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"speed": args.speed, "summary": summary, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"📁 已保存至 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
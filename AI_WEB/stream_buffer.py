@@ -0,0 +1,111 @@
+import itertools
+import threading
+import time
+import uuid
+
+
+class StreamBuffer:
+    """
+    一次生成的输出缓冲：后台线程把生成器产出的文字片段依次存下来，
+    任意多个读者（第一次连接、断线重连）都可以从某个序号开始读，直到生成结束
+    """
+
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.abandoned = False              # 没人读被中途取消，输出不完整
+        self.readers = 0
+        self.last_seen = time.monotonic()   # 最近一次有读者在读的时间
+        self.finished_at = None
+        self._cond = threading.Condition()
+
+    def _produce(self, stream, abandon_after):
+        try:
+            for chunk in stream:
+                with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+                    # 客户端断开太久一直没回来，就停止生成（close 会让引擎取消这个请求）
+                    abandoned = not self.readers and time.monotonic() - self.last_seen > abandon_after
+                if abandoned:
+                    self.abandoned = True
+                    stream.close()
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.done = True
+                self.finished_at = time.monotonic()
+                self._cond.notify_all()
+
+    def read(self, start=0, timeout=1.0):
+        """从第 start 个片段开始，逐个返回 (序号, 片段)，直到生成结束"""
+        with self._cond:
+            self.readers += 1
+        try:
+            index = start
+            while True:
+                with self._cond:
+                    while index >= len(self.chunks) and not self.done:
+                        self._cond.wait(timeout)
+                    self.last_seen = time.monotonic()
+                    if index >= len(self.chunks):
+                        return
+                    chunk = self.chunks[index]
+                yield index, chunk
+                index += 1
+        finally:
+            with self._cond:
+                self.readers -= 1
+                self.last_seen = time.monotonic()
+
+
+class StreamRegistry:
+    """
+    所有进行中/刚结束的生成，按 stream_id 查找
+    - 生成在后台线程里跑，和 HTTP 连接脱钩：连接断了生成照常继续，重连后从 Last-Event-ID 接着读
+    - 结束的缓冲保留 ttl 秒供重连；断线超过 abandon_after 秒没人回来就取消生成
+    """
+
+    def __init__(self, ttl=120, abandon_after=30):
+        self.ttl = ttl
+        self.abandon_after = abandon_after
+        self.buffers = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    def start(self, stream):
+        self.cleanup()
+        buffer = StreamBuffer(uuid.uuid4().hex)
+        with self._lock:
+            self.buffers[buffer.stream_id] = buffer
+        thread = threading.Thread(target=buffer._produce, args=(stream, self.abandon_after),
+                                  name=f"sse-stream-{next(self._counter)}", daemon=True)
+        thread.start()
+        return buffer
+
+    def get(self, stream_id):
+        with self._lock:
+            return self.buffers.get(stream_id)
+
+    def cleanup(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, b in self.buffers.items()
+                       if b.done and not b.readers and now - b.finished_at > self.ttl]
+            for sid in expired:
+                del self.buffers[sid]
+
+    def stats(self):
+        with self._lock:
+            buffers = list(self.buffers.values())
+        return {
+            "streams": len(buffers),
+            "running": sum(not b.done for b in buffers),
+            "abandoned": sum(b.abandoned for b in buffers),
+            "readers": sum(b.readers for b in buffers),
+            "buffered_chunks": sum(len(b.chunks) for b in buffers),
+        }
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from chatbot_logic import SuperChatbot
+from model_registry import ModelRegistry
+from long_term_memory import MemoryStore
+from test_engine import tiny_model_and_tokenizer
+
+
+def make_bot():
+    model, tokenizer = tiny_model_and_tokenizer()
+    tokenizer.chat_template = "{% for m in messages %}{{ m['role'] }} {{ m['content'] }} {% endfor %}"
+
+    class TinyModel:
+        @classmethod
+        def from_pretrained(cls, model_id, **kwargs):
+            return model
+
+    registry = ModelRegistry().register("tiny", "tiny", model_cls=TinyModel)
+    registry.entries["tiny"].tokenizer = tokenizer
+    return SuperChatbot("tiny", registry=registry, memory=MemoryStore(window=2, top_k=1), kv_cache_mb=4)
+
+
+def test_final_message_reuses_draft_retrieval():
+    """草稿和正式发送的问题检索到的旧对话不同时，沿用草稿的检索结果，预先 prefill 的前缀才能命中"""
+    bot = make_bot()
+    try:
+        history = []
+        for i in range(20):
+            history += [{"role": "user", "content": f"t{10 + i} " * 10}, {"role": "assistant", "content": f"t{50 + i}"}]
+        # 草稿检索到第 2 轮（t12），写完的问题更像第 15 轮（t25）
+        assert bot.draft("t12", history, session_id="s") > 0
+        while bot.drafts["s"].queue.get() is not None:
+            pass
+        list(bot.chat_stream("t12 t25 t25 t25", history, session_id="s", max_new_tokens=2))
+        assert bot.engine.prefix_hit_tokens >= 32
+        assert not bot.memory.latency  # 草稿的检索不计入延迟统计
+    finally:
+        bot.engine.shutdown()
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from engine import BULK, GenerationEngine
+from vocab_prune import PrunedHead
+
+VOCAB = 100
+
+
+def tiny_model_and_tokenizer():
+    """随机初始化的小 Qwen2 和一个按空格切词的词表（t0 ... t99），不需要下载任何东西"""
+    vocab = {f"t{i}": i for i in range(VOCAB)}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="t0"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="t1")
+    torch.manual_seed(0)
+    config = Qwen2Config(vocab_size=VOCAB, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+                         eos_token_id=1)
+    return Qwen2ForCausalLM(config).eval(), tokenizer
+
+
+def run(engine, prompt_ids, max_new_tokens=4):
+    seq = engine.submit(prompt_ids, max_new_tokens=max_new_tokens, do_sample=False)
+    while seq.queue.get() is not None:
+        pass
+    return seq
+
+
+def test_vocab_fallback_with_prefix_hit():
+    """prompt 命中前缀缓存时，词表外的 token 仍然要让这个请求退回完整输出层"""
+    model, tokenizer = tiny_model_and_tokenizer()
+    head = PrunedHead(model.get_output_embeddings(), range(2, 50))
+    engine = GenerationEngine(model, tokenizer, prefill_chunk_size=16, kv_cache_mb=4, block_size=16,
+                              vocab_head=head)
+    try:
+        shared = [2 + i % 40 for i in range(40)]
+        first = run(engine, shared)
+        assert "full" not in first.head_state
+
+        second = run(engine, shared[:32] + [90, 91, 92])
+        assert engine.prefix_hit_tokens >= 32
+        assert second.head_state.get("full")
+        assert head.fallbacks == 1
+    finally:
+        engine.shutdown()
+
+
+def test_preempted_kv_is_written_to_disk_outside_the_lock(tmp_path, monkeypatch):
+    """被抢占的批量任务 KV 写盘时不拿着 _cond（submit/cancel 不用等磁盘），换回来后输出不变"""
+    model, tokenizer = tiny_model_and_tokenizer()
+    prompt = [2 + i % 40 for i in range(40)]
+    kwargs = dict(prefill_chunk_size=16, kv_cache_mb=4, block_size=16, max_running=1, swap_host_mb=0,
+                  swap_dir=str(tmp_path))
+    engine = GenerationEngine(model, tokenizer, **kwargs)
+    try:
+        expected = run(engine, prompt, max_new_tokens=40).output_ids
+    finally:
+        engine.shutdown()
+
+    engine = GenerationEngine(model, tokenizer, **kwargs)
+    saves = []
+    real_save = torch.save
+    monkeypatch.setattr(torch, "save", lambda *a, **k: (saves.append(engine._cond._is_owned()), real_save(*a, **k)))
+    try:
+        bulk = engine.submit(prompt, max_new_tokens=40, do_sample=False, priority=BULK)
+        assert bulk.queue.get() is not None  # 批量任务已经在 decode
+        run(engine, [5, 6, 7])
+        while bulk.queue.get() is not None:
+            pass
+        assert engine.preemptions == 1
+        assert saves == [False]
+        assert bulk.output_ids == expected
+        assert engine.swapped_bytes == {"host": 0, "disk": 0} and not list(tmp_path.iterdir())
+    finally:
+        engine.shutdown()
@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AI_Model"))
+from hot_reload import HotReloader
+from model_registry import ModelRegistry
+from model_router import ModelRouter
+
+
+class SlowModel(torch.nn.Linear):
+    delay = 0.0
+
+    @classmethod
+    def from_pretrained(cls, model_id, **kwargs):
+        time.sleep(cls.delay)
+        return cls(4, 4)
+
+
+class FakeBot:
+    """只实现 HotReloader 和路由器用到的部分"""
+
+    def __init__(self, registry, name, lazy=True, **kwargs):
+        self.registry, self.name, self.vocab_path = registry, name, None
+        self.torch_dtype = kwargs.get("torch_dtype", torch.float32)
+        self.engine_kwargs = {"kv_cache_mb": 1}
+        registry.register(name, name, model_cls=SlowModel, size_mb=1)
+        registry.entries[name].tokenizer = object()
+        registry.on_evict(name, lambda n: None)
+
+    def _ensure_engine(self, model, tokenizer):
+        pass
+
+    def chat_stream(self, message, history, *args, **kwargs):
+        with self.registry.use(self.name):
+            yield "ok"
+
+
+def test_reload_does_not_block_old_model():
+    registry = ModelRegistry()
+    old = FakeBot(registry, "old", torch_dtype=torch.bfloat16)
+    registry.get("old")
+    router = ModelRouter({"0.5B": old})
+    reloader = HotReloader(router, registry, lambda model_id, **kwargs: FakeBot(registry, **kwargs), poll=0.05)
+
+    SlowModel.delay = 1.0
+    started, status = reloader.start("0.5B", "new")
+    assert started, status
+    time.sleep(0.1)
+    start = time.perf_counter()
+    assert list(router.chat_stream("你好", [])) == ["ok"]
+    assert time.perf_counter() - start < 0.5
+    assert router.tiers["0.5B"] is old
+
+    reloader._thread.join()
+    assert reloader.status()["state"] == "done"
+    assert router.tiers["0.5B"].name == "new"
+    assert router.tiers["0.5B"].torch_dtype is torch.bfloat16  # 没指定就沿用旧模型的精度
+    assert "old" not in registry.entries
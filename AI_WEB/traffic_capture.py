@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+
+class TrafficCapture:
+    """
+    记录线上 /chat 流量的“形状”（默认关闭，设置 AI_CAPTURE_PATH 开启），给 replay.py 回放做容量规划
+    - 只记长度和时间，不记任何对话内容；session_id 加盐哈希，只保留“哪些请求属于同一会话”
+    - 每个请求结束（或客户端断开）时写一行 JSON：距上一个请求的间隔、历史条数/字数、prompt token 数、
+      输出片段数、耗时，以及客户端在第几秒断开
+    """
+
+    def __init__(self, path, sample_rate=1.0, tokenizer=None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.tokenizer = tokenizer          # 有分词器时记录准确的 token 数，否则只记字数
+        self.salt = os.urandom(8).hex()     # 每次启动换一个盐，不同抓包之间的会话不能关联
+        self.last_arrival = None
+        self.captured = 0
+        self._lock = threading.Lock()
+
+    def _count_tokens(self, texts):
+        if self.tokenizer is None:
+            return None
+        return sum(len(self.tokenizer(t)["input_ids"]) for t in texts)
+
+    def start(self, data):
+        """请求到达时调用，返回这条记录（没被采样到返回 None）"""
+        now = time.time()
+        with self._lock:
+            gap = None if self.last_arrival is None else now - self.last_arrival
+            self.last_arrival = now
+        if random.random() >= self.sample_rate:
+            return None
+
+        message = data.get('message', '')
+        history = data.get('history', [])
+        session_id = data.get('session_id')
+        return {
+            "arrival": round(now, 3),
+            "gap": None if gap is None else round(gap, 3),
+            "session": hashlib.sha1(f"{self.salt}:{session_id}".encode()).hexdigest()[:12] if session_id else None,
+            "mode": data.get('mode', 'assistant'),
+            "message_chars": len(message),
+            "history_messages": len(history),
+            "history_chars": sum(len(m.get("content", "")) for m in history),
+            "prompt_tokens": self._count_tokens([message] + [m.get("content", "") for m in history]),
+        }
+
+    def wrap(self, stream, record):
+        """包住发给客户端的 SSE 流：正常结束记耗时，被客户端中途断开则记下断开的时间"""
+        if record is None:
+            yield from stream
+            return
+        start = time.perf_counter()
+        chunks = 0
+        completed = False
+        try:
+            for item in stream:
+                chunks += 1
+                if record.get("ttft") is None and '"token"' in item:
+                    record["ttft"] = round(time.perf_counter() - start, 3)
+                yield item
+            completed = True
+        finally:
+            elapsed = round(time.perf_counter() - start, 3)
+            record.update(events=chunks, seconds=elapsed, disconnect_after=None if completed else elapsed)
+            self._write(record)
+
+    def _write(self, record):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.captured += 1
+
+    def stats(self):
+        return {"path": self.path, "sample_rate": self.sample_rate, "captured": self.captured}
@@ -0,0 +1,264 @@
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(ROOT, "benchmark_baseline.json")
+sys.path.append(os.path.join(ROOT, "AI_Model"))
+sys.path.append(os.path.join(ROOT, "AI_Test"))
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{{ '<|im_start|>' + message['role'] + '\n' + message['content'] + '<|im_end|>' + '\n' }}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}{{ '<|im_start|>assistant\n' }}{% endif %}"
+)
+CORPUS = [
+    "你好，我是一个人工智能助手，很高兴为您服务。",
+    "夜色渐深，长安城的灯火一盏盏熄灭。李白独自坐在酒肆的角落里，望着窗外的月亮。",
+    "请帮我查一下北京明天的天气，会不会下雨？",
+    "写一个 Python 函数，计算斐波那契数列的第 n 项。",
+    "The quick brown fox jumps over the lazy dog. Hello world!",
+]
+
+
+def load_module(name, path):
+    """按文件路径导入（AI_Model 和 AI_Test 里都有 a2.py / a3.py，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_tiny_model(vocab_size=2000, seed=0):
+    """离线构造一个很小的 Qwen2 结构模型和字节级 BPE 分词器（随机权重，只用来测速度）"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    special = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=special,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    bpe.train_from_iterator(CORPUS * 20, trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe, eos_token="<|im_end|>", pad_token="<|endoftext|>")
+    tokenizer.chat_template = CHAT_TEMPLATE
+
+    torch.manual_seed(seed)
+    config = Qwen2Config(
+        vocab_size=len(tokenizer), hidden_size=128, intermediate_size=352, num_hidden_layers=4,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096,
+        tie_word_embeddings=True,
+    )
+    model = Qwen2ForCausalLM(config).eval()
+    return model, tokenizer
+
+
+def measure(fn, reset=None, cycle=1, repeat=9, min_seconds=0.2):
+    """
+    返回 (每次调用的耗时中位数（微秒）, 相对波动)
+    - 先自动确定循环次数（cycle 的整数倍），让每轮至少跑 min_seconds；每轮开始前调用 reset，
+      轮流跑一组输入的项目每轮都从头重放同样的几整组，各轮之间可比
+    - 计时期间关掉 gc（同 timeit），去掉最快和最慢各一轮后，用剩下的极差 / 中位数作为波动
+    """
+    def run(loops):
+        if reset is not None:
+            reset()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            return time.perf_counter() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    run(cycle)
+    loops = cycle
+    while run(loops) < min_seconds:
+        loops *= 2
+    samples = sorted(run(loops) / loops * 1e6 for _ in range(repeat))
+    median = samples[len(samples) // 2]
+    return median, (samples[-2] - samples[1]) / median
+
+
+# ==================== 各个热点组件 ====================
+
+def collect_benchmarks():
+    """返回 {名字: (fn, reset, cycle)}：fn 执行一次被测操作；轮流跑一组输入的项目，
+    reset 把状态恢复到第一组开头，cycle 是一整组的调用次数"""
+    from transformers import DynamicCache
+    from incremental_streamer import IncrementalDetokenizer
+    from sampling import sample_next_token
+
+    model, tokenizer = build_tiny_model()
+    benches = {}
+
+    def add(name, fn, reset=None, cycle=1):
+        benches[name] = (fn, reset, cycle)
+
+    # 1. 聊天模板 + 分词
+    messages = [{"role": "system", "content": "你是一个简明扼要、专业的 AI 助手。"}]
+    for text in CORPUS[:4]:
+        messages += [{"role": "user", "content": text}, {"role": "assistant", "content": text[::-1]}]
+
+    def chat_template():
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        tokenizer(text)["input_ids"]
+    add("chat_template+tokenize", chat_template)
+
+    # 2. 不同长度的 prefill
+    for length in (32, 256, 1024):
+        ids = torch.randint(3, len(tokenizer), (1, length))
+
+        def prefill(ids=ids):
+            with torch.inference_mode():
+                model(input_ids=ids, past_key_values=DynamicCache(), use_cache=True, logits_to_keep=1)
+        add(f"prefill_{length}", prefill)
+
+    # 3. 单步 decode（KV 缓存里已有 256 个 token，每次算完再裁掉，长度保持不变）
+    cache = DynamicCache()
+    with torch.inference_mode():
+        model(input_ids=torch.randint(3, len(tokenizer), (1, 256)), past_key_values=cache, use_cache=True)
+    step_input = torch.tensor([[5]])
+
+    def decode_step():
+        with torch.inference_mode():
+            model(input_ids=step_input, past_key_values=cache, use_cache=True, logits_to_keep=1)
+        cache.crop(-1)
+    add("decode_step_ctx256", decode_step)
+
+    # 4. 采样（用 Qwen2.5 的真实词表大小，排序开销才有代表性）
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn(151936, generator=generator)
+    prev_ids = torch.randint(0, 151936, (300,), generator=generator).tolist()
+
+    def sampling():
+        sample_next_token(logits.clone(), prev_ids, do_sample=True, temperature=0.7, top_p=0.8,
+                          repetition_penalty=1.1, generator=generator)
+    add("sample_top_p_151k", sampling)
+
+    # 5. 流式增量解码（每次调用 = 一个 token）
+    stream_ids = tokenizer(CORPUS[1] * 20)["input_ids"]
+    state = {}
+
+    def detokenize_reset():
+        state.update(detok=IncrementalDetokenizer(tokenizer, skip_special_tokens=True), pos=0)
+
+    def detokenize():
+        if state["pos"] == len(stream_ids):
+            detokenize_reset()
+        state["detok"].add([stream_ids[state["pos"]]])
+        state["pos"] += 1
+    add("detokenize_per_token", detokenize, detokenize_reset, len(stream_ids))
+
+    # 6. 规则意图分类（正则命中 + n-gram 兜底各一半）
+    a2 = load_module("ai_test_a2", os.path.join(ROOT, "AI_Test", "a2.py"))
+    classifier = a2.IntentClassifier()
+    queries = ["你好呀", "这个多少钱", "明天会下雨吗", "帮我订一张去广州的机票", "你们几点下班", "谢谢，没别的了"]
+    counter = {"i": 0}
+
+    def classify():
+        classifier.classify_intent(queries[counter["i"] % len(queries)])
+        counter["i"] += 1
+    add("intent_classify", classify, lambda: counter.update(i=0), len(queries))
+
+    # 7. 多轮对话机器人（问天气 -> 报城市 -> 得到结果，多个会话轮流）；
+    # 每轮换一个新的机器人，会话历史不会越跑越长
+    a3 = load_module("ai_test_a3", os.path.join(ROOT, "AI_Test", "a3.py"))
+    script = ["你好", "我想查天气", "北京", "上海的天气怎么样", "谢谢，再见"]
+    turn = {}
+
+    def respond():
+        i = turn["i"]
+        turn["chatbot"].respond(script[i % len(script)], session_id=f"bench-{i // len(script) % 100}")
+        turn["i"] += 1
+    add("multiturn_respond", respond, lambda: turn.update(chatbot=a3.MultiTurnChatbot(), i=0), len(script))
+
+    return benches
+
+
+# ==================== 与基线比较 ====================
+
+def machine_info():
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理热点组件的微基准测试")
+    parser.add_argument("filters", nargs="*", help="只跑名字里包含这些字符串的项目")
+    parser.add_argument("--update-baseline", action="store_true", help="把这次结果写成新的基线")
+    parser.add_argument("--runs", type=int, default=None,
+                        help="每个项目完整测几遍（默认比较时 1 遍，更新基线时 3 遍，几遍之间的差异也算进波动）")
+    parser.add_argument("--threshold", type=float, default=0.15, help="退化阈值的下限（比基线慢超过这个比例才可能算退化）")
+    parser.add_argument("--spread-factor", type=float, default=3.0,
+                        help="每个项目的阈值 = max(下限, 这个倍数 x 该项目测得的波动)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+    runs = args.runs or (3 if args.update_baseline else 1)
+
+    # 单线程跑，结果更稳定，也和线上的 CPU 部署一致
+    torch.set_num_threads(1)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        if saved.get("machine") != machine_info():
+            print(f"⚠️ 基线来自另一台机器/环境 ({saved.get('machine')})，比较结果仅供参考；"
+                  f"可以用 --update-baseline 在本机重新生成")
+
+    results, regressions = {}, []
+    print(f"{'项目':<26}{'当前(µs)':>12}{'波动':>7}{'基线(µs)':>12}{'变化':>9}{'阈值':>7}")
+    for name, (fn, reset, cycle) in collect_benchmarks().items():
+        if args.filters and not any(f in name for f in args.filters):
+            continue
+        measured = [measure(fn, reset, cycle) for _ in range(runs)]
+        medians = sorted(m for m, _ in measured)
+        median = medians[len(medians) // 2]
+        # 波动：一遍之内各轮的差异，和几遍之间中位数的差异，取较大的
+        spread = max(max(sp for _, sp in measured), (medians[-1] - medians[0]) / median)
+        results[name] = {"us": round(median, 2), "spread": round(spread, 3)}
+
+        base = baseline.get(name)
+        if base:
+            threshold = max(args.threshold, args.spread_factor * max(base["spread"], spread))
+            change = median / base["us"] - 1
+            flag = "❌" if change > threshold else ("🚀" if change < -threshold else "✅")
+            if change > threshold:
+                regressions.append(name)
+            print(f"{name:<26}{median:>12.1f}{spread:>7.0%}{base['us']:>12.1f}{change:>+8.0%} {flag}{threshold:>6.0%}")
+        else:
+            print(f"{name:<26}{median:>12.1f}{spread:>7.0%}{'-':>12}")
+
+    if args.update_baseline:
+        merged = {**baseline, **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine_info(), "results": merged}, f, ensure_ascii=False, indent=2)
+        print(f"✅ 基线已更新: {args.baseline}")
+        return
+
+    if regressions:
+        print(f"❌ 性能退化超过各自的阈值: {', '.join(regressions)}")
+        sys.exit(1)
+    print("✅ 没有发现性能退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,13 @@ import sys
 
 def install_packages():
     packages = [
-        "transformers>=4.35.0",
+        "transformers>=4.56.0",  # 引擎用到 logits_to_keep 和按层拆分的 Cache 接口（分页 KV 缓存）
         "torch>=2.0.0",
         "sentencepiece",
         "protobuf",
         "accelerate",  # 加速推理
-        "bitsandbytes"  # 量化支持，减少内存使用
+        "bitsandbytes",  # 量化支持，减少内存使用
+        "numpy"  # AI_Test 里的 n-gram 意图分类器
     ]
     
     for package in packages: